@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from django.core.exceptions import ImproperlyConfigured
 from decouple import config, Csv
 import os
 import re
@@ -67,6 +68,89 @@ GOOGLE_MAPS_API_KEY = config('GOOGLE_MAPS_API_KEY', default='chave_nao_configura
 # Weather API Key
 WEATHER_API_KEY = os.environ.get('WEATHER_API_KEY')
 
+# --- COTAÇÕES DE MOEDA ---
+# Intervalo (segundos) entre atualizações do comando 'refresh_rates' e variação aleatória (jitter)
+EXCHANGE_RATES_REFRESH_INTERVAL = config('EXCHANGE_RATES_REFRESH_INTERVAL', default=900, cast=int)
+EXCHANGE_RATES_REFRESH_JITTER = config('EXCHANGE_RATES_REFRESH_JITTER', default=60, cast=int)
+# Espera máxima (segundos) entre tentativas quando a API estiver fora do ar
+EXCHANGE_RATES_MAX_BACKOFF = config('EXCHANGE_RATES_MAX_BACKOFF', default=3600, cast=int)
+# Se False, os requests NUNCA chamam a API de cotações (só cache/banco).
+# Desligue quando o comando 'refresh_rates' estiver rodando em segundo plano.
+EXCHANGE_RATES_FETCH_ON_REQUEST = config('EXCHANGE_RATES_FETCH_ON_REQUEST', default=True, cast=bool)
+
+# --- PREVISÃO DO TEMPO ---
+# Intervalo (segundos) entre execuções do comando 'prefetch_weather' e quantos dias à frente buscar
+WEATHER_PREFETCH_INTERVAL = config('WEATHER_PREFETCH_INTERVAL', default=3600, cast=int)
+WEATHER_PREFETCH_DAYS = config('WEATHER_PREFETCH_DAYS', default=14, cast=int)
+# Se False, as páginas da viagem só leem previsões salvas (nunca chamam a WeatherAPI).
+# Desligue quando o comando 'prefetch_weather' estiver rodando em segundo plano.
+WEATHER_FETCH_ON_REQUEST = config('WEATHER_FETCH_ON_REQUEST', default=True, cast=bool)
+# Chamadas simultâneas à WeatherAPI ao resolver o clima de vários itens de uma vez
+WEATHER_FETCH_THREADS = config('WEATHER_FETCH_THREADS', default=8, cast=int)
+
+# --- GEOCODING (FILA EM SEGUNDO PLANO) ---
+# Se True, salvar um item com endereço novo NÃO chama o Google: o item fica 'PENDING'
+# e o comando 'geocode_worker' preenche as coordenadas. Sem worker rodando, use False.
+GEOCODE_ASYNC = config('GEOCODE_ASYNC', default=True, cast=bool)
+# Itens por lote, requisições simultâneas ao Google e espera (segundos) quando a fila está vazia
+GEOCODE_WORKER_BATCH_SIZE = config('GEOCODE_WORKER_BATCH_SIZE', default=50, cast=int)
+GEOCODE_WORKER_THREADS = config('GEOCODE_WORKER_THREADS', default=4, cast=int)
+GEOCODE_WORKER_IDLE_SLEEP = config('GEOCODE_WORKER_IDLE_SLEEP', default=5, cast=int)
+# Tentativas (erros de rede/API) antes de marcar o item como 'FAILED'
+GEOCODE_MAX_ATTEMPTS = config('GEOCODE_MAX_ATTEMPTS', default=5, cast=int)
+# Segundos que um item pode ficar reservado ('PROCESSING') por um worker antes de voltar
+# para a fila (worker que caiu no meio do lote)
+GEOCODE_CLAIM_TIMEOUT = config('GEOCODE_CLAIM_TIMEOUT', default=300, cast=int)
+
+# --- PDFs (ROTEIRO E CHECKLIST) ---
+# Gerados em segundo plano e guardados em PDF_CACHE_ROOT (um arquivo por versão da viagem).
+# A pasta fica FORA do MEDIA_ROOT: o /media/ é servido sem login e os PDFs só saem pelas views.
+# PDF_ASYNC=False gera no próprio request (útil em desenvolvimento).
+PDF_ASYNC = config('PDF_ASYNC', default=True, cast=bool)
+PDF_CACHE_ROOT = config('PDF_CACHE_ROOT', default=os.path.join(BASE_DIR, 'private', 'pdf_cache'))
+# A conversão roda num pool de processos: PDF_RENDER_PROCESSES=0 usa um por núcleo.
+# PDF_RENDER_QUEUE_SIZE limita os PDFs pendentes (acima disso a exportação em lote responde 503)
+# e PDF_RENDER_TIMEOUT é o tempo máximo (segundos) de uma geração.
+PDF_RENDER_PROCESSES = config('PDF_RENDER_PROCESSES', default=0, cast=int)
+PDF_RENDER_QUEUE_SIZE = config('PDF_RENDER_QUEUE_SIZE', default=16, cast=int)
+PDF_RENDER_TIMEOUT = config('PDF_RENDER_TIMEOUT', default=120, cast=int)
+
+# --- FEEDS DE AGENDA (.ICS POR LINK COM TOKEN) ---
+# O .ics pronto fica no cache e é descartado quando itens/viagem mudam (signals);
+# este é só o tempo máximo (segundos) que um feed ou token fica guardado.
+ICS_FEED_CACHE_TIMEOUT = config('ICS_FEED_CACHE_TIMEOUT', default=21600, cast=int)
+
+# --- ORÇAMENTO DE QUERIES POR REQUEST (core.middleware.QueryBudgetMiddleware) ---
+# Requests acima de N queries ou X ms de banco geram um WARNING no log ('[QUERY BUDGET]', logger core.middleware)
+QUERY_BUDGET_ENABLED = config('QUERY_BUDGET_ENABLED', default=True, cast=bool)
+QUERY_BUDGET_MAX_QUERIES = config('QUERY_BUDGET_MAX_QUERIES', default=30, cast=int)
+QUERY_BUDGET_MAX_DB_MS = config('QUERY_BUDGET_MAX_DB_MS', default=300, cast=int)
+
+# --- LOGS ---
+# Falhas de APIs externas (cotações, clima, Geocoding), PDFs e o orçamento de queries
+# vão para os loggers 'core.*' (stdout do container, com nível). LOG_LEVEL=DEBUG/INFO/WARNING...
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'core': {
+            'handlers': ['console'],
+            'level': config('LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# --- MÉTRICAS (endpoint /metrics no formato do Prometheus) ---
+# Token exigido pelo scrape ('Authorization: Bearer <token>'). Vazio: só superusuários logados.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
@@ -120,6 +204,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.RequestMetricsMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -158,8 +244,37 @@ if os.environ.get('SQL_DATABASE') and os.environ.get('SQL_HOST'):
             'PASSWORD': os.environ.get('SQL_PASSWORD'),
             'HOST': os.environ.get('SQL_HOST'),
             'PORT': os.environ.get('SQL_PORT', '5432'),
+            # Conexões persistentes: cada worker reaproveita a conexão entre requests
+            # por até SQL_CONN_MAX_AGE segundos (0 = abre e fecha uma conexão por request)
+            'CONN_MAX_AGE': config('SQL_CONN_MAX_AGE', default=60, cast=int),
+            # Testa a conexão reaproveitada antes de usar (Postgres reiniciado, timeout de rede...)
+            'CONN_HEALTH_CHECKS': config('SQL_CONN_HEALTH_CHECKS', default=True, cast=bool),
         }
     }
+
+    # Pool de conexões do psycopg 3 (pacote psycopg[pool]); substitui as conexões persistentes
+    if config('SQL_POOL', default=False, cast=bool):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': config('SQL_POOL_MIN_SIZE', default=2, cast=int),
+                'max_size': config('SQL_POOL_MAX_SIZE', default=10, cast=int),
+                'timeout': config('SQL_POOL_TIMEOUT', default=10, cast=int),
+            }
+        }
+
+    # Réplica somente leitura (opcional): usada pelas views marcadas com @read_replica.
+    # Usuário, senha, banco e porta são os do principal, a menos que informados.
+    if os.environ.get('SQL_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.environ.get('SQL_REPLICA_HOST'),
+            'PORT': os.environ.get('SQL_REPLICA_PORT', DATABASES['default']['PORT']),
+            'NAME': os.environ.get('SQL_REPLICA_DATABASE', DATABASES['default']['NAME']),
+            'USER': os.environ.get('SQL_REPLICA_USER', DATABASES['default']['USER']),
+            'PASSWORD': os.environ.get('SQL_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+            'TEST': {'MIRROR': 'default'},
+        }
 else:
     # Fallback apenas para desenvolvimento local fora do Docker
     print("⚠️  AVISO: Usando SQLite local (Variáveis de ambiente do Postgres não encontradas)")
@@ -170,6 +285,41 @@ else:
         }
     }
 
+# Direciona as leituras das views @read_replica para a réplica (se existir)
+DATABASE_ROUTERS = ['core.db_routers.ReadReplicaRouter']
+
+# --- CACHE COMPARTILHADO ---
+# Cotações, geocodes e previsões ficam no cache. Com 'locmem' (padrão) cada processo tem o seu
+# e tudo se perde ao reiniciar; em produção use um cache compartilhado entre web e workers:
+#   CACHE_BACKEND=db         -> tabela no próprio banco (rode 'python manage.py createcachetable')
+#   CACHE_BACKEND=redis      -> CACHE_LOCATION=redis://host:6379/1
+#   CACHE_BACKEND=memcached  -> CACHE_LOCATION=host:11211
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'travel-manager'),
+    'db': ('django.core.cache.backends.db.DatabaseCache', 'travel_cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://localhost:6379/1'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+}
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem').strip().lower()
+if CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ImproperlyConfigured(
+        f"CACHE_BACKEND inválido: '{CACHE_BACKEND}'. Use um destes: {', '.join(CACHE_BACKENDS)}"
+    )
+
+cache_engine, cache_default_location = CACHE_BACKENDS[CACHE_BACKEND]
+CACHES = {
+    'default': {
+        'BACKEND': cache_engine,
+        'LOCATION': config('CACHE_LOCATION', default='') or cache_default_location,
+        # Prefixo: permite dividir o mesmo Redis/Memcached com outras aplicações (ex: dev e prod)
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='travel'),
+        'TIMEOUT': config('CACHE_DEFAULT_TIMEOUT', default=300, cast=int),
+    }
+}
+if CACHE_BACKEND in ('locmem', 'db'):
+    # O padrão do Django (300 entradas) é pouco para um geocode por endereço
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int)}
+
 
 
 # Password validation
@@ -2,12 +2,11 @@ from django.contrib import admin
 from .models import (
     Trip, TripItem, TripAttachment, Expense, 
     APIConfiguration, Checklist, ChecklistItem, 
-    EmailConfiguration, AccessLog # Adicionados aqui
+    EmailConfiguration, AccessLog, ExchangeRate, GeocodeCache, WeatherForecast # Adicionados aqui
 )
 
 # Registros Simples
 admin.site.register(Trip)
-admin.site.register(TripItem)
 admin.site.register(TripAttachment)
 admin.site.register(Expense)
 admin.site.register(Checklist)
@@ -32,4 +31,43 @@ class AccessLogAdmin(admin.ModelAdmin):
     list_display = ('timestamp', 'user', 'action', 'ip_address')
     list_filter = ('action', 'timestamp')
     search_fields = ('user__username', 'ip_address')
-    readonly_fields = ('timestamp',) # Logs geralmente são apenas leitura
\ No newline at end of file
+    readonly_fields = ('timestamp',) # Logs geralmente são apenas leitura
+
+# --- Registro para Cotações de Moeda ---
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('date', 'currency', 'rate', 'updated_at')
+    list_filter = ('currency',)
+    date_hierarchy = 'date'
+
+# --- Registro para Cache de Geocodificação ---
+@admin.register(GeocodeCache)
+class GeocodeCacheAdmin(admin.ModelAdmin):
+    list_display = ('address_key', 'country_code', 'lat', 'lng', 'updated_at')
+    list_filter = ('country_code',)
+    search_fields = ('address_key', 'formatted_address')
+
+# --- Registro para Itens da Viagem (com reprocessamento de Geocoding) ---
+@admin.register(TripItem)
+class TripItemAdmin(admin.ModelAdmin):
+    list_display = ('name', 'trip', 'item_type', 'start_datetime', 'geocode_status')
+    list_filter = ('item_type', 'geocode_status')
+    search_fields = ('name', 'location_address')
+    actions = ['enqueue_geocoding']
+
+    @admin.action(description="Localizar novamente (fila de Geocoding)")
+    def enqueue_geocoding(self, request, queryset):
+        # Só marca na fila: quem chama o Google é o 'geocode_worker' (sem timeout no admin)
+        count = (
+            queryset.exclude(location_address__isnull=True).exclude(location_address='')
+            .update(location_lat=None, location_lng=None,
+                    geocode_status=TripItem.GEOCODE_PENDING, geocode_attempts=0)
+        )
+        self.message_user(request, f"{count} itens enviados para a fila de Geocoding.")
+
+# --- Registro para Cache de Previsão do Tempo ---
+@admin.register(WeatherForecast)
+class WeatherForecastAdmin(admin.ModelAdmin):
+    list_display = ('location_key', 'date', 'temp', 'condition', 'fetched_at', 'expires_at')
+    date_hierarchy = 'date'
+    search_fields = ('location_key',)
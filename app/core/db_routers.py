@@ -0,0 +1,61 @@
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+
+# Alias do banco réplica (somente leitura), criado em settings quando SQL_REPLICA_HOST está definido
+REPLICA_ALIAS = 'replica'
+
+# Só os dados de negócio vão para a réplica. Sessões, cache em tabela (DatabaseCache), etc.
+# continuam no principal: ler o lock/valor do cache numa réplica atrasada e gravar no
+# principal quebraria o single-flight do cached_call.
+REPLICA_APP_LABELS = {'core', 'auth'}
+
+_use_replica = ContextVar('use_read_replica', default=False)
+
+
+class ReadReplicaRouter:
+    """
+    Leituras vão para a réplica SOMENTE dentro de views marcadas com @read_replica.
+    Todo o resto (escritas, sessão, login, comandos) continua no banco principal.
+    Sem réplica configurada, não interfere em nada.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (_use_replica.get() and REPLICA_ALIAS in settings.DATABASES
+                and model._meta.app_label in REPLICA_APP_LABELS):
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplica e principal têm os mesmos dados
+        if {obj1._state.db, obj2._state.db} <= {'default', REPLICA_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # A réplica recebe as tabelas pela replicação do Postgres, nunca por migrate
+        return db != REPLICA_ALIAS
+
+
+def read_replica(view_func):
+    """
+    Decorator para views somente leitura: as queries feitas durante a view
+    (incluindo a renderização do template) leem da réplica.
+    Atenção: a réplica pode estar alguns instantes atrás do principal;
+    não use em telas que precisam mostrar na hora o que acabou de ser salvo.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        # Sessão e usuário saem do principal (um login recém-feito pode ainda não estar na réplica)
+        user = getattr(request, 'user', None)
+        if user is not None:
+            user.is_authenticated  # força o carregamento (request.user é preguiçoso)
+        token = _use_replica.set(True)
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
@@ -2,7 +2,8 @@ from django import forms
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.forms import PasswordResetForm, PasswordChangeForm
 from .models import Expense, Trip, TripItem, TripAttachment, APIConfiguration, TripCollaborator, TripPhoto, TripNote, EmailConfiguration
-from .utils import get_db_mail_connection
+from .utils import get_db_mail_connection, get_email_settings
+from .metrics import upstream_call
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
@@ -407,12 +408,9 @@ class CustomPasswordResetForm(PasswordResetForm):
         
         # 3. Define o remetente (From)
         if not from_email:
-            try:
-                config = EmailConfiguration.objects.first()
-                if config:
-                    from_email = config.default_from_email
-            except:
-                pass
+            config = get_email_settings()
+            if config:
+                from_email = config.default_from_email
         
         # 4. Loop para encontrar usuários com esse e-mail e enviar a mensagem
         # (Lógica padrão do Django, mas adaptada para usar nossa 'connection')
@@ -452,7 +450,8 @@ class CustomPasswordResetForm(PasswordResetForm):
                 html_email = loader.render_to_string(html_email_template_name, context)
                 email_message.attach_alternative(html_email, 'text/html')
 
-            email_message.send()
+            with upstream_call('smtp'):
+                email_message.send()
 
 # --- FORMULÁRIO DE NOTAS DE VIAGEM ---
 class TripNoteForm(forms.ModelForm):
@@ -0,0 +1,185 @@
+"""
+Exportação dos itens de viagem no formato iCalendar (.ics).
+
+O arquivo é gerado em streaming, item a item (iterator + only), e leva um ETag
+calculado pelo banco: clientes de calendário que consultam a cada poucos minutos
+recebem 304 sem que nenhum item seja lido.
+
+Os feeds de assinatura (URL com token, sem login) guardam o .ics pronto no cache:
+as consultas dos clientes não tocam no banco até um item/viagem mudar (signals).
+"""
+from datetime import timedelta
+import hashlib
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from icalendar import Calendar, Event as ICalEvent
+from .itinerary import clean_item_details
+from .metrics import record_cache
+from .models import CalendarFeedToken, Trip, TripItem
+from .utils import cached_call, make_cache_key
+
+ICS_CONTENT_TYPE = 'text/calendar; charset=utf-8'
+ICS_PRODID = '-//Travel Manager//carlosviola.com//'
+
+# Aumente quando o conteúdo dos eventos mudar: invalida os ETags já entregues aos clientes
+ICS_FORMAT_VERSION = 1
+
+# Campos do TripItem usados nos eventos (only() no streaming)
+ICS_ITEM_FIELDS = (
+    'id', 'trip_id', 'name', 'link', 'details', 'location_address',
+    'start_datetime', 'end_datetime', 'updated_at',
+)
+
+_CALENDAR_END = b'END:VCALENDAR\r\n'
+
+
+def ics_etag(*parts):
+    """ETag (sem aspas; o decorator condition as adiciona) a partir do estado dos itens."""
+    raw = '|'.join(str(part) for part in (ICS_FORMAT_VERSION,) + parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+def items_state(items):
+    """Última alteração e quantidade dos itens (a contagem pega exclusões, que não mudam o Max)."""
+    state = items.aggregate(changed=Max('updated_at'), count=Count('id'))
+    return state['changed'], state['count']
+
+
+def item_to_event(item):
+    event = ICalEvent()
+    # UID estável: o cliente atualiza o mesmo evento em vez de duplicar a cada sincronização
+    event.add('uid', f"tripitem-{item.id}@travelmanager")
+    event.add('summary', f"✈️ {item.name}")
+
+    # Descrição: Junta notas e link
+    description = ""
+    if item.link:
+        description += f"Link: {item.link}\n"
+    notes = clean_item_details(item.details)['notes'] if item.details else ''
+    if notes:
+        description += f"Notas: {notes}"
+    event.add('description', description)
+
+    if item.location_address:
+        event.add('location', item.location_address)
+
+    event.add('dtstart', item.start_datetime)
+    # Data de Fim (Se não tiver, assume 1 hora de duração)
+    event.add('dtend', item.end_datetime or item.start_datetime + timedelta(hours=1))
+    # Data da última alteração (e não "agora"): o mesmo estado gera sempre os mesmos bytes
+    event.add('dtstamp', item.updated_at or item.start_datetime)
+    return event
+
+def stream_ics(items, name):
+    """Gera o .ics em pedaços: cabeçalho, um evento por item e o fechamento."""
+    cal = Calendar()
+    cal.add('prodid', ICS_PRODID)
+    cal.add('version', '2.0')
+    cal.add('x-wr-calname', name)
+    yield cal.to_ical()[:-len(_CALENDAR_END)]
+
+    stream = items.exclude(start_datetime__isnull=True).only(*ICS_ITEM_FIELDS).order_by('start_datetime', 'id')
+    for item in stream.iterator(chunk_size=200):
+        yield item_to_event(item).to_ical()
+
+    yield _CALENDAR_END
+
+
+#-- Feeds de assinatura (URL com token) --#
+def _token_key(token):
+    return make_cache_key('ics_feed_token', token)
+
+def _feed_key(kind, obj_id):
+    return make_cache_key('ics_feed', kind, obj_id)
+
+def resolve_feed_token(token):
+    """
+    (user_id, trip_id ou None) do token, ou None se não existe/não vale mais.
+    Fica em cache (inclusive o "não existe", por pouco tempo, contra tentativas repetidas).
+    """
+    key = _token_key(token)
+    entry = cache.get(key)
+    if entry is not None:
+        record_cache('ics_feed_token', 'hit')
+        return tuple(entry) if entry else None
+
+    record_cache('ics_feed_token', 'miss')
+    feed = CalendarFeedToken.objects.select_related('user').filter(token=token).first()
+    scope = None
+    if feed and feed.user.is_active:
+        if feed.trip_id is None or Trip.objects.visible_to(feed.user).filter(pk=feed.trip_id).exists():
+            scope = (feed.user_id, feed.trip_id)
+
+    cache.set(key, list(scope) if scope else 0,
+              timeout=settings.ICS_FEED_CACHE_TIMEOUT if scope else 60)
+    return scope
+
+def forget_feed_token(token):
+    cache.delete(_token_key(token))
+
+def forget_user_feed_tokens(user_ids):
+    """
+    Descarta o escopo em cache de todos os tokens dos usuários: a próxima consulta ao feed
+    revalida usuário ativo e acesso à viagem (desativação, compartilhamento novo ou removido).
+    """
+    keys = [_token_key(token) for token in
+            CalendarFeedToken.objects.filter(user_id__in=set(user_ids)).values_list('token', flat=True)]
+    if not keys:
+        return
+
+    def drop():
+        cache.delete_many(keys)
+
+    drop()
+    # De novo após o commit, como em invalidate_ics_feeds
+    transaction.on_commit(drop)
+
+def _serialize(items, name):
+    body = b''.join(stream_ics(items, name))
+    return hashlib.sha256(body).hexdigest()[:32], body
+
+def get_feed(token):
+    """(etag, bytes do .ics) do feed do token, servido do cache; None se o token não vale."""
+    scope = resolve_feed_token(token)
+    if scope is None:
+        return None
+    user_id, trip_id = scope
+
+    if trip_id:
+        def load():
+            trip = Trip.objects.get(pk=trip_id)
+            return _serialize(trip.items.all(), trip.title)
+        key = _feed_key('trip', trip_id)
+    else:
+        def load():
+            user = User.objects.get(pk=user_id)
+            trips = Trip.objects.visible_to(user).values('id')
+            return _serialize(TripItem.objects.filter(trip__in=trips), f"Viagens - {user.get_full_name() or user.username}")
+        key = _feed_key('user', user_id)
+
+    return cached_call(key, load, timeout=settings.ICS_FEED_CACHE_TIMEOUT, cache_name='ics_feed')
+
+def invalidate_ics_feeds(trip_id=None, user_ids=()):
+    """
+    Descarta os .ics em cache afetados por uma mudança: o da viagem e os "todas as viagens"
+    do dono e dos colaboradores dela (mais os `user_ids` informados).
+    """
+    user_ids = set(user_ids)
+    if trip_id:
+        # Uma query: uma linha por colaborador (ou uma com None), todas com o dono
+        for owner_id, collaborator_id in Trip.objects.filter(pk=trip_id).values_list('user_id', 'collaborators__user_id'):
+            user_ids.update((owner_id, collaborator_id))
+    user_ids.discard(None)
+
+    keys = [_feed_key('user', user_id) for user_id in user_ids]
+    if trip_id:
+        keys.append(_feed_key('trip', trip_id))
+
+    def drop():
+        cache.delete_many(keys)
+
+    drop()
+    # De novo após o commit: um poll no meio da transação não pode deixar a versão antiga no cache
+    transaction.on_commit(drop)
@@ -0,0 +1,110 @@
+"""
+View-model do roteiro de uma viagem, compartilhado por trip_detail, trip_calendar e o PDF do roteiro.
+
+Tudo sai de um número fixo de queries, independente do tamanho da viagem:
+itens (1) + anexos dos itens (1) + gastos já convertidos para BRL (1), mais a tabela
+de cotações (cache). Datas, totais, moedas e notas são calculados em memória.
+"""
+from collections import namedtuple
+from decimal import Decimal
+import ast
+from django.conf import settings
+from django.utils import timezone
+from .models import TripItem
+from .utils import get_exchange_rate, get_exchange_rates, apply_stored_weather, resolve_trip_weather
+
+Itinerary = namedtuple('Itinerary', 'trip items expenses totals rates available_dates geocode_pending')
+
+CENTS = Decimal('0.01')
+
+
+def clean_item_details(details):
+    """
+    Normaliza o campo `details` do item para {'notes': texto}.
+    Itens antigos/importados podem ter o dict salvo como string (às vezes aninhado).
+    """
+    raw = details
+    if isinstance(raw, str):
+        try:
+            raw = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            pass
+
+    if not isinstance(raw, dict):
+        return {'notes': str(raw)}
+
+    notes = raw.get('notes', '')
+    if isinstance(notes, str) and notes.strip().startswith("{'notes'"):
+        try:
+            inner = ast.literal_eval(notes)
+            if isinstance(inner, dict):
+                notes = inner.get('notes', notes)
+        except (ValueError, SyntaxError):
+            pass
+    return {'notes': notes}
+
+def item_local_date(item):
+    """Dia do item no fuso atual (o mesmo critério de start_datetime__date)."""
+    return timezone.localtime(item.start_datetime).date()
+
+
+def build_itinerary_context(trip, rates=None):
+    """Carrega itens, anexos e gastos da viagem e devolve um Itinerary pronto para os templates."""
+    if rates is None:
+        rates = get_exchange_rates()
+
+    # 1 query de itens + 1 de anexos (item.attachments.exists no template usa o prefetch)
+    items = list(trip.items.prefetch_related('attachments').order_by('start_datetime'))
+
+    # 1 query: valor em Reais de cada gasto (salvo ou pela cotação do dia) já vem anotado
+    expenses = list(trip.expenses.all().with_brl(rates))
+
+    total = Decimal('0')
+    paid = Decimal('0')
+    expenses_by_item = {}
+    for expense in expenses:
+        expense.converted_amount = expense.brl_amount.quantize(CENTS)
+        total += expense.brl_amount
+        if expense.is_paid:
+            paid += expense.brl_amount
+        if expense.item_id:
+            expenses_by_item.setdefault(expense.item_id, []).append(expense)
+
+    total = total.quantize(CENTS)
+    paid = paid.quantize(CENTS)
+
+    for item in items:
+        item.flag_code = item.country_code
+        if item.details:
+            item.details = clean_item_details(item.details)
+        item.item_expenses = expenses_by_item.get(item.id, [])
+
+    return Itinerary(
+        trip=trip,
+        items=items,
+        expenses=expenses,
+        totals={'total': total, 'paid': paid, 'to_pay': total - paid},
+        rates=rates,
+        available_dates=sorted({item_local_date(item) for item in items}),
+        # Itens aguardando o 'geocode_worker' (a página consulta o status até zerar)
+        geocode_pending=sum(1 for item in items if item.geocode_status in TripItem.GEOCODE_QUEUED),
+    )
+
+def currency_rates(items, rates):
+    """Cotação de cada moeda local (TripItem.local_currency) dos itens, sem o BRL."""
+    trip_rates = []
+    for code in sorted({item.local_currency for item in items} - {'', 'BRL', None}):
+        rate = rates.get(code) or get_exchange_rate(code)
+        if rate:
+            trip_rates.append({'code': code, 'rate': rate})
+    return trip_rates
+
+def apply_item_weather(items):
+    """
+    Clima dos itens: previsões salvas (tabela WeatherForecast) numa query só;
+    com WEATHER_FETCH_ON_REQUEST, as que faltam são buscadas em paralelo.
+    """
+    if settings.WEATHER_FETCH_ON_REQUEST:
+        resolve_trip_weather(items)
+    else:
+        apply_stored_weather(items)
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from core.models import Trip, TripItem, GeocodeCache
+from core.utils import get_location_codes, normalize_address
+
+class Command(BaseCommand):
+    help = 'Preenche em lote o país (country_code) e a moeda local (local_currency) dos itens já existentes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recalcula todos os itens com endereço (não só os sem país) e as bandeiras de todas as viagens')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Itens lidos e gravados (bulk_update) por lote')
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+
+        items = TripItem.objects.exclude(location_address__isnull=True).exclude(location_address='')
+        if not options['all']:
+            items = items.filter(country_code='')
+
+        self.stdout.write(self.style.WARNING(f"--- Preenchendo país/moeda de {items.count()} itens ---"))
+
+        stream = items.order_by('id').only('id', 'trip', 'location_address', 'country_code', 'local_currency')
+
+        self.changed_trips = set()
+        batch = []
+        updated = 0
+        for item in stream.iterator(chunk_size=batch_size):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                updated += self.process_batch(batch)
+                batch = []
+                self.stdout.write(f"... {updated} itens atualizados")
+        if batch:
+            updated += self.process_batch(batch)
+
+        # Bandeiras das viagens (Trip.country_flags): bulk_update não dispara os signals
+        if options['all']:
+            self.changed_trips.update(Trip.objects.values_list('id', flat=True))
+        Trip.refresh_country_flags(self.changed_trips)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Fim. Total de itens atualizados: {updated} (bandeiras de {len(self.changed_trips)} viagens)"
+        ))
+
+    def process_batch(self, batch):
+        # País do Geocoding (tabela GeocodeCache) numa query por lote; sem ele, usa o texto do endereço
+        keys = {normalize_address(item.location_address) for item in batch}
+        geocoded = dict(
+            GeocodeCache.objects.filter(address_key__in=keys).values_list('address_key', 'country_code')
+        )
+
+        changed = []
+        for item in batch:
+            codes = get_location_codes(item.location_address, geocoded.get(normalize_address(item.location_address)))
+            if codes != (item.country_code, item.local_currency):
+                item.country_code, item.local_currency = codes
+                changed.append(item)
+
+        if changed:
+            TripItem.objects.bulk_update(changed, ['country_code', 'local_currency'])
+            self.changed_trips.update(item.trip_id for item in changed)
+        return len(changed)
@@ -0,0 +1,113 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from datetime import date, timedelta
+import time
+from core.itinerary import build_itinerary_context
+from core.models import Expense, Trip, TripItem
+from core.pdf import build_trip_pdf_html
+from core.pdf_render import render_pdf_bytes
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o tempo de montar o PDF do roteiro (view-model, HTML e conversão) conforme o número '
+        'de itens da viagem. Os dados semeados ficam numa transação desfeita no final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,50,200',
+                            help='Quantidades de itens (e gastos) da viagem de teste')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Execuções por tamanho (vale a mediana)')
+        parser.add_argument('--no-pdf', action='store_true',
+                            help='Mede só view-model e HTML (pula a conversão pelo xhtml2pdf, que é a parte lenta)')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',') if size.strip()})
+        except ValueError:
+            raise CommandError(f"--sizes inválido: {options['sizes']}")
+        if not sizes or sizes[0] < 1:
+            raise CommandError("Informe tamanhos maiores que zero (ex: --sizes 10,50,200)")
+        repeat = max(options['repeat'], 1)
+
+        self.stdout.write(self.style.WARNING(
+            f"--- PDF do roteiro com {', '.join(map(str, sizes))} itens ({repeat} execuções cada) ---"
+        ))
+        self.stdout.write(
+            f"{'itens':>6}{'queries':>9}{'view-model':>12}{'html':>10}{'pdf':>10}{'total':>10}{'tamanho':>10}"
+        )
+
+        # Sem chamadas à API de cotações durante a medição
+        with override_settings(EXCHANGE_RATES_FETCH_ON_REQUEST=False):
+            for size in sizes:
+                with transaction.atomic():
+                    trip, user = self.seed(size)
+                    self.report(size, [self.measure(trip, user, options['no_pdf']) for _ in range(repeat)])
+                    # Desfaz a massa de dados semeada
+                    transaction.set_rollback(True)
+
+        self.stdout.write("(html inclui o view-model; total = html + pdf; queries = só as do view-model)")
+
+    # --- MASSA DE DADOS ---
+    def seed(self, size):
+        """Viagem com `size` itens (um por hora) e `size` gastos, metade em moeda estrangeira."""
+        today = date.today()
+        now = timezone.now()
+        user = User.objects.create_user('benchmark_pdf_user', 'benchmark-pdf@example.com', 'x')
+        trip = Trip.objects.create(
+            user=user, title='Benchmark PDF',
+            start_date=today, end_date=today + timedelta(days=size // 24 + 1),
+        )
+        # bulk_create não passa pelo save(): nada de geocodificação durante a medição
+        items = TripItem.objects.bulk_create(
+            TripItem(
+                trip=trip, item_type='ACTIVITY', name=f'Atividade {i}',
+                start_datetime=now + timedelta(hours=i), end_datetime=now + timedelta(hours=i + 1),
+                location_address=f'Rua {i}, Lisboa, Portugal', location_lat=38.72, location_lng=-9.14,
+                details={'notes': f'Observações da atividade {i}'},
+            )
+            for i in range(size)
+        )
+        Expense.objects.bulk_create(
+            Expense(
+                trip=trip, item=item, description=f'Gasto {i}', amount=10 + i,
+                currency='EUR' if i % 2 else 'BRL', category='Passeios', date=today,
+            )
+            for i, item in enumerate(items)
+        )
+        return trip, user
+
+    # --- MEDIÇÃO ---
+    def measure(self, trip, user, skip_pdf):
+        """Retorna (queries do view-model, ms view-model, ms html, ms pdf, bytes do pdf)."""
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as ctx:
+            build_itinerary_context(trip)
+        view_model_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        html = build_trip_pdf_html(trip, user)
+        html_ms = (time.perf_counter() - start) * 1000
+
+        pdf_ms, pdf_size = 0, 0
+        if not skip_pdf:
+            start = time.perf_counter()
+            pdf_size = len(render_pdf_bytes(html))
+            pdf_ms = (time.perf_counter() - start) * 1000
+
+        return len(ctx.captured_queries), view_model_ms, html_ms, pdf_ms, pdf_size
+
+    def report(self, size, runs):
+        def median(index):
+            values = sorted(run[index] for run in runs)
+            return values[len(values) // 2]
+
+        queries, view_model_ms, html_ms, pdf_ms, pdf_size = (median(i) for i in range(5))
+        self.stdout.write(
+            f"{size:>6}{queries:>9}{view_model_ms:>10.1f}ms{html_ms:>8.1f}ms{pdf_ms:>8.1f}ms"
+            f"{html_ms + pdf_ms:>8.1f}ms{pdf_size / 1024:>8.1f}KB"
+        )
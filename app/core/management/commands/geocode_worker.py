@@ -0,0 +1,128 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from datetime import timedelta
+from core.models import Trip, TripItem
+from core.utils import geocode_items, GEOCODE_ITEM_FIELDS
+import time
+
+class Command(BaseCommand):
+    help = 'Processa a fila de Geocoding: preenche as coordenadas dos itens com status PENDING'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.GEOCODE_WORKER_BATCH_SIZE,
+                            help='Itens reservados por lote')
+        parser.add_argument('--threads', type=int, default=settings.GEOCODE_WORKER_THREADS,
+                            help='Requisições simultâneas ao Google')
+        parser.add_argument('--idle-sleep', type=int, default=settings.GEOCODE_WORKER_IDLE_SLEEP,
+                            help='Segundos de espera quando a fila está vazia')
+        parser.add_argument('--max-attempts', type=int, default=settings.GEOCODE_MAX_ATTEMPTS,
+                            help='Tentativas com erro antes de marcar o item como FAILED')
+        parser.add_argument('--once', action='store_true',
+                            help='Esvazia a fila uma vez e sai (útil para cron)')
+
+    def handle(self, *args, **options):
+        self.batch_size = max(options['batch_size'], 1)
+        self.threads = max(options['threads'], 1)
+        self.max_attempts = max(options['max_attempts'], 1)
+        idle_sleep = max(options['idle_sleep'], 1)
+
+        self.stdout.write(self.style.WARNING(
+            f"--- Worker de Geocoding iniciado (lote: {self.batch_size}, threads: {self.threads}) ---"
+        ))
+
+        while True:
+            # Processos longos: descarta conexões velhas/quebradas com o banco
+            close_old_connections()
+
+            processed, errors = self.process_batch()
+
+            if options['once'] and (processed == 0 or processed == errors):
+                break
+
+            # Fila vazia (ou só erros de rede): espera antes de tentar de novo
+            if processed == 0 or processed == errors:
+                try:
+                    time.sleep(idle_sleep)
+                except KeyboardInterrupt:
+                    break
+
+        self.stdout.write("--- Worker de Geocoding finalizado ---")
+
+    def requeue_stale_claims(self):
+        """Itens reservados há mais de GEOCODE_CLAIM_TIMEOUT (worker que caiu no meio do lote) voltam para a fila."""
+        limit = timezone.now() - timedelta(seconds=settings.GEOCODE_CLAIM_TIMEOUT)
+        count = (
+            TripItem.objects
+            .filter(geocode_status=TripItem.GEOCODE_PROCESSING, geocode_claimed_at__lt=limit)
+            .update(geocode_status=TripItem.GEOCODE_PENDING, geocode_claimed_at=None)
+        )
+        if count:
+            self.stdout.write(self.style.WARNING(f"{count} itens com reserva vencida voltaram para a fila"))
+
+    def claim_batch(self):
+        """
+        Reserva um lote numa transação curta (PROCESSING + claimed_at) e faz o commit:
+        os locks das linhas duram só o UPDATE, nunca as chamadas ao Google.
+        """
+        claimed_at = timezone.now()
+        with transaction.atomic():
+            # skip_locked: vários workers podem rodar juntos sem pegar o mesmo item
+            ids = list(
+                TripItem.objects.select_for_update(skip_locked=True)
+                .filter(geocode_status=TripItem.GEOCODE_PENDING)
+                .order_by('geocode_attempts', 'id')
+                .values_list('id', flat=True)[:self.batch_size]
+            )
+            if ids:
+                TripItem.objects.filter(id__in=ids).update(
+                    geocode_status=TripItem.GEOCODE_PROCESSING, geocode_claimed_at=claimed_at
+                )
+        return ids, claimed_at
+
+    def process_batch(self):
+        """Reserva um lote da fila, geocodifica (fora de transação) e grava. Retorna (itens processados, itens com erro)."""
+        self.requeue_stale_claims()
+
+        ids, claimed_at = self.claim_batch()
+        if not ids:
+            return 0, 0
+
+        items = list(
+            TripItem.objects.filter(id__in=ids)
+            .only('id', 'trip', 'location_address', 'geocode_claimed_at', *GEOCODE_ITEM_FIELDS)
+        )
+
+        start_time = time.time()
+        # Sem transação aberta: um usuário salvando o item não espera pela rede
+        found, failed, errors = geocode_items(
+            items, max_workers=self.threads, max_attempts=self.max_attempts
+        )
+        for item in items:
+            # Erro de rede abaixo do limite de tentativas: volta para a fila
+            if item.geocode_status == TripItem.GEOCODE_PROCESSING:
+                item.geocode_status = TripItem.GEOCODE_PENDING
+            item.geocode_claimed_at = None
+
+        with transaction.atomic():
+            # Só grava quem continua com a NOSSA reserva: item salvo pelo usuário no meio do lote
+            # (endereço novo -> PENDING) ou re-reservado após vencer fica como está
+            still_claimed = set(
+                TripItem.objects.select_for_update()
+                .filter(id__in=ids, geocode_status=TripItem.GEOCODE_PROCESSING, geocode_claimed_at=claimed_at)
+                .values_list('id', flat=True)
+            )
+            items = [item for item in items if item.id in still_claimed]
+            # bulk_update não chama o save() (que reenfileiraria o item)
+            TripItem.objects.bulk_update(items, GEOCODE_ITEM_FIELDS + ['geocode_claimed_at'])
+            # bulk_update também não dispara signals: atualiza as bandeiras das viagens
+            Trip.refresh_country_flags(item.trip_id for item in items)
+
+        skipped = len(ids) - len(items)
+        self.stdout.write(
+            f"Lote de {len(ids)} itens em {time.time() - start_time:.2f}s: "
+            f"{found} localizados, {failed} não encontrados, {errors} com erro"
+            + (f", {skipped} alterados durante o lote (descartados)" if skipped else "")
+        )
+        return len(ids), errors
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from datetime import datetime, timedelta
+from core.models import Expense
+from core.utils import fetch_exchange_rate_history, save_exchange_rate_history
+import time
+
+class Command(BaseCommand):
+    help = 'Carrega em lote o histórico diário de cotações (tabela ExchangeRate) para converter gastos pela data'
+
+    # Janela de dias por requisição (a API limita o tamanho da resposta)
+    WINDOW_DAYS = 180
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='Data inicial (AAAA-MM-DD). Padrão: data do gasto mais antigo')
+        parser.add_argument('--end', help='Data final (AAAA-MM-DD). Padrão: hoje')
+        parser.add_argument('--currencies', help='Moedas separadas por vírgula (ex: USD,EUR). Padrão: todas')
+
+    def handle(self, *args, **options):
+        end_date = self.parse_date(options['end']) if options['end'] else timezone.localdate()
+
+        if options['start']:
+            start_date = self.parse_date(options['start'])
+        else:
+            start_date = Expense.objects.exclude(currency='BRL').aggregate(first=Min('date'))['first']
+            if not start_date:
+                self.stdout.write("Nenhum gasto em moeda estrangeira. Nada a carregar.")
+                return
+
+        if start_date > end_date:
+            raise CommandError("A data inicial é maior que a data final.")
+
+        if options['currencies']:
+            currencies = [c.strip().upper() for c in options['currencies'].split(',') if c.strip()]
+        else:
+            currencies = [code for code, _ in Expense.CURRENCY_CHOICES if code != 'BRL']
+
+        self.stdout.write(self.style.WARNING(
+            f"--- Carregando histórico de {start_date} a {end_date} ({', '.join(currencies)}) ---"
+        ))
+
+        total = 0
+        for currency in currencies:
+            window_start = start_date
+            while window_start <= end_date:
+                window_end = min(window_start + timedelta(days=self.WINDOW_DAYS - 1), end_date)
+                try:
+                    history = fetch_exchange_rate_history(currency, window_start, window_end)
+                    saved = save_exchange_rate_history(currency, history)
+                    total += saved
+                    self.stdout.write(self.style.SUCCESS(
+                        f"✅ {currency} {window_start} → {window_end}: {saved} dias"
+                    ))
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(
+                        f"❌ {currency} {window_start} → {window_end}: {e}"
+                    ))
+                window_start = window_end + timedelta(days=1)
+                time.sleep(0.5) # Gentileza com a API gratuita
+
+        self.stdout.write(f"--- Fim. Total de cotações gravadas: {total} ---")
+
+    def parse_date(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f"Data inválida: {value} (use AAAA-MM-DD)")
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from datetime import timedelta
+from core.models import TripItem
+from core.utils import get_weather_api_key, resolve_trip_weather
+import time
+
+class Command(BaseCommand):
+    help = 'Busca em segundo plano a previsão do tempo dos itens das próximas viagens (tabela WeatherForecast)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.WEATHER_PREFETCH_DAYS,
+                            help='Quantos dias à frente buscar (a WeatherAPI prevê até 14)')
+        parser.add_argument('--threads', type=int, default=settings.WEATHER_FETCH_THREADS,
+                            help='Chamadas simultâneas à WeatherAPI')
+        parser.add_argument('--interval', type=int, default=settings.WEATHER_PREFETCH_INTERVAL,
+                            help='Segundos entre execuções')
+        parser.add_argument('--once', action='store_true',
+                            help='Executa apenas uma vez e sai (útil para cron)')
+
+    def handle(self, *args, **options):
+        interval = max(options['interval'], 60)
+        days = max(options['days'], 0)
+        self.threads = max(options['threads'], 1)
+
+        self.stdout.write(self.style.WARNING(
+            f"--- Pré-busca de clima iniciada ({days} dias à frente, intervalo: {interval}s) ---"
+        ))
+
+        while True:
+            # Processos longos: descarta conexões velhas/quebradas com o banco
+            close_old_connections()
+
+            try:
+                self.prefetch(days)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"❌ Erro na pré-busca de clima: {e}"))
+
+            if options['once']:
+                break
+
+            try:
+                time.sleep(interval)
+            except KeyboardInterrupt:
+                break
+
+        self.stdout.write("--- Pré-busca de clima finalizada ---")
+
+    def prefetch(self, days):
+        api_key = get_weather_api_key()
+        if not api_key:
+            self.stdout.write(self.style.ERROR("❌ Chave WEATHER_API não cadastrada ou inativa no banco."))
+            return
+
+        now = timezone.now()
+        items = list(
+            TripItem.objects
+            .exclude(location_address__isnull=True).exclude(location_address='')
+            .filter(start_datetime__gte=now - timedelta(days=1), start_datetime__lte=now + timedelta(days=days))
+            .only('id', 'location_address', 'start_datetime', 'weather_temp', 'weather_condition', 'weather_icon')
+        )
+        if not items:
+            self.stdout.write("Nenhum item nos próximos dias.")
+            return
+
+        # Pares (local, dia) únicos e vencidos/ausentes são buscados em paralelo;
+        # o mesmo hotel em vários itens/viagens vira uma consulta só
+        start_time = time.time()
+        refreshed = resolve_trip_weather(items, max_workers=self.threads, refresh_expired=True)
+
+        # Copia as previsões ainda válidas para os demais itens (PDF e telas que leem os campos do item)
+        TripItem.objects.bulk_update(items, ['weather_temp', 'weather_condition', 'weather_icon'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {len(items)} itens: {refreshed} com previsão atualizada na API "
+            f"em {time.time() - start_time:.2f}s"
+        ))
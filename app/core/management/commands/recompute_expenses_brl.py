@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from decimal import Decimal
+from core.models import Expense
+
+class Command(BaseCommand):
+    help = 'Recalcula em lote o valor em Reais (amount_brl) e a cotação usada de cada gasto'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only-missing', action='store_true',
+                            help='Recalcula apenas gastos ainda sem valor convertido')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Quantidade de gastos gravados por bulk_update')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        expenses = Expense.objects.all()
+        if options['only_missing']:
+            expenses = expenses.filter(amount_brl__isnull=True)
+
+        # A conversão (cotação histórica) é calculada pelo banco na própria query
+        expenses = expenses.with_brl(use_snapshot=False).only('id', 'amount', 'amount_brl', 'exchange_rate')
+
+        self.stdout.write(self.style.WARNING("--- Recalculando valores em Reais ---"))
+
+        batch = []
+        updated = 0
+        for expense in expenses.iterator(chunk_size=batch_size):
+            rate = Decimal(expense.brl_rate)
+            amount_brl = Decimal(expense.brl_amount).quantize(Decimal('0.01'))
+
+            if expense.exchange_rate == rate and expense.amount_brl == amount_brl:
+                continue
+
+            expense.exchange_rate = rate
+            expense.amount_brl = amount_brl
+            batch.append(expense)
+
+            if len(batch) >= batch_size:
+                Expense.objects.bulk_update(batch, ['exchange_rate', 'amount_brl'])
+                updated += len(batch)
+                batch = []
+                self.stdout.write(f"... {updated} gastos atualizados")
+
+        if batch:
+            Expense.objects.bulk_update(batch, ['exchange_rate', 'amount_brl'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Fim. Total de gastos atualizados: {updated}"))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections
+from core.utils import refresh_exchange_rates
+import random
+import time
+
+class Command(BaseCommand):
+    help = 'Atualiza as cotações em segundo plano (cache + banco) em intervalos regulares'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.EXCHANGE_RATES_REFRESH_INTERVAL,
+                            help='Segundos entre atualizações bem-sucedidas')
+        parser.add_argument('--jitter', type=int, default=settings.EXCHANGE_RATES_REFRESH_JITTER,
+                            help='Variação aleatória (+/- segundos) aplicada a cada espera')
+        parser.add_argument('--max-backoff', type=int, default=settings.EXCHANGE_RATES_MAX_BACKOFF,
+                            help='Espera máxima (segundos) entre tentativas após falhas seguidas')
+        parser.add_argument('--once', action='store_true',
+                            help='Executa apenas uma atualização e sai (útil para cron)')
+
+    def handle(self, *args, **options):
+        interval = max(options['interval'], 1)
+        jitter = max(options['jitter'], 0)
+        max_backoff = max(options['max_backoff'], 1)
+
+        self.stdout.write(self.style.WARNING(
+            f"--- Atualizador de cotações iniciado (intervalo: {interval}s, jitter: ±{jitter}s) ---"
+        ))
+
+        failures = 0
+        while True:
+            # Processos longos: descarta conexões velhas/quebradas com o banco
+            close_old_connections()
+
+            start_time = time.time()
+            rates = refresh_exchange_rates()
+            duration = time.time() - start_time
+
+            if rates:
+                failures = 0
+                delay = interval
+                self.stdout.write(self.style.SUCCESS(
+                    f"✅ {len(rates)} cotações atualizadas em {duration:.2f}s"
+                ))
+            else:
+                # Backoff exponencial: 30s, 60s, 120s... até o máximo configurado
+                failures += 1
+                delay = min(30 * 2 ** (failures - 1), max_backoff)
+                self.stdout.write(self.style.ERROR(
+                    f"❌ Falha ao atualizar cotações ({failures}x seguidas). Nova tentativa em ~{delay}s"
+                ))
+
+            if options['once']:
+                break
+
+            # Jitter evita que várias instâncias batam na API no mesmo segundo
+            delay = max(delay + random.uniform(-jitter, jitter), 1)
+            try:
+                time.sleep(delay)
+            except KeyboardInterrupt:
+                break
+
+        self.stdout.write("--- Atualizador de cotações finalizado ---")
@@ -0,0 +1,123 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import transaction
+from core.models import Trip, TripItem
+from core.utils import geocode_items, GEOCODE_ITEM_FIELDS
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Geocodifica em lote os itens com endereço e sem coordenadas (substitui a antiga tela fix-locations)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Itens lidos e gravados (bulk_update) por lote')
+        parser.add_argument('--threads', type=int, default=settings.GEOCODE_WORKER_THREADS,
+                            help='Requisições simultâneas ao Google')
+        parser.add_argument('--max-per-second', type=float, default=10,
+                            help='Limite de requisições por segundo ao Google (0 = sem limite)')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Inclui itens já marcados como "não encontrado" (FAILED)')
+        parser.add_argument('--after-id', type=int, default=0,
+                            help='Continua a partir deste ID de item (retomar execução interrompida)')
+        parser.add_argument('--checkpoint',
+                            help='Arquivo onde o último ID processado é salvo a cada lote (retoma automaticamente)')
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        threads = max(options['threads'], 1)
+        max_per_second = options['max_per_second'] or None
+        checkpoint = options['checkpoint']
+
+        after_id = options['after_id']
+        if checkpoint and not after_id and os.path.exists(checkpoint):
+            after_id = self.read_checkpoint(checkpoint)
+            self.stdout.write(f"Retomando a partir do item #{after_id} (checkpoint: {checkpoint})")
+
+        items = (
+            TripItem.objects
+            .exclude(location_address__isnull=True).exclude(location_address='')
+            .filter(location_lat__isnull=True, id__gt=after_id)
+            # Itens na fila (PENDING/PROCESSING) são do 'geocode_worker': os dois não geocodificam o mesmo item
+            .exclude(geocode_status__in=TripItem.GEOCODE_QUEUED)
+        )
+        if not options['retry_failed']:
+            items = items.exclude(geocode_status=TripItem.GEOCODE_FAILED)
+
+        total = items.count()
+        if not total:
+            self.stdout.write(self.style.SUCCESS("Nenhum item pendente de coordenadas."))
+            return
+
+        self.stdout.write(self.style.WARNING(
+            f"--- Geocodificando {total} itens (lote: {batch_size}, threads: {threads}, "
+            f"limite: {max_per_second or 'sem'} req/s) ---"
+        ))
+
+        # iterator(): lê os itens aos poucos, sem carregar a tabela inteira na memória.
+        # Ordem por ID para o checkpoint ser o último ID gravado.
+        stream = (
+            items.order_by('id')
+            .only('id', 'trip', 'location_address', *GEOCODE_ITEM_FIELDS)
+            .iterator(chunk_size=batch_size)
+        )
+
+        self.start_time = time.time()
+        self.totals = {'done': 0, 'found': 0, 'failed': 0, 'errors': 0}
+
+        batch = []
+        for item in stream:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                self.process_batch(batch, threads, max_per_second, total, checkpoint)
+                batch = []
+        if batch:
+            self.process_batch(batch, threads, max_per_second, total, checkpoint)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Fim em {time.time() - self.start_time:.1f}s. "
+            f"Localizados: {self.totals['found']}, não encontrados: {self.totals['failed']}, "
+            f"com erro: {self.totals['errors']}"
+        ))
+        if self.totals['errors']:
+            self.stdout.write("Itens com erro continuam sem coordenadas: rode o comando de novo para tentar outra vez.")
+
+    def process_batch(self, batch, threads, max_per_second, total, checkpoint):
+        found, failed, errors = geocode_items(batch, max_workers=threads, max_per_second=max_per_second)
+
+        with transaction.atomic():
+            # Item que entrou na fila do worker durante o lote (ex: endereço editado) fica para ele
+            queued = set(
+                TripItem.objects.select_for_update()
+                .filter(id__in=[item.id for item in batch], geocode_status__in=TripItem.GEOCODE_QUEUED)
+                .values_list('id', flat=True)
+            )
+            items = [item for item in batch if item.id not in queued]
+            # bulk_update não chama o save() (que colocaria o item na fila do worker)
+            TripItem.objects.bulk_update(items, GEOCODE_ITEM_FIELDS)
+            # bulk_update também não dispara signals: atualiza as bandeiras das viagens
+            Trip.refresh_country_flags(item.trip_id for item in items)
+
+        self.totals['done'] += len(batch)
+        self.totals['found'] += found
+        self.totals['failed'] += failed
+        self.totals['errors'] += errors
+
+        last_id = batch[-1].id
+        if checkpoint:
+            with open(checkpoint, 'w') as f:
+                f.write(str(last_id))
+
+        elapsed = time.time() - self.start_time
+        percent = self.totals['done'] * 100 / total
+        self.stdout.write(
+            f"... {self.totals['done']}/{total} ({percent:.0f}%) em {elapsed:.1f}s "
+            f"- último item #{last_id}"
+        )
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return int(f.read().strip() or 0)
+        except ValueError:
+            raise CommandError(f"Checkpoint inválido: {path}")
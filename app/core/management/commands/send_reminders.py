@@ -5,8 +5,9 @@ from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
 from datetime import timedelta
-from core.models import TripItem, EmailConfiguration
-from core.utils import get_db_mail_connection
+from core.models import TripItem
+from core.utils import get_db_mail_connection, get_email_settings
+from core.metrics import upstream_call
 import ast
 
 class Command(BaseCommand):
@@ -93,11 +94,9 @@ class Command(BaseCommand):
 
         # Configura Remetente (Banco ou Default)
         from_email = settings.DEFAULT_FROM_EMAIL
-        try:
-            email_config = EmailConfiguration.objects.first()
-            if email_config and email_config.default_from_email:
-                from_email = email_config.default_from_email
-        except: pass
+        email_config = get_email_settings()
+        if email_config and email_config.default_from_email:
+            from_email = email_config.default_from_email
 
         # Obtém conexão SMTP customizada
         connection = get_db_mail_connection()
@@ -114,4 +113,5 @@ class Command(BaseCommand):
         msg.attach_alternative(html_content, "text/html")
         
         # Envia
-        msg.send()
\ No newline at end of file
+        with upstream_call('smtp'):
+            msg.send()
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+Métricas da aplicação no formato texto do Prometheus (endpoint /metrics).
+
+Registro em memória, por processo: com um worker do gunicorn (configuração atual)
+cada scrape vê todos os requests. Com vários workers, cada scrape vê só o worker que atendeu.
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+# Limites (segundos) dos buckets dos histogramas de latência
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.snapshot().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [contagem por bucket..., soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: list(data) for key, data in self._values.items()}
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, data in sorted(values.items()):
+            for bound, count in zip(self.buckets, data):
+                labels = _format_labels(self.labelnames, key, [('le', bound)])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+            lines.append(f"{self.name}_bucket{labels} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {data[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}")
+        return lines
+
+
+# --- MÉTRICAS DA APLICAÇÃO ---
+VIEW_LATENCY = Histogram(
+    'travel_view_seconds', 'Tempo de resposta por view', ['view', 'method', 'status'],
+)
+VIEW_DB_QUERIES = Counter(
+    'travel_view_db_queries_total', 'Queries SQL executadas por view', ['view'],
+)
+UPSTREAM_LATENCY = Histogram(
+    'travel_upstream_request_seconds', 'Latência das chamadas a serviços externos', ['upstream', 'outcome'],
+)
+SPAN_LATENCY = Histogram(
+    'travel_span_seconds', 'Duração de trechos internos instrumentados', ['span', 'outcome'],
+)
+CACHE_REQUESTS = Counter(
+    'travel_cache_requests_total', 'Consultas ao cache por resultado (hit, stale, miss)', ['cache', 'result'],
+)
+
+REGISTRY = [VIEW_LATENCY, VIEW_DB_QUERIES, UPSTREAM_LATENCY, SPAN_LATENCY, CACHE_REQUESTS]
+
+
+class Span:
+    """Trecho em medição. O código dentro do `with` pode trocar o `outcome` (ex: 'not_found')."""
+
+    def __init__(self):
+        self.outcome = 'ok'
+
+
+@contextmanager
+def _timed(histogram, label, name):
+    current = Span()
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception:
+        current.outcome = 'error'
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, **{label: name, 'outcome': current.outcome})
+
+def upstream_call(upstream):
+    """Mede uma chamada externa (Google, WeatherAPI, OpenAI, SMTP...): `with upstream_call('weatherapi'):`."""
+    return _timed(UPSTREAM_LATENCY, 'upstream', upstream)
+
+def span(name):
+    """Mede um trecho interno (ex: TripItem.save): `with span('tripitem_save'):`."""
+    return _timed(SPAN_LATENCY, 'span', name)
+
+def record_cache(cache_name, result, count=1):
+    """Conta consultas ao cache: result = 'hit', 'stale' ou 'miss'."""
+    if count:
+        CACHE_REQUESTS.inc(count, cache=cache_name, result=result)
+
+def record_view(view, method, status, seconds, queries=None):
+    status_class = f"{status // 100}xx"
+    VIEW_LATENCY.observe(seconds, view=view, method=method, status=status_class)
+    if queries is not None:
+        VIEW_DB_QUERIES.inc(queries, view=view)
+
+
+def render_metrics():
+    """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+
+    # Taxa de acerto por cache (hit + stale sobre o total), já calculada para dashboards simples
+    totals = {}
+    for (cache_name, result), count in CACHE_REQUESTS.snapshot().items():
+        hits, total = totals.get(cache_name, (0, 0))
+        totals[cache_name] = (hits + (count if result in ('hit', 'stale') else 0), total + count)
+
+    lines.append("# HELP travel_cache_hit_ratio Fração das consultas ao cache respondidas sem ir à origem")
+    lines.append("# TYPE travel_cache_hit_ratio gauge")
+    for cache_name, (hits, total) in sorted(totals.items()):
+        lines.append(f'travel_cache_hit_ratio{{cache="{_escape(cache_name)}"}} {hits / total:.4f}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,90 @@
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from .metrics import record_view
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# --- CONTADOR DE QUERIES POR REQUEST ---
+class QueryStats:
+    """Execute wrapper do Django: conta as queries SQL e soma o tempo gasto no banco."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - start
+
+
+class QueryBudgetMiddleware:
+    """
+    Mede quantas queries (e quanto tempo de banco) cada request usou e avisa no log
+    quando passar do orçamento (QUERY_BUDGET_MAX_QUERIES / QUERY_BUDGET_MAX_DB_MS).
+    Funciona com DEBUG=False (não depende de connection.queries).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.QUERY_BUDGET_ENABLED
+        self.max_queries = settings.QUERY_BUDGET_MAX_QUERIES
+        self.max_db_ms = settings.QUERY_BUDGET_MAX_DB_MS
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        stats = QueryStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            # Só as conexões desta thread (queries feitas em thread pools não entram na conta)
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        db_ms = stats.time * 1000
+
+        # Disponível para outras partes (ex.: métricas) e nos headers em DEBUG
+        request.query_stats = stats
+        if settings.DEBUG:
+            response['X-DB-Queries'] = str(stats.count)
+            response['X-DB-Time-Ms'] = f"{db_ms:.1f}"
+
+        if stats.count > self.max_queries or db_ms > self.max_db_ms:
+            logger.warning(
+                "[QUERY BUDGET] %s %s -> %s: %s queries (limite %s), %.0fms de banco (limite %sms), %.0fms no total",
+                request.method, request.path, response.status_code, stats.count, self.max_queries,
+                db_ms, self.max_db_ms, elapsed_ms,
+            )
+
+        return response
+
+
+# --- TEMPO POR VIEW (MÉTRICAS) ---
+class RequestMetricsMiddleware:
+    """
+    Registra o tempo de resposta de cada view (nome da rota) nas métricas do /metrics.
+    Fica antes do QueryBudgetMiddleware para aproveitar a contagem de queries dele.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name if match else None) or 'unmatched'
+        stats = getattr(request, 'query_stats', None)
+        record_view(view, request.method, response.status_code, elapsed, stats.count if stats else None)
+        return response
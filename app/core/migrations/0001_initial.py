@@ -0,0 +1,282 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:46
+
+import core.models
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APIConfiguration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(choices=[('WEATHER_API', 'WeatherAPI (Clima)'), ('GOOGLE_MAPS_API', 'Google Maps API'), ('OPENAI_API', 'OpenAI API')], max_length=50, unique=True)),
+                ('value', models.CharField(max_length=255, verbose_name='Chave de Acesso (Key)')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Ativo')),
+                ('description', models.TextField(blank=True, null=True, verbose_name='Descrição/Notas')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Configuração de API',
+                'verbose_name_plural': 'Configurações de API',
+            },
+        ),
+        migrations.CreateModel(
+            name='Checklist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EmailConfiguration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('backend', models.CharField(default='django.core.mail.backends.smtp.EmailBackend', max_length=100, verbose_name='Backend')),
+                ('host', models.CharField(max_length=255, verbose_name='Servidor SMTP (Host)')),
+                ('port', models.IntegerField(default=587, verbose_name='Porta')),
+                ('username', models.CharField(blank=True, max_length=255, null=True, verbose_name='Usuário/E-mail')),
+                ('password', models.CharField(blank=True, max_length=255, null=True, verbose_name='Senha')),
+                ('use_tls', models.BooleanField(default=True, verbose_name='Usar TLS')),
+                ('use_ssl', models.BooleanField(default=False, verbose_name='Usar SSL')),
+                ('default_from_email', models.EmailField(max_length=254, verbose_name='E-mail de Envio (Remetente)')),
+            ],
+            options={
+                'verbose_name': 'Configuração de E-mail',
+                'verbose_name_plural': 'Configuração de E-mail',
+            },
+        ),
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address_key', models.CharField(max_length=255, unique=True, verbose_name='Endereço Normalizado')),
+                ('lat', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('lng', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('country_code', models.CharField(blank=True, default='', max_length=2, verbose_name='País (ISO)')),
+                ('formatted_address', models.CharField(blank=True, default='', max_length=500, verbose_name='Endereço (Google)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Cache de Geocodificação',
+                'verbose_name_plural': 'Cache de Geocodificação',
+            },
+        ),
+        migrations.CreateModel(
+            name='AccessLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, max_length=100, null=True)),
+                ('action', models.CharField(choices=[('LOGIN', 'Login'), ('LOGOUT', 'Logout')], max_length=20)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True, verbose_name='Endereço IP')),
+                ('timestamp', models.DateTimeField(auto_now_add=True, verbose_name='Data/Hora')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+            ],
+            options={
+                'verbose_name': 'Log de Acesso',
+                'verbose_name_plural': 'Logs de Acesso',
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChecklistItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(default='Geral', max_length=50)),
+                ('item', models.CharField(max_length=200)),
+                ('is_checked', models.BooleanField(default=False)),
+                ('checklist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.checklist')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('BRL', 'Real (BRL)'), ('USD', 'Dólar Americano (USD)'), ('EUR', 'Euro (EUR)'), ('CLP', 'Peso Chileno (CLP)'), ('ARS', 'Peso Argentino (ARS)'), ('UYU', 'Peso Uruguaio (UYU)'), ('COP', 'Peso Colombiano (COP)'), ('PEN', 'Sol Peruano (PEN)'), ('CAD', 'Dólar Canadense (CAD)'), ('GBP', 'Libra Esterlina (GBP)'), ('CHF', 'Franco Suíço (CHF)'), ('AUD', 'Dólar Australiano (AUD)'), ('JPY', 'Iene Japonês (JPY)')], max_length=3, verbose_name='Moeda')),
+                ('date', models.DateField(verbose_name='Data')),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=14, verbose_name='Cotação (BRL)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Cotação',
+                'verbose_name_plural': 'Cotações',
+                'ordering': ['-date', 'currency'],
+                'unique_together': {('currency', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200, verbose_name='Nome da Viagem')),
+                ('start_date', models.DateField(blank=True, null=True, verbose_name='Início')),
+                ('end_date', models.DateField(blank=True, null=True, verbose_name='Fim')),
+                ('status', models.CharField(choices=[('PLANNING', 'Planejamento'), ('CONFIRMED', 'Confirmada'), ('COMPLETED', 'Concluída'), ('CANCELED', 'Cancelada')], default='PLANNING', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('ai_insights', models.JSONField(blank=True, default=dict, null=True)),
+                ('country_flags', models.JSONField(blank=True, default=list, editable=False)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trips', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Viagem',
+                'verbose_name_plural': 'Viagens',
+                'ordering': ['-start_date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='checklist',
+            name='trip',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='checklist', to='core.trip'),
+        ),
+        migrations.CreateModel(
+            name='TripItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_type', models.CharField(choices=[('FLIGHT', 'Voo'), ('BUS', 'Ônibus'), ('TRAIN', 'Trem'), ('CRUISE', 'Cruzeiro'), ('HOTEL', 'Hospedagem'), ('ACTIVITY', 'Atração/Passeio'), ('TOUR', 'Tour Guiado'), ('WINARY', 'Atração/Vinícola'), ('MUSEUM', 'Atração/Museu'), ('RENTAL', 'Aluguel de Carro'), ('RESTAURANT', 'Restaurante'), ('TRANSPORT', 'Transporte Local'), ('BUYING', 'Compras'), ('INSURANCE', 'Seguro Viagem'), ('NOTE', 'Anotação')], max_length=20)),
+                ('name', models.CharField(max_length=200, verbose_name='Nome do Item')),
+                ('start_datetime', models.DateTimeField(verbose_name='Início/Check-in')),
+                ('end_datetime', models.DateTimeField(blank=True, null=True, verbose_name='Fim/Check-out')),
+                ('link', models.URLField(blank=True, max_length=500, null=True, verbose_name='Link Externo')),
+                ('location_lat', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('location_lng', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('location_address', models.CharField(blank=True, max_length=255, null=True, verbose_name='Endereço')),
+                ('geocode_status', models.CharField(blank=True, choices=[('PENDING', 'Aguardando localização'), ('PROCESSING', 'Localizando'), ('DONE', 'Localizado'), ('FAILED', 'Endereço não encontrado')], db_index=True, default='', max_length=10)),
+                ('geocode_attempts', models.PositiveSmallIntegerField(default=0)),
+                ('geocode_claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('country_code', models.CharField(blank=True, db_index=True, default='', max_length=2, verbose_name='País (ISO)')),
+                ('local_currency', models.CharField(blank=True, default='', max_length=3, verbose_name='Moeda Local')),
+                ('weather_temp', models.CharField(blank=True, max_length=10, null=True)),
+                ('weather_condition', models.CharField(blank=True, max_length=100, null=True)),
+                ('weather_icon', models.CharField(blank=True, max_length=255, null=True)),
+                ('details', models.JSONField(blank=True, default=dict, verbose_name='Detalhes Específicos')),
+                ('reminder_hours', models.IntegerField(choices=[(0, 'Sem lembrete'), (1, '1 hora antes'), (24, '24 horas (1 dia) antes'), (48, '48 horas (2 dias) antes'), (168, '1 semana antes'), (720, '1 mês antes')], default=0, verbose_name='Lembrete por E-mail')),
+                ('reminder_sent', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.trip')),
+            ],
+            options={
+                'verbose_name': 'Item da Viagem',
+                'verbose_name_plural': 'Itens da Viagem',
+                'ordering': ['start_datetime'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TripAttachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='trip_files/', verbose_name='Arquivo (PDF/Img)')),
+                ('description', models.CharField(blank=True, max_length=100, verbose_name='Descrição (Opcional)')),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='core.tripitem')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Expense',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(max_length=200, verbose_name='Descrição')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Valor')),
+                ('currency', models.CharField(choices=[('BRL', 'Real (BRL)'), ('USD', 'Dólar Americano (USD)'), ('EUR', 'Euro (EUR)'), ('CLP', 'Peso Chileno (CLP)'), ('ARS', 'Peso Argentino (ARS)'), ('UYU', 'Peso Uruguaio (UYU)'), ('COP', 'Peso Colombiano (COP)'), ('PEN', 'Sol Peruano (PEN)'), ('CAD', 'Dólar Canadense (CAD)'), ('GBP', 'Libra Esterlina (GBP)'), ('CHF', 'Franco Suíço (CHF)'), ('AUD', 'Dólar Australiano (AUD)'), ('JPY', 'Iene Japonês (JPY)')], default='BRL', max_length=3)),
+                ('is_paid', models.BooleanField(default=False, verbose_name='Pago?')),
+                ('category', models.CharField(max_length=50, verbose_name='Categoria')),
+                ('date', models.DateField(default=django.db.models.functions.datetime.Now)),
+                ('exchange_rate', models.DecimalField(blank=True, decimal_places=8, max_digits=14, null=True, verbose_name='Cotação usada')),
+                ('amount_brl', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='Valor (BRL)')),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expenses', to='core.trip')),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='related_expenses', to='core.tripitem')),
+            ],
+            options={
+                'verbose_name': 'Gasto',
+                'verbose_name_plural': 'Gastos',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TripNote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200, verbose_name='Título da Nota')),
+                ('content', models.TextField(help_text='Aceita Markdown ou HTML simples', verbose_name='Conteúdo')),
+                ('category', models.CharField(choices=[('GENERAL', 'Geral'), ('FLIGHT_RULES', 'Regras Aéreas'), ('LUGGAGE', 'Bagagem'), ('DOCS', 'Documentação/Vistos'), ('SHOPPING', 'Compras'), ('ITINERARY', 'Roteiro/Dicas')], default='GENERAL', max_length=20, verbose_name='Categoria')),
+                ('is_ai_generated', models.BooleanField(default=False, verbose_name='Gerado por IA?')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notes', to='core.trip')),
+            ],
+            options={
+                'verbose_name': 'Nota de Viagem',
+                'verbose_name_plural': 'Notas de Viagem',
+                'ordering': ['-updated_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TripPhoto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='trip_photos/')),
+                ('caption', models.CharField(blank=True, max_length=200, null=True)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photos', to='core.trip')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WeatherForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('location_key', models.CharField(max_length=255, verbose_name='Local Normalizado')),
+                ('date', models.DateField(verbose_name='Data')),
+                ('temp', models.SmallIntegerField(verbose_name='Temperatura Média (°C)')),
+                ('condition', models.CharField(blank=True, default='', max_length=100, verbose_name='Condição')),
+                ('icon', models.CharField(blank=True, default='', max_length=255, verbose_name='Ícone')),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+                ('expires_at', models.DateTimeField(verbose_name='Válida até')),
+            ],
+            options={
+                'verbose_name': 'Previsão do Tempo',
+                'verbose_name_plural': 'Previsões do Tempo',
+                'ordering': ['date', 'location_key'],
+                'unique_together': {('location_key', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CalendarFeedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(default=core.models.new_feed_token, max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feed_tokens', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='feed_tokens', to='core.trip')),
+            ],
+            options={
+                'verbose_name': 'Link de Agenda',
+                'verbose_name_plural': 'Links de Agenda',
+                'constraints': [models.UniqueConstraint(fields=('user', 'trip'), name='unique_feed_token_per_trip'), models.UniqueConstraint(condition=models.Q(('trip__isnull', True)), fields=('user',), name='unique_feed_token_all_trips')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TripCollaborator',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('viewer', 'Somente Leitura'), ('editor', 'Acesso Total (Editar/Excluir)')], default='viewer', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='collaborators', to='core.trip')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shared_trips', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('trip', 'user')},
+            },
+        ),
+    ]
@@ -1,9 +1,38 @@
-import requests # Para chamar a API do Google pelo Python
 import os
+import datetime
+import secrets
+from decimal import Decimal
 from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from .metrics import span
+
+# --- CONSULTAS DE VIAGENS (PERMISSÕES) ---
+class TripQuerySet(models.QuerySet):
+    def with_user_role(self, user):
+        """
+        Anota cada viagem com o papel do usuário (user_role): 'owner', 'editor', 'viewer' ou None.
+        O papel vem na mesma query (Case + Subquery em TripCollaborator), então checar
+        permissão de uma lista inteira de viagens não gera uma query por viagem.
+        """
+        collaborator_role = TripCollaborator.objects.filter(
+            trip=models.OuterRef('pk'), user=user
+        ).values('role')[:1]
+
+        return self.annotate(
+            user_role=models.Case(
+                models.When(user=user, then=models.Value('owner')),
+                default=models.Subquery(collaborator_role),
+                output_field=models.CharField(),
+            ),
+            user_role_for=models.Value(user.pk, output_field=models.IntegerField()),
+        )
+
+    def visible_to(self, user):
+        """Viagens em que o usuário é dono ou colaborador (sem JOIN/DISTINCT), já com user_role."""
+        return self.with_user_role(user).filter(user_role__isnull=False)
 
 # --- MODELO DE VIAGEM ---
 class Trip(models.Model):
@@ -33,14 +62,33 @@ class Trip(models.Model):
     # Campo para guardar as dicas da IA (Moeda, Tomada, etc)
     ai_insights = models.JSONField(blank=True, null=True, default=dict)
 
+    # Bandeiras (países distintos dos itens), mantidas pelos signals do TripItem.
+    # Evita consultar os itens de cada viagem nas listagens.
+    country_flags = models.JSONField(default=list, blank=True, editable=False)
+
+    objects = TripQuerySet.as_manager()
+
     def get_user_role(self, user):
-        if user == self.user:
-            return 'owner'
-        try:
-            collaborator = self.collaborators.get(user=user)
-            return collaborator.role
-        except TripCollaborator.DoesNotExist:
-            return None
+        """
+        Papel do usuário nesta viagem ('owner', 'editor', 'viewer' ou None).
+        Usa a anotação de TripQuerySet.with_user_role quando houver; senão consulta
+        uma vez e guarda na instância (várias checagens no mesmo request = 1 query).
+        """
+        if getattr(self, 'user_role_for', None) == user.pk:
+            return self.user_role
+
+        roles = self.__dict__.setdefault('_user_roles', {})
+        if user.pk not in roles:
+            if user.pk == self.user_id:
+                roles[user.pk] = 'owner'
+            else:
+                roles[user.pk] = (
+                    self.collaborators.filter(user=user).values_list('role', flat=True).first()
+                )
+        return roles[user.pk]
+
+    def can_edit(self, user):
+        return self.get_user_role(user) in ('owner', 'editor')
 
     def __str__(self):
         return self.title
@@ -55,16 +103,25 @@ class Trip(models.Model):
     
     @property
     def flags(self):
-        # A IMPORTAÇÃO VEM PARA CÁ (Importação Local)
-        from .utils import get_country_code_from_address
-        
-        codes = set()
-        for item in self.items.all():
-            if item.location_address:
-                code = get_country_code_from_address(item.location_address)
-                if code:
-                    codes.add(code.lower())
-        return list(codes)
+        # Resumo pré-calculado (ver refresh_country_flags): nenhuma query extra por viagem
+        return self.country_flags or []
+
+    @classmethod
+    def refresh_country_flags(cls, trip_ids):
+        """
+        Recalcula country_flags das viagens informadas a partir de TripItem.country_code.
+        Chamado pelos signals do TripItem e pelos comandos que gravam itens com bulk_update.
+        """
+        for trip_id in set(trip_ids):
+            codes = list(
+                TripItem.objects.filter(trip_id=trip_id)
+                .exclude(country_code='')
+                .order_by('country_code')
+                .values_list('country_code', flat=True)
+                .distinct()
+            )
+            # update() não dispara save()/signals e não mexe em updated_at
+            cls.objects.filter(pk=trip_id).update(country_flags=codes)
 
 # --- MODELO DE ITENS DA VIAGEM ---
 class TripItem(models.Model):
@@ -110,6 +167,28 @@ class TripItem(models.Model):
     location_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     location_address = models.CharField(max_length=255, null=True, blank=True, verbose_name="Endereço")
 
+    # Fila de Geocoding (preenchida em segundo plano pelo comando 'geocode_worker')
+    GEOCODE_PENDING = 'PENDING'
+    GEOCODE_PROCESSING = 'PROCESSING'
+    GEOCODE_DONE = 'DONE'
+    GEOCODE_FAILED = 'FAILED'
+    GEOCODE_STATUS_CHOICES = [
+        (GEOCODE_PENDING, 'Aguardando localização'),
+        (GEOCODE_PROCESSING, 'Localizando'),
+        (GEOCODE_DONE, 'Localizado'),
+        (GEOCODE_FAILED, 'Endereço não encontrado'),
+    ]
+    # Ainda na fila: aguardando ou reservado por um worker
+    GEOCODE_QUEUED = (GEOCODE_PENDING, GEOCODE_PROCESSING)
+    geocode_status = models.CharField(max_length=10, choices=GEOCODE_STATUS_CHOICES, blank=True, default='', db_index=True)
+    geocode_attempts = models.PositiveSmallIntegerField(default=0) # Tentativas com erro de rede/API
+    # Quando o worker reservou o item (status PROCESSING); reservas velhas voltam para a fila
+    geocode_claimed_at = models.DateTimeField(null=True, blank=True)
+
+    # País e moeda local do item (preenchidos no save a partir do Geocoding ou do endereço)
+    country_code = models.CharField(max_length=2, blank=True, default='', db_index=True, verbose_name="País (ISO)")
+    local_currency = models.CharField(max_length=3, blank=True, default='', verbose_name="Moeda Local")
+
     # NOVOS CAMPOS DE CLIMA
     weather_temp = models.CharField(max_length=10, blank=True, null=True) # Ex: 24
     weather_condition = models.CharField(max_length=100, blank=True, null=True) # Ex: Nublado
@@ -132,6 +211,9 @@ class TripItem(models.Model):
     reminder_hours = models.IntegerField(choices=REMINDER_CHOICES, default=0, verbose_name="Lembrete por E-mail")
     reminder_sent = models.BooleanField(default=False) # Controle interno
 
+    # Última alteração (cache do PDF/agenda); vazio nos itens criados antes deste campo
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
     class Meta:
         ordering = ['start_datetime']
         verbose_name = "Item da Viagem"
@@ -141,32 +223,108 @@ class TripItem(models.Model):
         return f"[{self.get_item_type_display()}] {self.name}"
 
     def save(self, *args, **kwargs):
-        # Verifica se tem endereço mas NÃO tem coordenada salva
-        if self.location_address and (not self.location_lat or not self.location_lng):
-            try:
-                # Chama a API de Geocoding do Google (Server-Side)
-                api_key = settings.GOOGLE_MAPS_API_KEY
-                base_url = "https://maps.googleapis.com/maps/api/geocode/json"
-                params = {
-                    "address": self.location_address,
-                    "key": api_key
-                }
-
-                response = requests.get(base_url, params=params)
-                data = response.json()
-
-                if data['status'] == 'OK':
-                    location = data['results'][0]['geometry']['location']
+        # Importação local (utils importa models)
+        from .utils import geocode_address, get_cached_geocode, get_location_codes
+
+        # Mede o save inteiro (Geocoding síncrono, se ligado, aparece aqui)
+        with span('tripitem_save'):
+            location = None
+            # Verifica se tem endereço mas NÃO tem coordenada salva
+            if self.location_address and (not self.location_lat or not self.location_lng):
+                # Endereço já conhecido (cache/tabela GeocodeCache): resolve na hora, sem rede.
+                location = get_cached_geocode(self.location_address)
+                if location is None and not settings.GEOCODE_ASYNC:
+                    location = geocode_address(self.location_address)
+
+                if location:
                     self.location_lat = location['lat']
                     self.location_lng = location['lng']
-                    print(f"Coordenadas encontradas para {self.name}: {self.location_lat}, {self.location_lng}")
+                    self.geocode_status = self.GEOCODE_DONE
                 else:
-                    print(f"Google não encontrou o endereço: {self.location_address}")
-
-            except Exception as e:
-                print(f"Erro ao geocodificar: {e}")
-
-        super().save(*args, **kwargs)
+                    # Não trava o salvamento esperando o Google: o worker preenche depois
+                    self.geocode_status = self.GEOCODE_PENDING
+                    self.geocode_attempts = 0
+                    self.geocode_claimed_at = None
+            elif self.location_lat and self.location_lng:
+                self.geocode_status = self.GEOCODE_DONE
+
+            # País/moeda: prefere o país do Geocoding; sem ele, reconhece pelo texto do endereço
+            if self.location_address and (location or not self.country_code):
+                self.country_code, self.local_currency = get_location_codes(
+                    self.location_address, location['country_code'] if location else None
+                )
+            elif not self.location_address:
+                self.country_code = self.local_currency = ''
+
+            super().save(*args, **kwargs)
+
+# --- CONSULTAS DE GASTOS ---
+class ExpenseQuerySet(models.QuerySet):
+    def with_brl(self, fallback_rates=None, use_snapshot=True):
+        """
+        Anota cada gasto com a cotação do DIA DO GASTO (brl_rate) e o valor em Reais (brl_amount).
+        Se o gasto já tem o valor convertido salvo (amount_brl), usa ele direto.
+        Senão, a cotação vem de ExchangeRate (último dia <= data do gasto) na mesma query,
+        usando o índice (currency, date). Sem histórico para a moeda, usa a tabela
+        atual de cotações (fallback_rates ou get_exchange_rates()).
+        use_snapshot=False ignora o valor salvo (usado no recálculo em lote).
+        """
+        if fallback_rates is None:
+            # Importação local (utils importa models)
+            from .utils import get_exchange_rates
+            fallback_rates = get_exchange_rates()
+
+        rate_field = models.DecimalField(max_digits=14, decimal_places=8)
+
+        historical_rate = ExchangeRate.objects.filter(
+            currency=models.OuterRef('currency'),
+            date__lte=models.OuterRef('date')
+        ).order_by('-date').values('rate')[:1]
+
+        current_rate = models.Case(
+            *[models.When(currency=code, then=models.Value(Decimal(str(rate)), output_field=rate_field))
+              for code, rate in fallback_rates.items()],
+            default=models.Value(Decimal('1'), output_field=rate_field),
+            output_field=rate_field
+        )
+
+        amount_field = models.DecimalField(max_digits=24, decimal_places=8)
+
+        rate = models.functions.Coalesce(
+            models.Subquery(historical_rate, output_field=rate_field),
+            current_rate,
+            output_field=rate_field
+        )
+        amount = models.ExpressionWrapper(models.F('amount') * rate, output_field=amount_field)
+
+        if use_snapshot:
+            rate = models.functions.Coalesce('exchange_rate', rate, output_field=rate_field)
+            amount = models.functions.Coalesce('amount_brl', amount, output_field=amount_field)
+
+        return self.annotate(brl_rate=rate, brl_amount=amount)
+
+    def brl_totals(self):
+        """
+        Totais em Reais em uma única query (SUM no banco):
+        {'total': Decimal, 'paid': Decimal, 'to_pay': Decimal}
+        """
+        totals = self.with_brl().aggregate(
+            total=models.Sum('brl_amount'),
+            paid=models.Sum('brl_amount', filter=models.Q(is_paid=True)),
+        )
+        total = (totals['total'] or Decimal('0')).quantize(Decimal('0.01'))
+        paid = (totals['paid'] or Decimal('0')).quantize(Decimal('0.01'))
+        return {'total': total, 'paid': paid, 'to_pay': total - paid}
+
+    def brl_summary(self, *fields):
+        """
+        Soma em Reais agrupada no banco (GROUP BY) pelos campos informados.
+        Ex: brl_summary('category') -> [{'category': 'Hotel', 'total': Decimal}, ...]
+        Ordenado do maior para o menor total.
+        """
+        return self.with_brl().order_by().values(*fields).annotate(
+            total=models.Sum('brl_amount')
+        ).order_by('-total')
 
 # --- MODELO DE GASTOS ---
 class Expense(models.Model):
@@ -205,6 +363,15 @@ class Expense(models.Model):
     category = models.CharField(max_length=50, verbose_name="Categoria") # Ex: Alimentação, Transporte
     date = models.DateField(default=models.functions.Now)
 
+    # Foto da conversão para Reais (gravada ao salvar / comando recompute_expenses_brl)
+    exchange_rate = models.DecimalField(max_digits=14, decimal_places=8, null=True, blank=True, verbose_name="Cotação usada")
+    amount_brl = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, verbose_name="Valor (BRL)")
+
+    # Última alteração (cache do PDF); vazio nos gastos criados antes deste campo
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    objects = ExpenseQuerySet.as_manager()
+
     class Meta:
         ordering = ['date']
         verbose_name = "Gasto"
@@ -213,6 +380,102 @@ class Expense(models.Model):
     def __str__(self):
         return f"{self.description} - {self.currency} {self.amount}"
 
+    def save(self, *args, **kwargs):
+        # Recalcula a conversão, exceto em saves parciais que não mexem nela
+        # (ex: alternar 'pago' salva só update_fields=['is_paid'])
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'amount_brl' in update_fields:
+            self.update_brl_snapshot()
+        super().save(*args, **kwargs)
+
+    def update_brl_snapshot(self):
+        """Converte o valor para Reais pela cotação da data do gasto."""
+        # Importação local (utils importa models)
+        from .utils import get_rate_for_date
+
+        expense_date = self.date if isinstance(self.date, datetime.date) else timezone.localdate()
+        self.exchange_rate = get_rate_for_date(self.currency, expense_date)
+        self.amount_brl = (Decimal(str(self.amount)) * self.exchange_rate).quantize(Decimal('0.01'))
+
+# --- MODELO DE COTAÇÕES DE MOEDA ---
+class ExchangeRate(models.Model):
+    """
+    Cotação de uma moeda para Real (BRL) em um determinado dia.
+    Preenchida em lote pelo comando 'refresh_rates' (uma linha por moeda/dia),
+    serve de fonte persistente quando o cache está vazio ou a API fora do ar.
+    """
+    currency = models.CharField(max_length=3, choices=Expense.CURRENCY_CHOICES, verbose_name="Moeda")
+    date = models.DateField(verbose_name="Data")
+    rate = models.DecimalField(max_digits=14, decimal_places=8, verbose_name="Cotação (BRL)")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date', 'currency']
+        unique_together = ('currency', 'date') # Uma cotação por moeda por dia
+        verbose_name = "Cotação"
+        verbose_name_plural = "Cotações"
+
+    def __str__(self):
+        return f"{self.currency} {self.date}: R$ {self.rate}"
+
+# --- MODELO DE CACHE DE GEOCODIFICAÇÃO ---
+class GeocodeCache(models.Model):
+    """
+    Resultado do Geocoding do Google para um endereço, chaveado pelo endereço normalizado
+    (minúsculo, sem espaços repetidos). Compartilhado por todas as viagens: o mesmo hotel
+    só é consultado (e pago) uma vez. Preenchido por utils.geocode_address().
+    """
+    address_key = models.CharField(max_length=255, unique=True, verbose_name="Endereço Normalizado")
+    lat = models.DecimalField(max_digits=9, decimal_places=6)
+    lng = models.DecimalField(max_digits=9, decimal_places=6)
+    country_code = models.CharField(max_length=2, blank=True, default='', verbose_name="País (ISO)")
+    formatted_address = models.CharField(max_length=500, blank=True, default='', verbose_name="Endereço (Google)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Cache de Geocodificação"
+        verbose_name_plural = "Cache de Geocodificação"
+
+    def __str__(self):
+        return f"{self.address_key} ({self.lat}, {self.lng})"
+
+    def as_dict(self):
+        return {
+            'lat': self.lat,
+            'lng': self.lng,
+            'country_code': self.country_code,
+            'formatted_address': self.formatted_address,
+        }
+
+# --- MODELO DE PREVISÃO DO TEMPO (CACHE) ---
+class WeatherForecast(models.Model):
+    """
+    Previsão do tempo de um local em um dia, chaveada pelo endereço normalizado.
+    Preenchida pelo comando 'prefetch_weather' (e por utils.fetch_weather_data).
+    A validade (expires_at) depende da distância do dia: previsões próximas
+    mudam mais rápido que as de daqui a duas semanas.
+    """
+    location_key = models.CharField(max_length=255, verbose_name="Local Normalizado")
+    date = models.DateField(verbose_name="Data")
+    temp = models.SmallIntegerField(verbose_name="Temperatura Média (°C)")
+    condition = models.CharField(max_length=100, blank=True, default='', verbose_name="Condição")
+    icon = models.CharField(max_length=255, blank=True, default='', verbose_name="Ícone")
+    fetched_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField(verbose_name="Válida até")
+
+    class Meta:
+        ordering = ['date', 'location_key']
+        unique_together = ('location_key', 'date') # Uma previsão por local por dia
+        verbose_name = "Previsão do Tempo"
+        verbose_name_plural = "Previsões do Tempo"
+
+    def __str__(self):
+        return f"{self.location_key} {self.date}: {self.temp}°C"
+
+    def as_tuple(self):
+        return self.temp, self.condition, self.icon
+
 # --- MODELO DE ANEXOS DE ARQUIVOS ---
 class TripAttachment(models.Model):
     item = models.ForeignKey(TripItem, on_delete=models.CASCADE, related_name='attachments')
@@ -241,6 +504,45 @@ class TripCollaborator(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.trip.title} ({self.role})"
 
+# --- MODELO DE LINKS DE ASSINATURA DA AGENDA (.ICS) ---
+def new_feed_token():
+    return secrets.token_urlsafe(32)
+
+class CalendarFeedToken(models.Model):
+    """
+    Token secreto da URL de assinatura (.ics) que o Google/Apple Calendar consulta sem login.
+    Com `trip` preenchido, o feed é só daquela viagem; vazio, todas as viagens que o usuário vê.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calendar_feed_tokens')
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, null=True, blank=True, related_name='feed_tokens')
+    token = models.CharField(max_length=64, unique=True, default=new_feed_token)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'trip'], name='unique_feed_token_per_trip'),
+            # NULL não conta no unique acima: garante um único token "todas as viagens" por usuário
+            models.UniqueConstraint(fields=['user'], condition=models.Q(trip__isnull=True),
+                                    name='unique_feed_token_all_trips'),
+        ]
+        verbose_name = "Link de Agenda"
+        verbose_name_plural = "Links de Agenda"
+
+    def __str__(self):
+        return f"{self.user.username} - {self.trip.title if self.trip_id else 'Todas as viagens'}"
+
+    @classmethod
+    def for_user(cls, user, trip=None):
+        token, _ = cls.objects.get_or_create(user=user, trip=trip)
+        return token
+
+    def rotate(self):
+        """Gera um token novo: o link antigo para de funcionar na hora."""
+        from .ics import forget_feed_token  # Importação local (ics importa models)
+        forget_feed_token(self.token)
+        self.token = new_feed_token()
+        self.save(update_fields=['token'])
+
 # --- MODELO DE CONFIGURAÇÕES DE API ---
 class APIConfiguration(models.Model):
     KEY_CHOICES = [
@@ -0,0 +1,381 @@
+"""
+Geração de PDFs (roteiro e checklist) em segundo plano, com cache por conteúdo.
+
+O nome do arquivo leva um HMAC (SECRET_KEY) do "estado" da viagem (datas de alteração, contagens,
+total em BRL...): enquanto nada muda, o mesmo PDF é servido do disco; qualquer alteração gera um nome novo.
+Os arquivos ficam em PDF_CACHE_ROOT, FORA do media (que é servido sem login): só saem pelas views.
+
+O xhtml2pdf é Python puro e preso ao GIL: a conversão roda num pool de PROCESSOS
+(PdfRenderer), para vários PDFs (ex: exportação em lote) usarem todos os núcleos.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_futures
+from datetime import datetime
+from io import BytesIO
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connections
+from django.db.models import Count, Max, Sum
+from django.http import FileResponse, HttpResponse
+from django.shortcuts import render
+from django.template.loader import get_template
+from django.utils.crypto import salted_hmac
+from django.utils.text import slugify
+from .itinerary import build_itinerary_context
+from .metrics import record_cache, span
+from .pdf_render import render_pdf_bytes
+from .utils import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+PDF_ERROR_TIMEOUT = 60  # segundos que uma falha fica registrada antes de tentar de novo
+
+# Aumente quando o layout/template do PDF mudar: invalida todos os arquivos já gerados
+PDF_LAYOUT_VERSION = 1
+
+_executor = None
+_renderer = None
+_executor_lock = threading.Lock()
+
+
+class PdfQueueFull(Exception):
+    """A fila de renderização está cheia (PDF_RENDER_QUEUE_SIZE jobs pendentes)."""
+
+
+#-- Hash do estado da viagem --#
+def _fingerprint(*parts):
+    # HMAC com a SECRET_KEY: sem ela, não dá para calcular o nome do arquivo a partir de pk/datas
+    raw = '|'.join(str(part) for part in (PDF_LAYOUT_VERSION,) + parts)
+    return salted_hmac('core.pdf.fingerprint', raw, algorithm='sha256').hexdigest()
+
+def trip_pdf_fingerprint(trip, user):
+    """Hash de tudo que aparece no PDF do roteiro (2 queries de agregação)."""
+    items = trip.items.aggregate(count=Count('id'), changed=Max('updated_at'))
+    # brl: total em Reais como o PDF mostra (with_brl), ou seja, já com as cotações usadas
+    # nos gastos sem valor convertido salvo; cotação nova -> PDF novo
+    expenses = trip.expenses.with_brl().aggregate(
+        count=Count('id'), changed=Max('updated_at'), amount=Sum('amount'), brl=Sum('brl_amount')
+    )
+    return _fingerprint(
+        'roteiro', trip.pk, trip.updated_at, user.get_full_name() or user.username,
+        items['count'], items['changed'],
+        expenses['count'], expenses['changed'], expenses['amount'], expenses['brl'],
+    )
+
+def checklist_pdf_fingerprint(trip, checklist, user):
+    """Hash dos itens do checklist (sem data de alteração: usa o próprio conteúdo, que é pequeno)."""
+    rows = checklist.items.order_by('id').values_list('id', 'category', 'item', 'is_checked')
+    return _fingerprint('checklist', trip.pk, trip.title, user.get_full_name() or user.username, list(rows))
+
+
+#-- HTML dos PDFs --#
+def build_trip_pdf_html(trip, user):
+    """HTML do roteiro (itens ordenados + gastos com total em BRL), pronto para o xhtml2pdf."""
+    itinerary = build_itinerary_context(trip)
+    context = {
+        'trip': trip,
+        'items': itinerary.items,
+        'expenses': itinerary.expenses,
+        'total_brl': itinerary.totals['total'],
+        'user': user,
+        'now': datetime.now(),
+    }
+    return get_template('trips/trip_pdf.html').render(context)
+
+
+#-- Geração e cache dos arquivos --#
+def pdf_storage():
+    """Pasta privada dos PDFs em cache (PDF_CACHE_ROOT), lida a cada chamada (override_settings)."""
+    return FileSystemStorage(location=settings.PDF_CACHE_ROOT)
+
+def pdf_cache_path(kind, trip_id, fingerprint):
+    return f"{kind}_{trip_id}_{fingerprint}.pdf"
+
+class PdfRenderer:
+    """
+    Pool de processos que converte HTML em PDF.
+
+    - Fila limitada: no máximo `queue_size` jobs pendentes/em execução; quem chega depois
+      espera uma vaga até `wait` segundos e recebe PdfQueueFull se não conseguir.
+    - Timeout por job: um PDF que passa de `timeout` segundos derruba o pool
+      (é a única forma de parar um processo travado); os jobs em andamento falham e
+      o próximo submit cria processos novos.
+    """
+
+    def __init__(self, processes, queue_size, timeout):
+        self.processes = processes
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # 'spawn': os filhos não herdam conexões de banco nem locks das threads do worker
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            # ProcessPoolExecutor não cancela job em execução: encerra os processos na mão
+            for process in list((pool._processes or {}).values()):
+                process.terminate()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, html, wait=0):
+        """Enfileira um HTML e retorna o Future com os bytes do PDF."""
+        acquired = self._slots.acquire(timeout=wait) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            raise PdfQueueFull("Fila de geração de PDFs cheia, tente novamente em instantes.")
+        try:
+            future = self._get_pool().submit(render_pdf_bytes, html)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def render(self, html, wait=0):
+        """Gera um PDF esperando o resultado (bloqueia a thread, não o GIL)."""
+        future = self.submit(html, wait=wait)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._reset_pool()
+            raise TimeoutError(f"PDF demorou mais de {self.timeout}s para ser gerado")
+
+    def render_many(self, jobs, wait=0):
+        """
+        Gera vários PDFs em paralelo: {chave: html} -> {chave: bytes ou a exceção do job}.
+        O tempo total fica perto do PDF mais lento (com processos suficientes), não da soma.
+        """
+        results = {}
+        futures = {}
+        for key, html in jobs.items():
+            try:
+                futures[key] = self.submit(html, wait=wait)
+            except PdfQueueFull as e:
+                results[key] = e
+
+        _, pending = wait_futures(futures.values(), timeout=self.timeout)
+        if pending:
+            self._reset_pool()
+
+        for key, future in futures.items():
+            if future in pending:
+                results[key] = TimeoutError(f"PDF demorou mais de {self.timeout}s para ser gerado")
+            else:
+                results[key] = future.exception() or future.result()
+        return results
+
+
+def get_renderer():
+    global _renderer
+    with _executor_lock:
+        if _renderer is None:
+            _renderer = PdfRenderer(
+                processes=settings.PDF_RENDER_PROCESSES or os.cpu_count() or 1,
+                queue_size=max(settings.PDF_RENDER_QUEUE_SIZE, 1),
+                timeout=settings.PDF_RENDER_TIMEOUT,
+            )
+    return _renderer
+
+def _get_executor():
+    """Threads que só acompanham os jobs do pool de processos e gravam o resultado."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(settings.PDF_RENDER_QUEUE_SIZE, 1), thread_name_prefix='pdf'
+            )
+    return _executor
+
+def _store_pdf(kind, trip_id, path, pdf):
+    if not pdf_storage().exists(path):
+        pdf_storage().save(path, ContentFile(pdf))
+    purge_trip_pdfs(trip_id, kind=kind, keep=path)
+
+def _render_job(kind, trip_id, path, html):
+    """Executa em segundo plano: gera o PDF, grava na pasta privada e apaga as versões antigas."""
+    try:
+        with span('pdf_render'):
+            # Espera uma vaga na fila do pool pelo mesmo tempo máximo de uma geração
+            pdf = get_renderer().render(html, wait=settings.PDF_RENDER_TIMEOUT)
+        _store_pdf(kind, trip_id, path, pdf)
+    except Exception as e:
+        logger.error("Erro ao gerar PDF (%s): %s", path, e)
+        cache.set(make_cache_key('pdf_error', path), str(e), timeout=PDF_ERROR_TIMEOUT)
+    finally:
+        cache.delete(make_cache_key('pdf_lock', path))
+        # Thread fora do ciclo de request: fecha a conexão dela com o banco (cache em tabela)
+        connections.close_all()
+
+def get_or_render_pdf(kind, trip_id, fingerprint, build_html):
+    """
+    Retorna (caminho do PDF pronto, None), (None, None) se está sendo gerado
+    ou (None, mensagem) se a última tentativa falhou.
+    Na falta do arquivo, monta o HTML (barato) e dispara a geração (cara) em segundo plano,
+    uma única vez por versão mesmo com vários cliques/workers (lock no cache).
+    """
+    path = pdf_cache_path(kind, trip_id, fingerprint)
+    if pdf_storage().exists(path):
+        record_cache('pdf', 'hit')
+        return path, None
+
+    error = cache.get(make_cache_key('pdf_error', path))
+    if error:
+        return None, error
+
+    record_cache('pdf', 'miss')
+    if not settings.PDF_ASYNC:
+        # Modo síncrono (desenvolvimento): gera no próprio request
+        try:
+            with span('pdf_render'):
+                pdf = render_pdf_bytes(build_html())
+        except Exception as e:
+            return None, str(e)
+        _store_pdf(kind, trip_id, path, pdf)
+        return path, None
+
+    if cache.add(make_cache_key('pdf_lock', path), 1, timeout=settings.PDF_RENDER_TIMEOUT):
+        _get_executor().submit(_render_job, kind, trip_id, path, build_html())
+    return None, None
+
+def pdf_response(request, kind, trip_id, fingerprint, build_html, filename):
+    """Resposta da view: o PDF pronto, a página "gerando..." (202) ou o erro."""
+    path, error = get_or_render_pdf(kind, trip_id, fingerprint, build_html)
+    if path:
+        # 'inline' abre no navegador; o arquivo já está pronto, é só leitura
+        return FileResponse(pdf_storage().open(path, 'rb'), content_type='application/pdf',
+                            filename=filename, as_attachment=False)
+    if error:
+        return HttpResponse(f'Erro ao gerar PDF: {error}', status=500)
+    return render(request, 'trips/pdf_rendering.html', {'filename': filename}, status=202)
+
+def purge_trip_pdfs(trip_id, kind=None, keep=None):
+    """Apaga os PDFs em cache de uma viagem (todas as versões ou só as de um tipo), exceto `keep`."""
+    kinds = [kind] if kind else ['roteiro', 'checklist']
+    _purge_cached(tuple(f"{name}_{trip_id}_" for name in kinds), keep)
+
+def _purge_cached(prefixes, keep=None):
+    storage = pdf_storage()
+    try:
+        _, files = storage.listdir('')
+    except FileNotFoundError:
+        return
+    for name in files:
+        if name.startswith(prefixes) and name != keep:
+            storage.delete(name)
+
+
+#-- Exportação em lote (zip) --#
+def export_trip_pdfs_zip(trips, user, fingerprints=None):
+    """
+    Zip com o PDF do roteiro de cada viagem. Os que já estão em cache são só lidos;
+    os demais são gerados em paralelo no pool de processos e também ficam em cache.
+    Viagens que falharem vão listadas em ERROS.txt dentro do próprio zip.
+    `fingerprints` ({trip_id: hash}) evita recalcular os hashes já calculados pela view.
+    """
+    if fingerprints is None:
+        fingerprints = {trip.id: trip_pdf_fingerprint(trip, user) for trip in trips}
+
+    files = {}
+    jobs = {}
+    paths = {}
+    for trip in trips:
+        path = pdf_cache_path('roteiro', trip.id, fingerprints[trip.id])
+        paths[trip.id] = path
+        if pdf_storage().exists(path):
+            record_cache('pdf', 'hit')
+            with pdf_storage().open(path, 'rb') as f:
+                files[trip.id] = f.read()
+        else:
+            record_cache('pdf', 'miss')
+            jobs[trip.id] = build_trip_pdf_html(trip, user)
+
+    errors = []
+    if jobs:
+        with span('pdf_export_render'):
+            results = get_renderer().render_many(jobs, wait=settings.PDF_RENDER_TIMEOUT)
+        for trip_id, result in results.items():
+            if isinstance(result, Exception):
+                errors.append((trip_id, result))
+            else:
+                files[trip_id] = result
+                _store_pdf('roteiro', trip_id, paths[trip_id], result)
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for trip in trips:
+            if trip.id in files:
+                name = f"roteiro_{trip.id}_{slugify(trip.title) or 'viagem'}.pdf"
+                archive.writestr(name, files[trip.id])
+        if errors:
+            titles = {trip.id: trip.title for trip in trips}
+            lines = [f"{titles[trip_id]} (#{trip_id}): {error}" for trip_id, error in errors]
+            archive.writestr('ERROS.txt', '\n'.join(lines) + '\n')
+    return buffer.getvalue()
+
+def _store_export_zip(path, trips, user, fingerprints):
+    content = export_trip_pdfs_zip(trips, user, fingerprints)
+    if not pdf_storage().exists(path):
+        pdf_storage().save(path, ContentFile(content))
+    # Só o zip mais recente de cada usuário fica guardado
+    _purge_cached((f"roteiros_{user.id}_",), keep=path)
+
+def _export_job(path, trips, user, fingerprints):
+    """Executa em segundo plano: gera os PDFs que faltam e grava o zip na pasta privada."""
+    try:
+        with span('pdf_export'):
+            _store_export_zip(path, trips, user, fingerprints)
+    except Exception as e:
+        logger.error("Erro ao gerar o zip de PDFs (%s): %s", path, e)
+        cache.set(make_cache_key('pdf_error', path), str(e), timeout=PDF_ERROR_TIMEOUT)
+    finally:
+        cache.delete(make_cache_key('pdf_lock', path))
+        connections.close_all()
+
+def export_zip_response(request, trips, filename):
+    """
+    Resposta da view de exportação em lote, no mesmo esquema de pdf_response:
+    o zip pronto, a página "gerando..." (202, recarrega sozinha) ou o erro.
+    O request nunca espera a conversão (que passaria do timeout do gunicorn em contas grandes).
+    """
+    user = request.user
+    fingerprints = {trip.id: trip_pdf_fingerprint(trip, user) for trip in trips}
+    path = f"roteiros_{user.id}_{_fingerprint('zip', *sorted(fingerprints.items()))}.zip"
+
+    if pdf_storage().exists(path):
+        record_cache('pdf_zip', 'hit')
+        return FileResponse(pdf_storage().open(path, 'rb'), content_type='application/zip',
+                            filename=filename, as_attachment=True)
+
+    error = cache.get(make_cache_key('pdf_error', path))
+    if error:
+        return HttpResponse(f'Erro ao gerar os PDFs: {error}', status=500)
+
+    record_cache('pdf_zip', 'miss')
+    if not settings.PDF_ASYNC:
+        # Modo síncrono (desenvolvimento): gera no próprio request
+        try:
+            _store_export_zip(path, trips, user, fingerprints)
+        except PdfQueueFull as e:
+            return HttpResponse(str(e), status=503)
+        return FileResponse(pdf_storage().open(path, 'rb'), content_type='application/zip',
+                            filename=filename, as_attachment=True)
+
+    # Lock cobre a montagem dos HTMLs mais a conversão (até PDF_RENDER_TIMEOUT)
+    if cache.add(make_cache_key('pdf_lock', path), 1, timeout=settings.PDF_RENDER_TIMEOUT * 2):
+        _get_executor().submit(_export_job, path, trips, user, fingerprints)
+    return render(request, 'trips/pdf_rendering.html', {'filename': filename}, status=202)
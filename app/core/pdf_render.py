@@ -0,0 +1,17 @@
+"""
+Conversão HTML -> PDF executada nos processos do pool de renderização (core/pdf.py).
+
+Este módulo NÃO importa Django: os processos filhos são iniciados com 'spawn'
+e só precisam do xhtml2pdf para converter o HTML já montado pela view.
+"""
+from io import BytesIO
+from xhtml2pdf import pisa
+
+
+def render_pdf_bytes(html):
+    """HTML -> bytes do PDF (xhtml2pdf). Lança ValueError se o xhtml2pdf reportar erro."""
+    buffer = BytesIO()
+    status = pisa.CreatePDF(html, dest=buffer)
+    if status.err:
+        raise ValueError(f"xhtml2pdf retornou {status.err} erro(s)")
+    return buffer.getvalue()
@@ -1,6 +1,11 @@
+from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import AccessLog
+from .models import AccessLog, APIConfiguration, CalendarFeedToken, EmailConfiguration, Trip, TripCollaborator, TripItem
+from .ics import ICS_ITEM_FIELDS, forget_feed_token, forget_user_feed_tokens, invalidate_ics_feeds
+from .utils import invalidate_app_config
+from .pdf import purge_trip_pdfs
 
 # Função auxiliar para pegar o IP real (mesmo atrás do Docker/Proxy)
 def get_client_ip(request):
@@ -31,4 +36,76 @@ def log_logout(sender, user, request, **kwargs):
             action='LOGOUT',
             ip_address=get_client_ip(request),
             session_key=request.session.session_key
-        )
\ No newline at end of file
+        )
+
+# Sinais para manter as bandeiras da viagem (Trip.country_flags) em dia
+@receiver(post_save, sender=TripItem)
+def refresh_trip_flags_on_save(sender, instance, update_fields=None, **kwargs):
+    # Salvamentos parciais que não mexem no país (ex: só o clima) não mudam as bandeiras
+    if update_fields is not None and 'country_code' not in update_fields:
+        return
+    Trip.refresh_country_flags([instance.trip_id])
+
+@receiver(post_delete, sender=TripItem)
+def refresh_trip_flags_on_delete(sender, instance, **kwargs):
+    Trip.refresh_country_flags([instance.trip_id])
+
+# Sinais para recarregar as configurações (chaves de API e SMTP) em todos os processos
+@receiver(post_save, sender=APIConfiguration)
+@receiver(post_delete, sender=APIConfiguration)
+@receiver(post_save, sender=EmailConfiguration)
+@receiver(post_delete, sender=EmailConfiguration)
+def refresh_app_config(sender, **kwargs):
+    invalidate_app_config()
+
+# Viagem excluída: apaga os PDFs em cache dela (PDF_CACHE_ROOT)
+@receiver(post_delete, sender=Trip)
+def purge_trip_pdf_cache(sender, instance, **kwargs):
+    purge_trip_pdfs(instance.pk)
+
+# Feeds de agenda (.ics) em cache: descarta os afetados quando itens, viagem ou compartilhamento mudam
+@receiver(post_save, sender=TripItem)
+def invalidate_feeds_on_item_save(sender, instance, update_fields=None, **kwargs):
+    # Salvamentos parciais de campos que não vão para o .ics (ex: só o clima) não mudam o feed
+    if update_fields is not None and not set(update_fields) & set(ICS_ITEM_FIELDS):
+        return
+    invalidate_ics_feeds(instance.trip_id)
+
+@receiver(post_delete, sender=TripItem)
+def invalidate_feeds_on_item_delete(sender, instance, **kwargs):
+    invalidate_ics_feeds(instance.trip_id)
+
+@receiver(post_save, sender=Trip)
+def invalidate_feeds_on_trip_save(sender, instance, **kwargs):
+    invalidate_ics_feeds(instance.pk)
+
+@receiver(post_delete, sender=Trip)
+def invalidate_feeds_on_trip_delete(sender, instance, **kwargs):
+    # A viagem já não existe no banco: o dono é informado direto
+    invalidate_ics_feeds(instance.pk, user_ids=[instance.user_id])
+
+@receiver(post_save, sender=TripCollaborator)
+def invalidate_feeds_on_share(sender, instance, **kwargs):
+    # Inclui o "token não vale" guardado por pouco tempo antes do compartilhamento
+    forget_user_feed_tokens([instance.user_id])
+    invalidate_ics_feeds(user_ids=[instance.user_id])
+
+@receiver(post_delete, sender=TripCollaborator)
+def revoke_feeds_on_unshare(sender, instance, **kwargs):
+    # Quem perdeu o acesso perde também o link de assinatura daquela viagem
+    CalendarFeedToken.objects.filter(user_id=instance.user_id, trip_id=instance.trip_id).delete()
+    # O feed "todas as viagens" continua, mas sem esta viagem
+    forget_user_feed_tokens([instance.user_id])
+    invalidate_ics_feeds(user_ids=[instance.user_id])
+
+@receiver(post_save, sender=User)
+def forget_feed_tokens_on_user_save(sender, instance, created=False, update_fields=None, **kwargs):
+    # Usuário desativado (ou reativado) não pode continuar recebendo o feed pelo cache.
+    # Salvamentos parciais que não mexem em is_active (ex: last_login no login) não mudam nada.
+    if created or (update_fields is not None and 'is_active' not in update_fields):
+        return
+    forget_user_feed_tokens([instance.pk])
+
+@receiver(post_delete, sender=CalendarFeedToken)
+def forget_deleted_feed_token(sender, instance, **kwargs):
+    forget_feed_token(instance.token)
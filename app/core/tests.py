@@ -1,3 +1,419 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from django.contrib.auth.models import Group, User
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from .models import (
+    AccessLog, CalendarFeedToken, Checklist, ChecklistItem, ExchangeRate, Expense, Trip, TripAttachment,
+    TripCollaborator, TripItem, TripNote, TripPhoto,
+)
+from .urls import urlpatterns
+from .utils import cache_store, cached_call, match_location
 
-# Create your tests here.
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'core-tests'}}
+
+# Nada de API externa (clima, cotações, geocodificação) e um cache isolado do real
+OFFLINE_SETTINGS = {
+    'WEATHER_FETCH_ON_REQUEST': False,
+    'EXCHANGE_RATES_FETCH_ON_REQUEST': False,
+    'GEOCODE_ASYNC': True,
+    'QUERY_BUDGET_ENABLED': False,
+    'CACHES': LOCMEM_CACHE,
+}
+
+
+# --- CACHE SINGLE-FLIGHT (cached_call) ---
+@override_settings(CACHES=LOCMEM_CACHE)
+class CachedCallTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_call_the_loader_once(self):
+        calls = []
+        started = threading.Event()
+
+        def loader():
+            calls.append(1)
+            started.set()
+            time.sleep(0.3)
+            return 'valor'
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(cached_call('tests_sf', loader, timeout=60)))
+        first.start()
+        started.wait(2)
+        # Cache frio e o lock com a primeira thread: esta espera o resultado em vez de chamar o loader
+        results.append(cached_call('tests_sf', loader, timeout=60, wait_timeout=2))
+        first.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['valor', 'valor'])
+
+    def test_expired_value_is_served_while_another_worker_refreshes(self):
+        calls = []
+        cache_store('tests_stale', 'velho', timeout=-1, stale_timeout=60)
+        cache.add('tests_stale:lock', 1)
+
+        value = cached_call('tests_stale', lambda: calls.append(1) or 'novo', timeout=60)
+
+        self.assertEqual(value, 'velho')
+        self.assertEqual(calls, [])
+
+    def test_failure_is_cached_for_negative_timeout(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            raise ConnectionError('API fora do ar')
+
+        self.assertIsNone(cached_call('tests_neg', loader, timeout=60, negative_timeout=60))
+        self.assertIsNone(cached_call('tests_neg', loader, timeout=60, negative_timeout=60))
+        self.assertEqual(len(calls), 1)
+
+    def test_failure_keeps_the_last_good_value(self):
+        cache_store('tests_keep', 'bom', timeout=-1, stale_timeout=60)
+
+        value = cached_call('tests_keep', lambda: None, timeout=60, negative_timeout=60)
+
+        self.assertEqual(value, 'bom')
+        self.assertEqual(cached_call('tests_keep', lambda: 'novo', timeout=60), 'bom')
+
+
+# --- GASTOS EM REAIS (ExpenseQuerySet.with_brl) ---
+class ExpenseBrlTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('brl_owner', 'brl@example.com', 'x')
+        cls.trip = Trip.objects.create(
+            user=owner, title='Lisboa', start_date=date(2024, 3, 1), end_date=date(2024, 3, 20)
+        )
+        ExchangeRate.objects.bulk_create([
+            ExchangeRate(currency='EUR', date=date(2024, 3, 1), rate=Decimal('5.00')),
+            ExchangeRate(currency='EUR', date=date(2024, 3, 10), rate=Decimal('6.00')),
+        ])
+
+    def expense(self, day, currency='EUR', amount_brl=None):
+        # bulk_create não passa pelo save(), que gravaria o valor convertido (amount_brl)
+        expense, = Expense.objects.bulk_create([Expense(
+            trip=self.trip, description='Gasto', amount=Decimal('10'), currency=currency,
+            category='Passeios', date=day, amount_brl=amount_brl,
+        )])
+        return Expense.objects.with_brl({'EUR': 9, 'USD': 7}).get(pk=expense.pk)
+
+    def test_uses_the_last_rate_up_to_the_expense_date(self):
+        self.assertEqual(self.expense(date(2024, 3, 5)).brl_rate, Decimal('5.00'))
+        self.assertEqual(self.expense(date(2024, 3, 10)).brl_rate, Decimal('6.00'))
+        self.assertEqual(self.expense(date(2024, 3, 15)).brl_amount, Decimal('60.00'))
+
+    def test_without_history_uses_the_current_rates(self):
+        self.assertEqual(self.expense(date(2024, 2, 1)).brl_rate, Decimal('9'))
+        self.assertEqual(self.expense(date(2024, 3, 5), currency='USD').brl_amount, Decimal('70'))
+
+    def test_stored_snapshot_wins_over_the_rate_table(self):
+        self.assertEqual(self.expense(date(2024, 3, 15), amount_brl=Decimal('55.55')).brl_amount, Decimal('55.55'))
+
+
+# --- PAPÉIS NA VIAGEM (TripQuerySet.with_user_role) ---
+class TripRoleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner, cls.editor, cls.viewer, cls.outsider = (
+            User.objects.create_user(f'role_{name}', f'{name}@example.com', 'x')
+            for name in ('owner', 'editor', 'viewer', 'outsider')
+        )
+        cls.trips = [
+            Trip.objects.create(user=cls.owner, title=f'Viagem {i}', start_date=date(2024, 5, 1), end_date=date(2024, 5, 9))
+            for i in range(3)
+        ]
+        for trip in cls.trips:
+            TripCollaborator.objects.create(trip=trip, user=cls.editor, role='editor')
+            TripCollaborator.objects.create(trip=trip, user=cls.viewer, role='viewer')
+
+    def test_roles_for_a_whole_list_in_one_query(self):
+        expected = {self.owner: 'owner', self.editor: 'editor', self.viewer: 'viewer', self.outsider: None}
+        for user, role in expected.items():
+            with self.subTest(user=user.username), self.assertNumQueries(1):
+                trips = list(Trip.objects.with_user_role(user))
+                self.assertEqual({trip.user_role for trip in trips}, {role})
+                # get_user_role/can_edit usam a anotação, sem query por viagem
+                self.assertEqual([trip.can_edit(user) for trip in trips], [role in ('owner', 'editor')] * 3)
+
+    def test_visible_to_excludes_outsiders(self):
+        self.assertEqual(Trip.objects.visible_to(self.viewer).count(), 3)
+        self.assertEqual(Trip.objects.visible_to(self.outsider).count(), 0)
+
+
+# --- PAÍS E MOEDA PELO ENDEREÇO (match_location) ---
+class MatchLocationTests(SimpleTestCase):
+
+    def test_last_country_wins(self):
+        self.assertEqual(match_location('Rua X, Lisboa, Portugal'), ('pt', 'EUR'))
+        self.assertEqual(match_location('Av. Brasil 10, Lisboa, Portugal'), ('pt', 'EUR'))
+
+    def test_currency_comes_from_the_same_match_as_the_country(self):
+        # 'portugal' (rua) traz EUR, mas o país é o último nome: Brasil -> BRL
+        self.assertEqual(match_location('Av. Portugal 123, São Paulo, Brasil'), ('br', 'BRL'))
+
+    def test_city_only_gives_the_currency(self):
+        self.assertEqual(match_location('Rua X, Lisboa'), (None, 'EUR'))
+        self.assertEqual(match_location(''), (None, None))
+
+
+# --- EXPORTAÇÃO .ICS (ETag / If-None-Match) ---
+@override_settings(**OFFLINE_SETTINGS)
+class TripIcsExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('ics_owner', 'ics@example.com', 'x')
+        cls.trip = Trip.objects.create(user=cls.owner, title='Roma', start_date=date(2024, 6, 1), end_date=date(2024, 6, 5))
+        cls.item = TripItem.objects.create(
+            trip=cls.trip, item_type='ACTIVITY', name='Coliseu',
+            start_datetime=timezone.now(), end_datetime=timezone.now() + timedelta(hours=2),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.owner)
+        self.url = reverse('trip_export_ics', args=[self.trip.id])
+
+    def test_matching_etag_returns_304_without_reading_items(self):
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Coliseu', b''.join(response.streaming_content))
+
+        # Sessão + usuário + viagem + estado dos itens: nenhum item é carregado
+        with self.assertNumQueries(4):
+            cached = self.client.get(self.url, secure=True, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+
+    def test_item_change_changes_the_etag(self):
+        etag = self.client.get(self.url, secure=True)['ETag']
+
+        self.item.name = 'Coliseu (ingresso)'
+        self.item.save()
+
+        response = self.client.get(self.url, secure=True, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+# --- FEEDS DE AGENDA (LINK .ICS COM TOKEN) ---
+@override_settings(**OFFLINE_SETTINGS)
+class CalendarFeedTokenTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('feed_owner', 'feed-owner@example.com', 'x')
+        cls.guest = User.objects.create_user('feed_guest', 'feed-guest@example.com', 'x')
+        cls.trip = Trip.objects.create(user=cls.owner, title='Tóquio', start_date=date(2024, 9, 1), end_date=date(2024, 9, 10))
+        TripItem.objects.create(
+            trip=cls.trip, item_type='ACTIVITY', name='Shibuya',
+            start_datetime=timezone.now(), end_datetime=timezone.now() + timedelta(hours=1),
+        )
+
+    def setUp(self):
+        cache.clear()
+        TripCollaborator.objects.create(trip=self.trip, user=self.guest, role='viewer')
+
+    def feed(self, feed_token):
+        response = self.client.get(reverse('calendar_feed', args=[feed_token.token]), secure=True)
+        return response.status_code
+
+    def test_feed_is_served_from_the_cache(self):
+        token = CalendarFeedToken.for_user(self.guest, self.trip)
+        self.assertEqual(self.feed(token), 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.feed(token), 200)
+
+    def test_deactivated_user_loses_the_cached_feed(self):
+        trip_token, all_token = CalendarFeedToken.for_user(self.guest, self.trip), CalendarFeedToken.for_user(self.guest)
+        self.assertEqual((self.feed(trip_token), self.feed(all_token)), (200, 200))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.guest.is_active = False
+            self.guest.save()
+        self.assertEqual((self.feed(trip_token), self.feed(all_token)), (404, 404))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.guest.is_active = True
+            self.guest.save(update_fields=['is_active'])
+        self.assertEqual(self.feed(all_token), 200)
+
+    def test_removed_collaborator_loses_the_trip_feed(self):
+        trip_token, all_token = CalendarFeedToken.for_user(self.guest, self.trip), CalendarFeedToken.for_user(self.guest)
+        self.assertEqual(self.feed(trip_token), 200)
+        self.assertIn(b'Shibuya', self.client.get(reverse('calendar_feed', args=[all_token.token]), secure=True).content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TripCollaborator.objects.filter(trip=self.trip, user=self.guest).delete()
+
+        self.assertEqual(self.feed(trip_token), 404)
+        self.assertFalse(CalendarFeedToken.objects.filter(pk=trip_token.pk).exists())
+        # O feed "todas as viagens" continua valendo, sem a viagem que saiu
+        response = self.client.get(reverse('calendar_feed', args=[all_token.token]), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'Shibuya', response.content)
+
+
+# --- ORÇAMENTO DE QUERIES (N+1) ---
+# Rotas que alteram/apagam dados, chamam APIs externas (IA), geram arquivos em lote ou dependem de token: não são medidas
+SKIP_ROUTES = {
+    'trip_delete', 'trip_item_delete', 'expense_delete', 'attachment_delete', 'trip_note_delete',
+    'trip_photo_delete', 'user_delete', 'api_delete', 'config_api_delete', 'trip_remove_share',
+    'trip_expense_toggle_paid', 'checklist_toggle', 'checklist_delete_item', 'checklist_clear_completed',
+    'checklist_generate', 'trip_generate_itinerary', 'trip_generate_insights', 'trip_note_ai_generate',
+    'api_edit', 'config_api_edit', 'password_reset_confirm', 'trip_export_pdfs',
+}
+
+# Qual objeto semeado vai no parâmetro 'pk' de cada rota (os demais parâmetros se explicam pelo nome)
+PK_OBJECTS = {
+    'trip_item_update': 'item',
+    'expense_update': 'expense',
+    'user_update': 'user',
+}
+PARAM_OBJECTS = {'trip_id': 'trip', 'item_id': 'item', 'note_id': 'note'}
+
+# Tamanhos da massa de dados (viagens, itens por viagem, gastos, etc.)
+QUERY_BUDGET_SIZES = (1, 3, 5)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Semeia a massa de dados em vários tamanhos e confere que cada tela (GET em core/urls.py)
+    faz o mesmo número de queries em todos eles: uma rota que cresce com os dados é um N+1.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # PDFs gerados no próprio request (sem jobs em segundo plano) numa pasta temporária
+        cls.media_root = tempfile.mkdtemp(prefix='query-budget-')
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(
+            **OFFLINE_SETTINGS,
+            PDF_ASYNC=False,
+            MEDIA_ROOT=cls.media_root,
+            PDF_CACHE_ROOT=f"{cls.media_root}/pdf_cache",
+        ))
+
+    def test_queries_do_not_grow_with_data(self):
+        routes = [p for p in urlpatterns if isinstance(p, URLPattern) and p.name and p.name not in SKIP_ROUTES]
+        baseline = {}
+
+        for size in QUERY_BUDGET_SIZES:
+            with transaction.atomic():
+                objects = self.seed(size)
+                self.client.force_login(objects['owner'])
+                urls = self.route_urls(routes, objects)
+
+                # Primeira passada só aquece caches (sessão, content types, etc.)
+                for url in urls.values():
+                    self.fetch(url)
+
+                for name, url in urls.items():
+                    if name not in baseline:
+                        with CaptureQueriesContext(connection) as ctx:
+                            response = self.fetch(url)
+                        baseline[name] = len(ctx.captured_queries)
+                        self.assertLess(response.status_code, 500, name)
+                        continue
+
+                    with self.subTest(route=name, size=size), self.assertNumQueries(baseline[name]):
+                        self.fetch(url)
+
+                # Desfaz a massa deste tamanho antes do próximo
+                transaction.set_rollback(True)
+
+        self.assertTrue(baseline)
+
+    def fetch(self, url):
+        """GET completo: o conteúdo em streaming (.ics, PDF) também é lido, e as queries dele contam."""
+        response = self.client.get(url, secure=True)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        response.close()
+        return response
+
+    def route_urls(self, routes, objects):
+        urls = {}
+        for route in routes:
+            kwargs = {}
+            for param in route.pattern.converters:
+                key = PK_OBJECTS.get(route.name, 'trip') if param == 'pk' else PARAM_OBJECTS.get(param)
+                if key is None:
+                    break
+                kwargs[param] = objects[key].pk
+            else:
+                urls[route.name] = reverse(route.name, kwargs=kwargs)
+        return urls
+
+    def seed(self, size):
+        """Cria um dono com `size` viagens, cada uma com `size` itens, gastos, notas, fotos e colaboradores."""
+        today = date.today()
+        now = timezone.now()
+
+        owner = User.objects.create_superuser('query_budget_owner', 'query-budget@example.com', 'x')
+        groups = [Group.objects.create(name=f'query-budget-{i}') for i in range(size)]
+        collaborators = []
+        for i in range(size):
+            user = User.objects.create_user(f'query_budget_user_{i}', f'user{i}@example.com', 'x')
+            user.groups.add(*groups)
+            collaborators.append(user)
+
+        trips = []
+        for t in range(size):
+            trip = Trip.objects.create(
+                user=owner, title=f'Viagem {t}',
+                start_date=today + timedelta(days=t), end_date=today + timedelta(days=t + size),
+            )
+            trips.append(trip)
+
+            items = [
+                TripItem.objects.create(
+                    trip=trip, item_type='HOTEL', name=f'Hotel {i}',
+                    start_datetime=now + timedelta(days=i), end_datetime=now + timedelta(days=i + 1),
+                    location_address=f'Rua {i}, Paris, France', location_lat=48.85, location_lng=2.35,
+                )
+                for i in range(size)
+            ]
+            for i, item in enumerate(items):
+                Expense.objects.create(
+                    trip=trip, item=item, description=f'Gasto {i}', amount=100 + i,
+                    currency='EUR' if i % 2 else 'BRL', category='Hospedagem', date=today,
+                )
+                TripAttachment.objects.create(item=item, file='trip_files/query-budget.pdf')
+                TripNote.objects.create(trip=trip, title=f'Nota {i}', content='Texto')
+                TripPhoto.objects.create(trip=trip, image='trip_photos/query-budget.jpg')
+                TripCollaborator.objects.create(trip=trip, user=collaborators[i], role='editor' if i % 2 else 'viewer')
+
+            checklist = Checklist.objects.create(trip=trip)
+            ChecklistItem.objects.bulk_create(
+                ChecklistItem(checklist=checklist, category='Geral', item=f'Item {i}') for i in range(size)
+            )
+
+        AccessLog.objects.bulk_create(
+            AccessLog(user=user, action='LOGIN', ip_address='127.0.0.1') for user in collaborators
+        )
+
+        trip = trips[0]
+        return {
+            'owner': owner,
+            'trip': trip,
+            'item': trip.items.first(),
+            'expense': trip.expenses.first(),
+            'note': trip.notes.first(),
+            'user': collaborators[0],
+        }
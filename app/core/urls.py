@@ -16,6 +16,7 @@ urlpatterns = [
     path('viagens/<int:pk>/editar/', views.trip_update, name='trip_update'),
     path('viagens/<int:pk>/excluir/', views.trip_delete, name='trip_delete'),
     path('trips/<int:pk>/pdf/', views.trip_detail_pdf, name='trip_detail_pdf'),
+    path('trips/export/pdfs/', views.trip_export_pdfs, name='trip_export_pdfs'),
     path('viagens/<int:pk>/calendario/', views.trip_calendar, name='trip_calendar'),
     path('sobre/', views.about_view, name='about'),
 
@@ -50,6 +51,7 @@ urlpatterns = [
     path('financeiro/', views.financial_dashboard, name='financial_dashboard'),
     path('financeiro/api/chart-data/', views.financial_chart_api, name='financial_chart_api'),
     path('fix-locations/', views.fix_locations, name='fix_locations'),
+    path('viagens/<int:trip_id>/geocoding/', views.trip_geocode_status, name='trip_geocode_status'),
     path('gastos/<int:pk>/alternar-pagamento/', views.trip_expense_toggle_paid, name='trip_expense_toggle_paid'),
 
     # Rotas de Gestão de Usuários
@@ -61,6 +63,8 @@ urlpatterns = [
     # Rotas para Importação / Exportação Google Calender
     path('viagens/<int:trip_id>/export-ics/', views.trip_export_ics, name='trip_export_ics'),
     path('viagens/<int:trip_id>/import-ics/', views.trip_import_ics, name='trip_import_ics'),
+    path('viagens/<int:trip_id>/agenda/assinar/', views.trip_calendar_feed, name='trip_calendar_feed'),
+    path('agenda/<str:token>.ics', views.calendar_feed, name='calendar_feed'),
 
     # Rotas de Perfil do Usuário
     path('profile/', views.profile_view, name='user_profile'),
@@ -130,4 +134,7 @@ urlpatterns = [
 
     # Rota para o CHANGELOG
     path('changelog/', views.changelog_view, name='changelog'),
+
+    # Métricas para o Prometheus
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,21 +1,34 @@
 import json
+import hashlib
+import logging
 import requests
 import re
+import time
+import threading
+from functools import lru_cache
+from collections import namedtuple
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from django.conf import settings
 from datetime import timedelta, datetime
 from openai import OpenAI
-from .models import APIConfiguration, Trip
+from .models import APIConfiguration, EmailConfiguration, Trip, TripItem, Expense, ExchangeRate, GeocodeCache, WeatherForecast
 from django.core.mail import get_connection
 from django.core.cache import cache
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from decimal import Decimal
+from .metrics import upstream_call, record_cache
+
+logger = logging.getLogger(__name__)
 
 
 #-- Função Adicional para Buscar Dicas de Viagem AI --#
 def get_travel_intel(destination):
-    # 1. Busca chave no banco
-    try:
-        config = APIConfiguration.objects.get(key='OPENAI_API', is_active=True)
-        api_key = config.value
-    except APIConfiguration.DoesNotExist:
+    # 1. Busca chave no banco (em cache)
+    api_key = get_api_key('OPENAI_API')
+    if not api_key:
         return None
 
     client = OpenAI(api_key=api_key)
@@ -35,146 +48,602 @@ def get_travel_intel(destination):
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", # Modelo barato e rápido
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
-        )
+        with upstream_call('openai'):
+            response = client.chat.completions.create(
+                model="gpt-4o-mini", # Modelo barato e rápido
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"}
+            )
         return json.loads(response.choices[0].message.content)
     except Exception as e:
         print(f"Erro OpenAI: {e}")
         return None
 
+#-- Função Adicional para Cache com Proteção contra Stampede --#
+def make_cache_key(prefix, *parts):
+    """
+    Monta uma chave de cache segura (sem espaços/acentos, tamanho fixo)
+    a partir de textos livres como endereços.
+    """
+    raw = '|'.join(str(part).strip().lower() for part in parts)
+    return f"{prefix}_{hashlib.md5(raw.encode('utf-8')).hexdigest()}"
+
+def cache_store(key, value, timeout, stale_timeout=0):
+    """
+    Grava um valor no formato usado por cached_call:
+    fica "fresco" por `timeout` segundos e ainda pode ser servido
+    como "velho" (stale) por mais `stale_timeout` segundos.
+    """
+    entry = {'value': value, 'expires_at': time.time() + timeout}
+    cache.set(key, entry, timeout=timeout + stale_timeout)
+
+def cached_call(key, loader, timeout, stale_timeout=0, negative_timeout=60, lock_timeout=30, wait_timeout=5, cache_name=None):
+    """
+    Cache "single-flight" para chamadas caras (APIs pagas):
+    1. Valor fresco no cache -> retorna direto.
+    2. Expirou -> apenas UM worker (lock via cache.add) chama o `loader`;
+       os demais recebem o valor velho enquanto isso (stale-while-revalidate).
+    3. Cache frio e outro worker já buscando -> espera até `wait_timeout` pelo resultado.
+    4. Falha do loader (exceção ou None) -> guarda o "negativo" por `negative_timeout`,
+       evitando que cada request bata de novo na API fora do ar.
+    `cache_name` agrupa as chaves nas métricas de acerto (ex: 'geocode'); padrão: a própria chave.
+    """
+    cache_name = cache_name or key
+    entry = cache.get(key)
+    if entry is not None and entry['expires_at'] > time.time():
+        record_cache(cache_name, 'hit')
+        return entry['value']
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=lock_timeout):
+        record_cache(cache_name, 'miss')
+        try:
+            try:
+                value = loader()
+            except Exception as e:
+                logger.warning("Erro ao atualizar cache (%s): %s", key, e)
+                value = None
+
+            if value is None:
+                # Negative caching: mantém o último valor bom (se houver) por mais um tempo
+                stale_value = entry['value'] if entry is not None else None
+                cache_store(key, stale_value, negative_timeout, stale_timeout)
+                return stale_value
+
+            cache_store(key, value, timeout, stale_timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    # Outro worker já está atualizando esta chave
+    if entry is not None:
+        record_cache(cache_name, 'stale')
+        return entry['value']
+
+    record_cache(cache_name, 'miss')
+
+    deadline = time.time() + wait_timeout
+    while time.time() < deadline:
+        time.sleep(0.1)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+    return None
+
+#-- Função Adicional para Ler as Configurações (APIs e E-mail) em Cache --#
+# Valores "tipados" (somente leitura) das tabelas APIConfiguration e EmailConfiguration
+ApiConfig = namedtuple('ApiConfig', ['key', 'value', 'is_active'])
+EmailSettings = namedtuple('EmailSettings', [
+    'backend', 'host', 'port', 'username', 'password', 'use_tls', 'use_ssl', 'default_from_email'
+])
+
+# Foto imutável das configurações carregadas: quem leu continua com a sua, mesmo se outra
+# thread recarregar ou invalidar no meio do request (a troca é só da referência global)
+AppConfig = namedtuple('AppConfig', ['version', 'checked_at', 'api', 'email'])
+
+CONFIG_VERSION_KEY = 'app_config_version'
+CONFIG_CHECK_INTERVAL = 5  # segundos entre conferências da versão no cache compartilhado
+_config_snapshot = None
+_config_lock = threading.Lock()
+
+def _load_app_config():
+    """
+    Carrega TODAS as configurações (2 queries) e guarda na memória do processo (AppConfig).
+    Cada save/delete grava uma nova "versão" no cache compartilhado (invalidate_app_config);
+    o processo confere essa versão no máximo a cada CONFIG_CHECK_INTERVAL segundos
+    e só recarrega do banco quando ela muda.
+    """
+    global _config_snapshot
+    snapshot = _config_snapshot
+    now = time.monotonic()
+    if snapshot is not None and now - snapshot.checked_at < CONFIG_CHECK_INTERVAL:
+        record_cache('app_config', 'hit')
+        return snapshot
+
+    version = cache.get(CONFIG_VERSION_KEY)
+    if version is None:
+        cache.add(CONFIG_VERSION_KEY, str(time.time_ns()), timeout=None)
+        version = cache.get(CONFIG_VERSION_KEY)
+
+    with _config_lock:
+        snapshot = _config_snapshot
+        if snapshot is None or snapshot.version != version:
+            record_cache('app_config', 'miss')
+            api = {
+                row.key: ApiConfig(row.key, row.value, row.is_active)
+                for row in APIConfiguration.objects.all()
+            }
+            email = EmailConfiguration.objects.first()
+            if email:
+                email = EmailSettings(
+                    email.backend, email.host, int(email.port), email.username, email.password,
+                    bool(email.use_tls), bool(email.use_ssl), email.default_from_email
+                )
+            snapshot = AppConfig(version, now, MappingProxyType(api), email)
+        else:
+            record_cache('app_config', 'hit')
+            snapshot = snapshot._replace(checked_at=now)
+        _config_snapshot = snapshot
+    return snapshot
+
+def _expire_app_config():
+    """Força a próxima leitura a recarregar, sem apagar os dados que outra thread pode estar usando."""
+    global _config_snapshot
+    with _config_lock:
+        if _config_snapshot is not None:
+            _config_snapshot = _config_snapshot._replace(version=None, checked_at=0.0)
+
+def invalidate_app_config():
+    """Chamado pelos signals ao salvar/excluir uma configuração: todos os processos recarregam."""
+    def bump():
+        cache.set(CONFIG_VERSION_KEY, str(time.time_ns()), timeout=None)
+        _expire_app_config()
+
+    _expire_app_config()
+    # Só depois do commit: outro processo não pode recarregar a versão nova com os dados antigos
+    transaction.on_commit(bump)
+
+def get_api_config(key):
+    """ApiConfig (key, value, is_active) cadastrada para a chave (ex: 'OPENAI_API') ou None."""
+    return _load_app_config().api.get(key)
+
+def get_api_key(key, active_only=True):
+    """Valor da chave de API (ex: 'WEATHER_API') ou None se não cadastrada/inativa."""
+    config = get_api_config(key)
+    if config and config.value and (config.is_active or not active_only):
+        return config.value
+    return None
+
+def get_email_settings():
+    """EmailSettings da configuração SMTP cadastrada ou None."""
+    return _load_app_config().email
+
 #-- Função Adicional para Buscar Cotação de Moeda --#
-def get_exchange_rate(from_currency):
+# Valores fixos: usados apenas se nunca houve conexão com a API
+FALLBACK_RATES = {
+    'USD': 5.85, 
+    'EUR': 6.15, 
+    'GBP': 7.30,
+    'CAD': 4.15,
+    'AUD': 3.75,
+    'CHF': 6.45,
+    'JPY': 0.039,
+    'CLP': 0.0060,
+    'ARS': 0.0058,
+    'UYU': 0.13,
+    'COP': 0.0013,
+    'PEN': 1.55
+}
+
+# Tabela completa de cotações (todas as moedas de uma vez)
+RATES_CACHE_KEY = 'exchange_rates'
+RATES_CACHE_TIMEOUT = 60 * 60  # 1 hora "fresca"
+# Última cotação válida de cada moeda (backup de longo prazo)
+# Também é o tempo em que a tabela velha ainda pode ser servida (stale)
+RATES_LAST_GOOD_TIMEOUT = 60 * 60 * 24 * 30  # 30 dias
+# Tabela carregada do banco (busca no request desligada)
+RATES_STORED_CACHE_TIMEOUT = 60 * 5  # 5 minutos
+# Falha total (API e banco): não tenta de novo antes disso
+RATES_NEGATIVE_TIMEOUT = 60  # 1 minuto
+
+def fetch_exchange_rates():
     """
-    Busca a cotação atual de uma moeda para Real (BRL).
-    Prioridade:
-    1. API em Tempo Real
-    2. Cache (Última cotação válida coletada)
-    3. Valor Fixo (Apenas se nunca houve conexão)
+    Busca as cotações de TODAS as moedas de Expense.CURRENCY_CHOICES
+    em uma única requisição (a API aceita vários pares: USD-BRL,EUR-BRL,...).
+    Retorna {'USD': 5.85, 'EUR': 6.15, ...}. Lança exceção se a API falhar.
     """
-    if from_currency == 'BRL':
-        return 1.0
-    
-    # Define uma chave única para salvar essa moeda
-    cache_key = f"exchange_rate_{from_currency}"
-    
-    try:
-        # Tenta conectar na API
-        url = f"https://economia.awesomeapi.com.br/json/last/{from_currency}-BRL"
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        
+    currencies = [code for code, _ in Expense.CURRENCY_CHOICES if code != 'BRL']
+    pairs = ','.join(f"{code}-BRL" for code in currencies)
+
+    url = f"https://economia.awesomeapi.com.br/json/last/{pairs}"
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+    with upstream_call('exchange_rates'):
         response = requests.get(url, timeout=5, headers=headers)
         response.raise_for_status()
-        
-        data = response.json()
-        key = f"{from_currency}BRL"
-        rate = float(data[key]['bid'])
-        
-        # SUCESSO!
-        # Salva este valor no cache por 30 dias (tempo longo para servir de backup)
-        # Assim, garantimos que "a última cotação coletada" fique salva.
-        cache.set(cache_key, rate, timeout=60*60*24*30)
-        
-        return rate
+    data = response.json()
+
+    rates = {}
+    for code in currencies:
+        entry = data.get(f"{code}BRL")
+        if entry:
+            rates[code] = float(entry['bid'])
+    return rates
+
+def save_exchange_rates(rates, date=None):
+    """
+    Grava as cotações na tabela ExchangeRate (uma linha por moeda/dia),
+    em uma única query de upsert.
+    """
+    date = date or timezone.localdate()
+    _upsert_exchange_rates(
+        [ExchangeRate(currency=code, date=date, rate=Decimal(str(rate))) for code, rate in rates.items()]
+    )
+
+def save_exchange_rate_history(currency, history):
+    """
+    Grava o histórico de uma moeda ({data: cotação}) em lote.
+    Retorna quantas linhas foram gravadas.
+    """
+    rows = [ExchangeRate(currency=currency, date=day, rate=Decimal(str(rate))) for day, rate in history.items()]
+    _upsert_exchange_rates(rows)
+    return len(rows)
+
+def _upsert_exchange_rates(rows):
+    ExchangeRate.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['currency', 'date'],
+        update_fields=['rate', 'updated_at'],
+    )
+
+def fetch_exchange_rate_history(currency, start_date, end_date):
+    """
+    Busca as cotações diárias de uma moeda para BRL entre duas datas
+    (endpoint /json/daily da mesma API). Retorna {date: cotação}.
+    Lança exceção se a API falhar.
+    """
+    days = (end_date - start_date).days + 1
+    url = f"https://economia.awesomeapi.com.br/json/daily/{currency}-BRL/{days}"
+    params = {
+        'start_date': start_date.strftime('%Y%m%d'),
+        'end_date': end_date.strftime('%Y%m%d'),
+    }
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+    with upstream_call('exchange_rates_history'):
+        response = requests.get(url, params=params, timeout=10, headers=headers)
+        response.raise_for_status()
+
+    history = {}
+    for entry in response.json():
+        # A API devolve do mais recente para o mais antigo; fica a última cotação de cada dia
+        day = datetime.fromtimestamp(int(entry['timestamp']), tz=timezone.get_current_timezone()).date()
+        if start_date <= day <= end_date and day not in history:
+            history[day] = float(entry['bid'])
+    return history
+
+def load_stored_exchange_rates():
+    """
+    Lê do banco a cotação mais recente de cada moeda (uma única query).
+    Retorna {'USD': 5.85, ...} ou {} se a tabela estiver vazia.
+    """
+    latest_date = ExchangeRate.objects.filter(
+        currency=OuterRef('currency')
+    ).order_by('-date').values('date')[:1]
 
+    stored = ExchangeRate.objects.filter(date=Subquery(latest_date)).values_list('currency', 'rate')
+    return {code: float(rate) for code, rate in stored}
+
+def refresh_exchange_rates():
+    """
+    Atualiza a tabela de cotações no cache (uma chamada para todas as moedas)
+    e no banco (ExchangeRate do dia).
+    Também salva cada moeda como "última cotação válida" por 30 dias.
+    Retorna o dicionário de taxas ou None se a API falhar.
+    """
+    try:
+        rates = fetch_exchange_rates()
     except Exception as e:
-        print(f"Erro ao buscar cotação ({from_currency}): {e}")
-        
-        # FALHA NA API:
-        # 1. Tenta pegar a "última cotação coletada" do cache
-        cached_rate = cache.get(cache_key)
-        if cached_rate:
-            print(f"Fallback: Usando valor em cache para {from_currency}: {cached_rate}")
-            return cached_rate
-
-        # 2. Cache vazio? (Primeira vez rodando sem internet?)
-        # Só então usamos os valores fixos
-        print(f"Fallback Crítico: Usando valor fixo para {from_currency}")
-        fallback_rates = {
-            'USD': 5.85, 
-            'EUR': 6.15, 
-            'GBP': 7.30,
-            'CAD': 4.15,
-            'AUD': 3.75,
-            'CHF': 6.45,
-            'JPY': 0.039,
-            'CLP': 0.0060,
-            'ARS': 0.0058,
-            'UYU': 0.13,
-            'COP': 0.0013,
-            'PEN': 1.55
-        }
-        return fallback_rates.get(from_currency, 1.0)
+        logger.warning("Erro ao buscar cotações: %s", e)
+        return None
+
+    cache_store(RATES_CACHE_KEY, rates, RATES_CACHE_TIMEOUT, RATES_LAST_GOOD_TIMEOUT)
+    cache.set_many(
+        {f"exchange_rate_{code}": rate for code, rate in rates.items()},
+        timeout=RATES_LAST_GOOD_TIMEOUT
+    )
+
+    try:
+        save_exchange_rates(rates)
+    except Exception as e:
+        logger.error("Erro ao gravar cotações no banco: %s", e)
+    return rates
+
+def _load_exchange_rates():
+    """Carrega a tabela para o cache: API (se permitido no request) e depois o banco."""
+    if settings.EXCHANGE_RATES_FETCH_ON_REQUEST:
+        rates = refresh_exchange_rates()
+        if rates:
+            return rates
+    return load_stored_exchange_rates() or None
+
+def get_exchange_rates():
+    """
+    Retorna a "foto" completa da tabela de cotações para Real (BRL),
+    ex: {'BRL': 1.0, 'USD': 5.85, ...}. As views chamam uma única vez por request.
+    Prioridade:
+    1. Cache (tabela fresca, mantida pelo comando 'refresh_rates')
+    2. API em Tempo Real (uma requisição para todas as moedas)
+       -> Só se EXCHANGE_RATES_FETCH_ON_REQUEST estiver ligado
+    3. Banco (cotação mais recente gravada em ExchangeRate)
+    4. Cache (Última cotação válida coletada de cada moeda)
+    5. Valor Fixo (Apenas se nunca houve conexão)
+    """
+    if settings.EXCHANGE_RATES_FETCH_ON_REQUEST:
+        timeout = RATES_CACHE_TIMEOUT
+    else:
+        timeout = RATES_STORED_CACHE_TIMEOUT
+
+    # Apenas um worker por vez atualiza a tabela; os outros usam a versão em cache
+    rates = cached_call(
+        RATES_CACHE_KEY, _load_exchange_rates,
+        timeout=timeout,
+        stale_timeout=RATES_LAST_GOOD_TIMEOUT,
+        negative_timeout=RATES_NEGATIVE_TIMEOUT,
+        cache_name='exchange_rates'
+    ) or {}
+
+    table = {'BRL': 1.0}
+    missing = [code for code, _ in Expense.CURRENCY_CHOICES if code != 'BRL' and code not in rates]
+    last_good = cache.get_many([f"exchange_rate_{code}" for code in missing]) if missing else {}
+
+    for code, _ in Expense.CURRENCY_CHOICES:
+        if code == 'BRL':
+            continue
+        if code in rates:
+            table[code] = rates[code]
+        elif f"exchange_rate_{code}" in last_good:
+            table[code] = last_good[f"exchange_rate_{code}"]
+        else:
+            logger.warning("Fallback Crítico: Usando valor fixo para %s", code)
+            table[code] = FALLBACK_RATES.get(code, 1.0)
+    return table
+
+def get_rate_for_date(currency, date):
+    """
+    Cotação (Decimal) de uma moeda para BRL na data informada:
+    último valor de ExchangeRate até a data; sem histórico, usa a tabela atual.
+    """
+    if currency == 'BRL':
+        return Decimal('1')
+
+    stored = ExchangeRate.objects.filter(
+        currency=currency, date__lte=date
+    ).order_by('-date').values_list('rate', flat=True).first()
+    if stored is not None:
+        return stored
+    return Decimal(str(get_exchange_rate(currency)))
+
+def get_exchange_rate(from_currency):
+    """
+    Busca a cotação de uma moeda para Real (BRL) a partir da tabela compartilhada.
+    """
+    if from_currency == 'BRL':
+        return 1.0
+    return get_exchange_rates().get(from_currency, FALLBACK_RATES.get(from_currency, 1.0))
 
 #-- Função Adicional para Mapear Moeda por País/Cidade --#
 def get_currency_by_country(country_name):
     """
     Mapeia nomes de países E CIDADES (que vêm do Google Maps) para códigos de moeda.
+    Usa o mesmo reconhecedor de get_country_code_from_address (ver match_location).
     """
-    if not country_name:
-        return None
-        
-    text = country_name.lower().strip()
-    
-    mapping = {
-        # Europa (Países e Capitais Principais)
-        'france': 'EUR', 'frança': 'EUR', 'paris': 'EUR',
-        'germany': 'EUR', 'alemanha': 'EUR', 'berlin': 'EUR', 'berlim': 'EUR',
-        'italy': 'EUR', 'itália': 'EUR', 'rome': 'EUR', 'roma': 'EUR',
-        'spain': 'EUR', 'espanha': 'EUR', 'madrid': 'EUR', 'barcelona': 'EUR',
-        'portugal': 'EUR', 'lisbon': 'EUR', 'lisboa': 'EUR',
-        'netherlands': 'EUR', 'holanda': 'EUR', 'amsterdam': 'EUR',
-        'united kingdom': 'GBP', 'reino unido': 'GBP', 'england': 'GBP', 'inglaterra': 'GBP', 'london': 'GBP', 'londres': 'GBP',
-        'switzerland': 'CHF', 'suíça': 'CHF', 'zurich': 'CHF',
-        
-        # Américas
-        'united states': 'USD', 'estados unidos': 'USD', 'usa': 'USD', 'ny': 'USD', 'miami': 'USD', 'orlando': 'USD',
-        'canada': 'CAD', 'canadá': 'CAD', 'toronto': 'CAD', 'vancouver': 'CAD',
-        'chile': 'CLP', 'santiago': 'CLP',
-        'argentina': 'ARS', 'buenos aires': 'ARS',
-        'uruguay': 'UYU', 'uruguai': 'UYU', 'montevideo': 'UYU',
-        'colombia': 'COP', 'colômbia': 'COP',
-        'peru': 'PEN', 'lima': 'PEN',
-        
-        # Ásia / Oceania
-        'japan': 'JPY', 'japão': 'JPY', 'tokyo': 'JPY',
-        'australia': 'AUD', 'austrália': 'AUD', 'sydney': 'AUD',
-    }
-    
-    for key, currency in mapping.items():
-        if key in text:
-            return currency
-            
-    return None
+    return match_location(country_name)[1]
 
 #-- Função Adicional para Buscar Clima --#
+WEATHER_STALE_TIMEOUT = 60 * 60 * 12
+WEATHER_NEGATIVE_TIMEOUT = 60 * 10  # Local/data sem previsão: não tenta por 10 min
+WEATHER_FORECAST_DAYS = 14  # Alcance da previsão na WeatherAPI
+
+def weather_ttl(day):
+    """
+    Validade (segundos) da previsão de um dia, conforme a distância até ele:
+    dias passados não mudam mais; amanhã muda várias vezes ao dia; daqui a 10 dias, pouco.
+    """
+    days_ahead = (day - timezone.localdate()).days
+    if days_ahead < 0:
+        return 60 * 60 * 24 * 30  # 30 dias
+    if days_ahead <= 2:
+        return 60 * 60 * 3   # 3 horas
+    if days_ahead <= 7:
+        return 60 * 60 * 6   # 6 horas
+    return 60 * 60 * 12      # 12 horas
+
+def get_weather_api_key():
+    """Chave da WeatherAPI cadastrada no banco (WEATHER_API) ou None."""
+    return get_api_key('WEATHER_API')
+
+def weather_day(date_obj):
+    """Dia local de um date/datetime (itens guardam datetime em UTC)."""
+    if isinstance(date_obj, datetime):
+        if timezone.is_aware(date_obj):
+            date_obj = timezone.localtime(date_obj)
+        return date_obj.date()
+    return date_obj
+
 def fetch_weather_data(location, date_obj):
+    """
+    Previsão (temp, condição, ícone) de um local em um dia.
+    Ordem de busca: cache (memória/Redis) -> tabela WeatherForecast ainda válida -> WeatherAPI.
+    Se a API falhar, devolve a última previsão salva (mesmo vencida) em vez de nada.
+    """
     # 1. Busca a chave no Banco de Dados
-    try:
-        config = APIConfiguration.objects.get(key='WEATHER_API', is_active=True)
-        api_key = config.value
-    except APIConfiguration.DoesNotExist:
-        # Se não achar no banco, pode tentar um fallback para o settings (opcional)
-        # ou apenas retornar erro.
-        print("ERRO: Chave WEATHER_API não cadastrada ou inativa no banco.")
+    api_key = get_weather_api_key()
+    if not api_key:
+        logger.error("Chave WEATHER_API não cadastrada ou inativa no banco.")
         return None, None, None
 
-    if not location or not date_obj:
+    location_key = normalize_address(location)
+    if not location_key or not date_obj:
         return None, None, None
 
+    # 2. Cache por (local, dia) com proteção contra stampede
+    day = weather_day(date_obj)
+    result = cached_call(
+        make_cache_key('weather', location_key, day.isoformat()),
+        lambda: _load_weather(api_key, location, location_key, day),
+        timeout=weather_ttl(day),
+        stale_timeout=WEATHER_STALE_TIMEOUT,
+        negative_timeout=WEATHER_NEGATIVE_TIMEOUT,
+        cache_name='weather'
+    )
+    if result:
+        return result
+    return None, None, None
+
+def _load_weather(api_key, location, location_key, day):
+    """Tabela WeatherForecast (se ainda válida); senão WeatherAPI, gravando o resultado."""
+    stored = WeatherForecast.objects.filter(location_key=location_key, date=day).first()
+    if stored and stored.expires_at > timezone.now():
+        return stored.as_tuple()
+
+    result = refresh_weather_forecast(api_key, location, day)
+    if result:
+        return result
+
+    return stored.as_tuple() if stored else None
+
+def resolve_trip_weather(items, max_workers=None, refresh_expired=False):
+    """
+    Resolve a previsão de vários itens de uma vez (telas da viagem e 'prefetch_weather'):
+    1. Previsões salvas saem da tabela WeatherForecast numa query só;
+    2. Os pares (local, dia) que faltam são deduplicados e buscados em paralelo
+       (no máximo `max_workers` chamadas simultâneas à WeatherAPI);
+    3. Os itens atualizados são gravados com um único bulk_update.
+    O pior caso passa a ser ~1 ida e volta à API, não uma por item.
+    refresh_expired=True também busca de novo as previsões vencidas (usado no 'prefetch_weather').
+    Retorna quantos itens receberam previsão nova da API.
+    """
+    missing = apply_stored_weather(items, include_expired=not refresh_expired)
+    if not missing:
+        return 0
+
+    api_key = get_weather_api_key()
+    if not api_key:
+        return 0
+
+    pairs = {}
+    for item in missing:
+        pair = (normalize_address(item.location_address), weather_day(item.start_datetime))
+        pairs.setdefault(pair, item.location_address)
+
+    # As threads só fazem HTTP; banco fica na thread principal
+    results = {}
+    workers = min(max_workers or settings.WEATHER_FETCH_THREADS, len(pairs))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {
+            executor.submit(_fetch_weather_api, api_key, location, pair[1].strftime('%Y-%m-%d')): pair
+            for pair, location in pairs.items()
+        }
+        for future in as_completed(futures):
+            pair = futures[future]
+            result = future.result()
+            if result:
+                store_weather_forecast(pair[0], pair[1], result)
+                # Mesma janela "stale" do fetch_weather_data: ao vencer, serve o valor velho enquanto atualiza
+                cache_store(
+                    make_cache_key('weather', pair[0], pair[1].isoformat()), result,
+                    weather_ttl(pair[1]), stale_timeout=WEATHER_STALE_TIMEOUT
+                )
+                results[pair] = result
+
+    updated = []
+    for item in missing:
+        result = results.get((normalize_address(item.location_address), weather_day(item.start_datetime)))
+        if result:
+            item.weather_temp, item.weather_condition, item.weather_icon = result
+            updated.append(item)
+
+    if updated:
+        TripItem.objects.bulk_update(updated, ['weather_temp', 'weather_condition', 'weather_icon'])
+    return len(updated)
+
+def refresh_weather_forecast(api_key, location, day):
+    """Consulta a WeatherAPI e grava na tabela WeatherForecast. Retorna (temp, condição, ícone) ou None."""
+    result = _fetch_weather_api(api_key, location, day.strftime('%Y-%m-%d'))
+    if result:
+        store_weather_forecast(normalize_address(location), day, result)
+    return result
+
+def store_weather_forecast(location_key, day, result):
+    """Grava (temp, condição, ícone) na tabela WeatherForecast com a validade do dia."""
+    temp, condition, icon = result
+    WeatherForecast.objects.update_or_create(
+        location_key=location_key,
+        date=day,
+        defaults={
+            'temp': temp,
+            'condition': (condition or '')[:100],
+            'icon': (icon or '')[:255],
+            'expires_at': timezone.now() + timedelta(seconds=weather_ttl(day)),
+        }
+    )
+
+def apply_stored_weather(items, include_expired=True):
+    """
+    Preenche weather_temp/condition/icon dos itens com as previsões já salvas
+    (uma única query na tabela WeatherForecast, sem chamar a API).
+    Retorna os itens com endereço e data que continuam sem previsão
+    (com include_expired=False, também os que só têm previsão vencida).
+    """
+    wanted = {}
+    for item in items:
+        location_key = normalize_address(item.location_address)
+        if location_key and item.start_datetime:
+            wanted[item] = (location_key, weather_day(item.start_datetime))
+
+    if not wanted:
+        return []
+
+    stored = {
+        (forecast.location_key, forecast.date): forecast
+        for forecast in WeatherForecast.objects.filter(
+            location_key__in={key for key, _ in wanted.values()},
+            date__in={day for _, day in wanted.values()}
+        )
+    }
+
+    now = timezone.now()
+    missing = []
+    for item, pair in wanted.items():
+        forecast = stored.get(pair)
+        record_cache('weather_table', 'hit' if forecast else 'miss')
+        if forecast:
+            item.weather_temp = forecast.temp
+            item.weather_condition = forecast.condition
+            item.weather_icon = forecast.icon
+            if not include_expired and forecast.expires_at <= now:
+                missing.append(item)
+        elif not item.weather_temp or not include_expired:
+            missing.append(item)
+    return missing
+
+def _fetch_weather_api(api_key, location, date_str):
+    """Chamada real à WeatherAPI. Retorna (temp, condição, ícone) ou None."""
     try:
-        date_str = date_obj.strftime('%Y-%m-%d')
         # Usa a api_key que veio do banco
         url = f"http://api.weatherapi.com/v1/forecast.json?key={api_key}&q={location}&dt={date_str}&lang=pt"        
-        response = requests.get(url, timeout=5)
+        with upstream_call('weatherapi') as call:
+            response = requests.get(url, timeout=5)
+            if response.status_code != 200:
+                call.outcome = 'error'
 
         # DEBUG 2: Verificando resposta da API
         if response.status_code != 200:
-            print(f"Erro API: Status {response.status_code}")
-            print(f"Mensagem: {response.text}")
-            return None, None, None 
+            logger.warning("Erro na WeatherAPI: status %s - %s", response.status_code, response.text[:500])
+            return None
 
         data = response.json()
 
@@ -191,23 +660,259 @@ def fetch_weather_data(location, date_obj):
                 
             return temp, condition, icon
         else:
-            print(f"JSON inesperado: {data}")
+            logger.warning("WeatherAPI: JSON inesperado para %s: %s", location, data)
             
     except Exception as e:
-        print(f"Erro ao buscar clima para {location}: {e}")
-        return None, None, None
+        logger.warning("Erro ao buscar clima para %s: %s", location, e)
     
-    return None, None, None
+    return None
+
+#-- Função Adicional para Geocodificar Endereços --#
+GEOCODE_CACHE_TIMEOUT = 60 * 60 * 24 * 30  # 30 dias (endereços quase não mudam)
+GEOCODE_NEGATIVE_TIMEOUT = 60 * 60  # Endereço não encontrado: não tenta por 1 hora
+
+
+class GeocodeApiError(Exception):
+    """Status de erro da Geocoding API (OVER_QUERY_LIMIT, REQUEST_DENIED...): tentar de novo depois."""
+
+
+def normalize_address(address):
+    """Chave do cache de endereços: minúsculo, sem espaços repetidos e sem pontuação nas pontas."""
+    if not address:
+        return ''
+    return re.sub(r'\s+', ' ', address).strip(' ,.;-').lower()[:255]
+
+def get_google_maps_api_key():
+    """Chave do Google Maps: cadastrada no banco (GOOGLE_MAPS_API) ou, na falta, a do .env."""
+    return get_api_key('GOOGLE_MAPS_API') or settings.GOOGLE_MAPS_API_KEY
+
+def geocode_address(address):
+    """
+    Serviço único de Geocoding: Endereço -> {'lat', 'lng', 'country_code', 'formatted_address'}.
+    Ordem de busca: cache (memória/Redis) -> tabela GeocodeCache -> Geocoding API do Google.
+    Um acerto no cache ou na tabela não faz nenhuma chamada de rede.
+    Retorna None se o Google não encontrar o endereço (falha fica em cache por 1 hora).
+    """
+    address_key = normalize_address(address)
+    if not address_key:
+        return None
+
+    return cached_call(
+        make_cache_key('geocode', address_key),
+        lambda: _load_geocode(address, address_key),
+        timeout=GEOCODE_CACHE_TIMEOUT,
+        negative_timeout=GEOCODE_NEGATIVE_TIMEOUT,
+        cache_name='geocode'
+    )
+
+def get_cached_geocode(address):
+    """
+    Consulta SOMENTE o cache e a tabela GeocodeCache (nunca chama o Google).
+    Usado no save() do TripItem para não bloquear o request: se não souber, retorna None.
+    """
+    address_key = normalize_address(address)
+    if not address_key:
+        return None
+
+    entry = cache.get(make_cache_key('geocode', address_key))
+    if entry is not None and entry['value'] is not None:
+        record_cache('geocode', 'hit')
+        return entry['value']
+
+    record_cache('geocode', 'miss')
+    cached = GeocodeCache.objects.filter(address_key=address_key).first()
+    record_cache('geocode_table', 'hit' if cached else 'miss')
+    if cached:
+        value = cached.as_dict()
+        cache_store(make_cache_key('geocode', address_key), value, GEOCODE_CACHE_TIMEOUT)
+        return value
+    return None
+
+def geocode_many(addresses, max_workers=4, max_per_second=None):
+    """
+    Geocodifica vários endereços de uma vez (usado pelos workers em lote).
+    Endereços repetidos viram uma única consulta; os já conhecidos saem da tabela
+    GeocodeCache numa query só e o resto vai ao Google em paralelo (max_workers threads),
+    respeitando no máximo `max_per_second` requisições por segundo (se informado).
+    Retorna {endereço_normalizado: resultado ou None (não encontrado)}.
+    Endereços que deram erro de rede/API ficam FORA do dicionário (para tentar de novo).
+    """
+    keys = {}
+    for address in addresses:
+        address_key = normalize_address(address)
+        if address_key and address_key not in keys:
+            keys[address_key] = address
+
+    results = {
+        cached.address_key: cached.as_dict()
+        for cached in GeocodeCache.objects.filter(address_key__in=list(keys))
+    }
+    missing = [key for key in keys if key not in results]
+    record_cache('geocode_table', 'hit', len(results))
+    record_cache('geocode_table', 'miss', len(missing))
+    if not missing:
+        return results
+
+    # As threads só fazem HTTP; banco e cache ficam na thread principal
+    api_key = get_google_maps_api_key()
+    throttle = _make_throttle(max_per_second)
+
+    def fetch(address):
+        throttle()
+        return _fetch_geocode_api(address, api_key)
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        futures = {executor.submit(fetch, keys[key]): key for key in missing}
+        for future in as_completed(futures):
+            address_key = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning("Erro no Geocoding de '%s': %s", keys[address_key], e)
+                continue
+
+            if result:
+                result = _store_geocode(address_key, result)
+            else:
+                cache_store(make_cache_key('geocode', address_key), None, GEOCODE_NEGATIVE_TIMEOUT)
+            results[address_key] = result
+
+    return results
+
+# Campos do TripItem alterados por geocode_items (para only() e bulk_update)
+GEOCODE_ITEM_FIELDS = ['location_lat', 'location_lng', 'country_code', 'local_currency', 'geocode_status', 'geocode_attempts']
+
+def geocode_items(items, max_workers=4, max_per_second=None, max_attempts=None):
+    """
+    Preenche location_lat/lng, país/moeda e geocode_status de uma lista de TripItem (sem salvar).
+    Erros de rede/API somam em geocode_attempts; com `max_attempts`, o item vira FAILED no limite.
+    Quem chama grava com bulk_update (campos em GEOCODE_ITEM_FIELDS).
+    Retorna (localizados, não encontrados, com erro).
+    """
+    results = geocode_many(
+        [item.location_address for item in items],
+        max_workers=max_workers,
+        max_per_second=max_per_second
+    )
+
+    found = failed = errors = 0
+    for item in items:
+        address_key = normalize_address(item.location_address)
+        if not address_key:
+            item.geocode_status = ''
+        elif address_key not in results:
+            errors += 1
+            item.geocode_attempts += 1
+            if max_attempts and item.geocode_attempts >= max_attempts:
+                item.geocode_status = TripItem.GEOCODE_FAILED
+        elif results[address_key]:
+            found += 1
+            item.location_lat = results[address_key]['lat']
+            item.location_lng = results[address_key]['lng']
+            item.country_code, item.local_currency = get_location_codes(
+                item.location_address, results[address_key]['country_code']
+            )
+            item.geocode_status = TripItem.GEOCODE_DONE
+        else:
+            failed += 1
+            item.geocode_status = TripItem.GEOCODE_FAILED
+
+    return found, failed, errors
+
+def _make_throttle(max_per_second):
+    """Retorna uma função que, chamada antes de cada requisição, espera o necessário (thread-safe)."""
+    if not max_per_second:
+        return lambda: None
+
+    interval = 1.0 / max_per_second
+    lock = threading.Lock()
+    next_slot = [time.monotonic()]
+
+    def throttle():
+        with lock:
+            now = time.monotonic()
+            wait = next_slot[0] - now
+            next_slot[0] = max(now, next_slot[0]) + interval
+        if wait > 0:
+            time.sleep(wait)
+
+    return throttle
+
+def _load_geocode(address, address_key):
+    """Busca na tabela GeocodeCache; se não houver, consulta o Google e grava o resultado."""
+    cached = GeocodeCache.objects.filter(address_key=address_key).first()
+    record_cache('geocode_table', 'hit' if cached else 'miss')
+    if cached:
+        return cached.as_dict()
+
+    result = _fetch_geocode_api(address)
+    if not result:
+        return None
+    return _store_geocode(address_key, result)
+
+def _store_geocode(address_key, result):
+    """Grava a resposta do Google na tabela GeocodeCache e no cache. Retorna o dicionário salvo."""
+    cached, _ = GeocodeCache.objects.update_or_create(
+        address_key=address_key,
+        defaults={
+            'lat': round(Decimal(str(result['lat'])), 6),
+            'lng': round(Decimal(str(result['lng'])), 6),
+            'country_code': result['country_code'],
+            'formatted_address': result['formatted_address'][:500],
+        }
+    )
+    value = cached.as_dict()
+    cache_store(make_cache_key('geocode', address_key), value, GEOCODE_CACHE_TIMEOUT)
+    return value
+
+def _fetch_geocode_api(address, api_key=None):
+    """
+    Chamada real à Geocoding API (Server-Side). Retorna o primeiro resultado ou None (ZERO_RESULTS).
+    Qualquer outro status (cota, chave negada, erro do Google) lança GeocodeApiError:
+    não é "endereço não encontrado" e o item precisa voltar para a fila.
+    """
+    base_url = "https://maps.googleapis.com/maps/api/geocode/json"
+    params = {
+        "address": address,
+        "key": api_key or get_google_maps_api_key()
+    }
+
+    with upstream_call('google_geocoding') as call:
+        response = requests.get(base_url, params=params, timeout=5)
+        data = response.json()
+        if data['status'] == 'ZERO_RESULTS':
+            call.outcome = 'not_found'
+        elif data['status'] != 'OK':
+            raise GeocodeApiError(f"{data['status']}: {data.get('error_message', '')}")
+
+    if data['status'] == 'ZERO_RESULTS':
+        logger.info("Google não encontrou o endereço: %s", address)
+        return None
+
+    result = data['results'][0]
+    location = result['geometry']['location']
+
+    # País vem nos address_components (short_name = código ISO de 2 letras)
+    country_code = ''
+    for component in result.get('address_components', []):
+        if 'country' in component.get('types', []):
+            country_code = component.get('short_name', '')[:2].upper()
+            break
+
+    return {
+        'lat': location['lat'],
+        'lng': location['lng'],
+        'country_code': country_code,
+        'formatted_address': result.get('formatted_address', ''),
+    }
 
 #-- Função Adicional para Geração de Checklist AI --#
 def generate_checklist_ai(trip):
     """
     Gera uma lista de itens de viagem baseada no destino e duração usando OpenAI.
     """
-    try:
-        config = APIConfiguration.objects.get(key='OPENAI_API', is_active=True)
-        api_key = config.value
-    except APIConfiguration.DoesNotExist:
+    api_key = get_api_key('OPENAI_API')
+    if not api_key:
         return None
 
     client = OpenAI(api_key=api_key)
@@ -232,11 +937,12 @@ def generate_checklist_ai(trip):
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", # Modelo rápido e barato
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
-        )
+        with upstream_call('openai'):
+            response = client.chat.completions.create(
+                model="gpt-4o-mini", # Modelo rápido e barato
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"}
+            )
         content = response.choices[0].message.content
         return json.loads(content)
     except Exception as e:
@@ -248,11 +954,10 @@ def generate_itinerary_ai(trip, interests):
     """
     Gera itens de roteiro (atividades) baseados no destino e interesses.
     """
-    try:
-        config = APIConfiguration.objects.get(key='OPENAI_API', is_active=True)
-        client = OpenAI(api_key=config.value)
-    except APIConfiguration.DoesNotExist:
+    api_key = get_api_key('OPENAI_API')
+    if not api_key:
         return None
+    client = OpenAI(api_key=api_key)
 
     destination = trip.title 
     
@@ -298,11 +1003,12 @@ def generate_itinerary_ai(trip, interests):
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
-        )
+        with upstream_call('openai'):
+            response = client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"}
+            )
         content = response.choices[0].message.content
         return json.loads(content)
     except Exception as e:
@@ -311,7 +1017,7 @@ def generate_itinerary_ai(trip, interests):
 
 #-- Função Adicional para Dicas de Viagem AI --#
 def generate_trip_insights_ai(trip_id):
-    from .models import Trip, APIConfiguration
+    from .models import Trip
     
     trip = Trip.objects.get(pk=trip_id)
     destination = trip.title 
@@ -319,10 +1025,8 @@ def generate_trip_insights_ai(trip_id):
     print(f"--- INICIANDO GERAÇÃO IA PARA: {destination} ---")
 
     # 1. Busca a chave
-    try:
-        config = APIConfiguration.objects.get(key='OPENAI_API')
-        openai_key = config.value
-    except APIConfiguration.DoesNotExist:
+    openai_key = get_api_key('OPENAI_API', active_only=False)
+    if not openai_key:
         print("ERRO: Chave OPENAI_API não encontrada.")
         return False
 
@@ -343,15 +1047,16 @@ def generate_trip_insights_ai(trip_id):
     try:
         client = OpenAI(api_key=openai_key)
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a JSON generator. Output raw JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5,
-            response_format={"type": "json_object"} 
-        )
+        with upstream_call('openai'):
+            response = client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are a JSON generator. Output raw JSON only."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.5,
+                response_format={"type": "json_object"} 
+            )
 
         content = response.choices[0].message.content
         content = content.replace("```json", "").replace("```", "").strip()
@@ -396,18 +1101,9 @@ def generate_trip_insights_ai(trip_id):
         print(f"ERRO CRÍTICO NA IA: {e}")
         return False
 
-#-- Função Adicional para Extrair Código do País --#  
-def get_country_code_from_address(address):
-    """
-    Recebe um endereço (string) e retorna o código ISO do país (ex: 'br', 'us').
-    Retorna None se não encontrar.
-    """
-    if not address:
-        return None
-        
-    address_lower = address.lower()
-    
-    country_map = {
+#-- Função Adicional para Extrair Código do País --#
+# Nomes de países (PT/EN) -> código ISO usado nas bandeiras
+COUNTRY_CODES = {
     # A
     'afeganistão': 'af', 'afghanistan': 'af',
     'áfrica do sul': 'za', 'south africa': 'za',
@@ -561,25 +1257,112 @@ def get_country_code_from_address(address):
 
     # Z
     'zâmbia': 'zm', 'zambia': 'zm',
-    'zimbábue': 'zw', 'zimbabwe': 'zw',    }
+    'zimbábue': 'zw', 'zimbabwe': 'zw',
+}
 
-    for country_name, country_code in country_map.items():
-        if country_name in address_lower:
-            return country_code
-            
-    return None
+# Países E CIDADES (como vêm do Google Maps) -> código da moeda
+CURRENCY_KEYWORDS = {
+    # Europa (Países e Capitais Principais)
+    'france': 'EUR', 'frança': 'EUR', 'paris': 'EUR',
+    'germany': 'EUR', 'alemanha': 'EUR', 'berlin': 'EUR', 'berlim': 'EUR',
+    'italy': 'EUR', 'itália': 'EUR', 'rome': 'EUR', 'roma': 'EUR',
+    'spain': 'EUR', 'espanha': 'EUR', 'madrid': 'EUR', 'barcelona': 'EUR',
+    'portugal': 'EUR', 'lisbon': 'EUR', 'lisboa': 'EUR',
+    'netherlands': 'EUR', 'holanda': 'EUR', 'amsterdam': 'EUR',
+    'united kingdom': 'GBP', 'reino unido': 'GBP', 'england': 'GBP', 'inglaterra': 'GBP', 'london': 'GBP', 'londres': 'GBP',
+    'switzerland': 'CHF', 'suíça': 'CHF', 'zurich': 'CHF',
+    
+    # Américas
+    'united states': 'USD', 'estados unidos': 'USD', 'usa': 'USD', 'ny': 'USD', 'miami': 'USD', 'orlando': 'USD',
+    'canada': 'CAD', 'canadá': 'CAD', 'toronto': 'CAD', 'vancouver': 'CAD',
+    'chile': 'CLP', 'santiago': 'CLP',
+    'argentina': 'ARS', 'buenos aires': 'ARS',
+    'uruguay': 'UYU', 'uruguai': 'UYU', 'montevideo': 'UYU',
+    'colombia': 'COP', 'colômbia': 'COP',
+    'peru': 'PEN', 'lima': 'PEN',
+    
+    # Ásia / Oceania
+    'japan': 'JPY', 'japão': 'JPY', 'tokyo': 'JPY',
+    'australia': 'AUD', 'austrália': 'AUD', 'sydney': 'AUD',
+}
+
+def _build_location_matcher():
+    """
+    Monta UMA regex com todos os nomes (alternância com limites de palavra),
+    compilada uma única vez ao importar o módulo. Nomes mais longos vêm primeiro
+    para 'coreia do sul' ganhar de um eventual 'coreia', por exemplo.
+    """
+    keywords = {}
+    for name, code in COUNTRY_CODES.items():
+        keywords.setdefault(name, [None, None])[0] = code
+    for name, currency in CURRENCY_KEYWORDS.items():
+        keywords.setdefault(name, [None, None])[1] = currency
+
+    names = sorted(keywords, key=len, reverse=True)
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(name) for name in names) + r')\b')
+    return pattern, {name: tuple(values) for name, values in keywords.items()}
+
+_LOCATION_PATTERN, _LOCATION_KEYWORDS = _build_location_matcher()
+
+@lru_cache(maxsize=4096)
+def match_location(address):
+    """
+    Uma única passada pelo endereço: retorna (código do país, moeda), cada um ou None.
+    Quando há mais de um país no endereço, vale o ÚLTIMO (o Google termina o
+    endereço pelo país: "Av. Portugal 123, São Paulo, Brasil"), e a moeda vem do
+    mesmo nome (ou de COUNTRY_CURRENCIES). Nomes só de moeda (cidades como 'lisboa')
+    valem quando nenhum país aparece. Memoizado por endereço.
+    """
+    if not address:
+        return None, None
+
+    country_code = currency = city_currency = None
+    for match in _LOCATION_PATTERN.finditer(address.lower()):
+        code, curr = _LOCATION_KEYWORDS[match.group(0)]
+        if code:
+            country_code, currency = code, curr or COUNTRY_CURRENCIES.get(code)
+        elif curr:
+            city_currency = curr
+    if country_code is None:
+        currency = city_currency
+    return country_code, currency
+
+# País (ISO) -> moeda, para as moedas com cotação no sistema (Expense.CURRENCY_CHOICES)
+COUNTRY_CURRENCIES = {
+    'br': 'BRL',
+    'us': 'USD', 'ec': 'USD', 'sv': 'USD', 'pa': 'USD', 'pr': 'USD',
+    'at': 'EUR', 'be': 'EUR', 'hr': 'EUR', 'cy': 'EUR', 'ee': 'EUR', 'fi': 'EUR',
+    'fr': 'EUR', 'de': 'EUR', 'gr': 'EUR', 'ie': 'EUR', 'it': 'EUR', 'lv': 'EUR',
+    'lt': 'EUR', 'lu': 'EUR', 'mt': 'EUR', 'nl': 'EUR', 'pt': 'EUR', 'sk': 'EUR',
+    'si': 'EUR', 'es': 'EUR', 'ad': 'EUR', 'mc': 'EUR', 'sm': 'EUR', 'va': 'EUR',
+    'me': 'EUR',
+    'cl': 'CLP', 'ar': 'ARS', 'uy': 'UYU', 'co': 'COP', 'pe': 'PEN',
+    'ca': 'CAD', 'gb': 'GBP', 'ch': 'CHF', 'li': 'CHF', 'au': 'AUD', 'jp': 'JPY',
+}
+
+def get_location_codes(address, geocoded_country=None):
+    """
+    País (ISO minúsculo) e moeda local de um endereço, para gravar no TripItem.
+    O país vem do Geocoding (address_components) quando houver; senão, do texto do endereço.
+    Retorna ('', '') quando não reconhece.
+    """
+    text_country, text_currency = match_location(address)
+    country_code = (geocoded_country or text_country or '').lower()
+    currency = COUNTRY_CURRENCIES.get(country_code) or text_currency or ''
+    return country_code, currency
+
+def get_country_code_from_address(address):
+    """
+    Recebe um endereço (string) e retorna o código ISO do país (ex: 'br', 'us').
+    Retorna None se não encontrar.
+    """
+    return match_location(address)[0]
 
 #-- Função de envio de email --#
 def get_db_mail_connection():
-    print("--- DEBUG EMAIL: Iniciando busca ---")
     try:
-        from .models import EmailConfiguration
-        
-        # Conta quantos registros existem para debug
-        total_configs = EmailConfiguration.objects.count()
-        print(f"--- DEBUG EMAIL: Total de registros na tabela: {total_configs} ---")
-        
-        config = EmailConfiguration.objects.first()
+        # Configuração SMTP em cache (sem query por e-mail enviado)
+        config = get_email_settings()
 
         if config:
             print(f"--- DEBUG EMAIL: Config encontrado! Host: {config.host} Port: {config.port} ---")
@@ -7,19 +7,26 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils import timezone # Importante para saber o ano atual
 from django.urls import reverse
-from collections import defaultdict
+import hmac
 import json
-import googlemaps
 import ast
 import markdown
 import os
 import traceback
 import sys
 from datetime import datetime, time, timedelta
-from .utils import get_exchange_rate, get_currency_by_country, fetch_weather_data, get_travel_intel, generate_checklist_ai, generate_itinerary_ai, generate_trip_insights_ai, get_country_code_from_address
+from .metrics import upstream_call, render_metrics
+from .db_routers import read_replica
+from .ics import ICS_CONTENT_TYPE, get_feed, ics_etag, items_state, stream_ics
+from .itinerary import apply_item_weather, build_itinerary_context, currency_rates, item_local_date
+from .pdf import (
+    build_trip_pdf_html, checklist_pdf_fingerprint, export_zip_response, pdf_response,
+    trip_pdf_fingerprint,
+)
+from .utils import get_api_key, get_exchange_rates, get_travel_intel, generate_checklist_ai, generate_itinerary_ai, generate_trip_insights_ai
 from .models import (
     Trip, TripItem, Expense, TripAttachment, APIConfiguration, Checklist, ChecklistItem, TripCollaborator,
-    TripPhoto, EmailConfiguration, AccessLog, TripNote
+    TripPhoto, EmailConfiguration, AccessLog, TripNote, CalendarFeedToken
 )
 from django.conf import settings
 from .forms import (
@@ -27,16 +34,18 @@ from .forms import (
     APIConfigurationForm, UserCreateForm, UserEditForm, APIConfigurationForm, ShareTripForm,
     TripPhotoForm, EmailConfigurationForm, ICSImportForm, TripNoteForm
 )
-from django.db.models import Sum, Q, Case, When, F, DecimalField
+from django.db.models import Sum, Q, Case, When, F, DecimalField, Count
+from django.core.paginator import Paginator
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import user_passes_test
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.template.loader import get_template
-from xhtml2pdf import pisa
-from icalendar import Calendar, Event as ICalEvent
+from icalendar import Calendar
 import pytz
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_POST, require_safe
 from django.core.serializers.json import DjangoJSONEncoder
 import requests
 
@@ -48,21 +57,13 @@ def home(request):
     trips = Trip.objects.filter(user=request.user).order_by('-start_date')
     
     # 2. Cálculo Financeiro
-    total_spent = 0
-    rates_cache = {}
-    all_expenses = Expense.objects.filter(trip__user=request.user)
-    
-    for expense in all_expenses:
-        if expense.currency not in rates_cache:
-            rates_cache[expense.currency] = get_exchange_rate(expense.currency)
-        # ARREDONDAMENTO AQUI:
-        val_converted = float(expense.amount) * rates_cache[expense.currency]
-        total_spent += round(val_converted, 2)
+    rates = get_exchange_rates() # Tabela completa de cotações (uma única consulta)
+    # Soma feita no banco sobre o valor já convertido de cada gasto
+    total_spent = Expense.objects.filter(trip__user=request.user).brl_totals()['total']
 
     # 3. Cotações de Referência (Dólar e Euro) para os Widgets
-    # Se já tivermos buscado no loop acima, usamos do cache. Se não, buscamos agora.
-    usd_rate = rates_cache.get('USD') or get_exchange_rate('USD')
-    eur_rate = rates_cache.get('EUR') or get_exchange_rate('EUR')
+    usd_rate = rates['USD']
+    eur_rate = rates['EUR']
 
     # 4. Dados para o Mapa (CORREÇÃO AQUI)
     # Buscamos os itens com coordenadas
@@ -85,12 +86,9 @@ def home(request):
         })
     
     # --- CORREÇÃO AQUI: BUSCA A CHAVE NO BANCO ---
-    google_maps_api_key = None
-    try:
-        # Tenta pegar a chave salva no banco
-        config = APIConfiguration.objects.get(key='GOOGLE_MAPS_API')
-        google_maps_api_key = config.value
-    except APIConfiguration.DoesNotExist:
+    # Chave salva no banco (lida do cache de configurações, sem query)
+    google_maps_api_key = get_api_key('GOOGLE_MAPS_API', active_only=False)
+    if not google_maps_api_key:
         print("AVISO: Chave GOOGLE_MAPS_API não encontrada no banco.")
     # ---------------------------------------------
 
@@ -109,191 +107,23 @@ def home(request):
     return render(request, 'index.html', context)
 
 # --- VIEWS PARA VIAGEM (TRIP) ---
+@read_replica
 def trip_list(request):
     """
     Lista todas as viagens (próprias e compartilhadas) do usuário logado.
     """
     
-    # --- MUDANÇA AQUI ---
-    # Buscamos viagens onde o usuário é o DONO (user=request.user)
-    # OU (|) onde ele é um COLABORADOR (collaborators__user=request.user)
-    # O .distinct() é importante para evitar duplicatas caso haja algum conflito no join
-    trips = Trip.objects.filter(
-        Q(user=request.user) | Q(collaborators__user=request.user)
-    ).distinct().order_by('-start_date')
-
-    # --- Lógica para Identificar Bandeiras (MANTIDA IGUAL) ---
-    country_map = {
-        # A
-        'afeganistão': 'af', 'afghanistan': 'af',
-        'áfrica do sul': 'za', 'south africa': 'za',
-        'albânia': 'al', 'albania': 'al',
-        'alemanha': 'de', 'germany': 'de',
-        'andorra': 'ad',
-        'angola': 'ao',
-        'antígua e barbuda': 'ag', 'antigua and barbuda': 'ag',
-        'arábia saudita': 'sa', 'saudi arabia': 'sa',
-        'argélia': 'dz', 'algeria': 'dz',
-        'argentina': 'ar',
-        'armênia': 'am', 'armenia': 'am',
-        'austrália': 'au', 'australia': 'au',
-        'áustria': 'at', 'austria': 'at',
-        'azerbaijão': 'az', 'azerbaijan': 'az',
-
-        # B
-        'bahamas': 'bs',
-        'bangladesh': 'bd',
-        'barbados': 'bb',
-        'barein': 'bh', 'bahrain': 'bh',
-        'bélgica': 'be', 'belgium': 'be',
-        'belize': 'bz',
-        'benin': 'bj',
-        'bolívia': 'bo', 'bolivia': 'bo',
-        'bósnia e herzegovina': 'ba', 'bosnia and herzegovina': 'ba',
-        'botswana': 'bw',
-        'brasil': 'br', 'brazil': 'br',
-        'brunei': 'bn',
-        'bulgária': 'bg', 'bulgaria': 'bg',
-
-        # C
-        'cabo verde': 'cv', 'cape verde': 'cv',
-        'camarões': 'cm', 'cameroon': 'cm',
-        'canadá': 'ca', 'canada': 'ca',
-        'catar': 'qa', 'qatar': 'qa',
-        'cazaquistão': 'kz', 'kazakhstan': 'kz',
-        'chile': 'cl',
-        'china': 'cn',
-        'chipre': 'cy', 'cyprus': 'cy',
-        'colômbia': 'co', 'colombia': 'co',
-        'coreia do norte': 'kp', 'north korea': 'kp',
-        'coreia do sul': 'kr', 'south korea': 'kr',
-        'costa rica': 'cr',
-        'croácia': 'hr', 'croatia': 'hr',
-        'cuba': 'cu',
-
-        # D
-        'dinamarca': 'dk', 'denmark': 'dk',
-        'dominica': 'dm',
-
-        # E
-        'egito': 'eg', 'egypt': 'eg',
-        'el salvador': 'sv',
-        'emirados árabes unidos': 'ae', 'united arab emirates': 'ae',
-        'equador': 'ec',
-        'eritrea': 'er',
-        'eslováquia': 'sk', 'slovakia': 'sk',
-        'eslovênia': 'si', 'slovenia': 'si',
-        'espanha': 'es', 'spain': 'es',
-        'estados unidos': 'us', 'usa': 'us', 'united states': 'us',
-        'estônia': 'ee', 'estonia': 'ee',
-        'etiópia': 'et', 'ethiopia': 'et',
-
-        # F
-        'finlândia': 'fi', 'finland': 'fi',
-        'frança': 'fr', 'france': 'fr',
-
-        # G
-        'gabão': 'ga', 'gabon': 'ga',
-        'gana': 'gh', 'ghana': 'gh',
-        'geórgia': 'ge', 'georgia': 'ge',
-        'grécia': 'gr', 'greece': 'gr',
-        'guatemala': 'gt',
-
-        # H
-        'haiti': 'ht',
-        'holanda': 'nl', 'netherlands': 'nl',
-        'honduras': 'hn',
-        'hungria': 'hu', 'hungary': 'hu',
-
-        # I
-        'índia': 'in', 'india': 'in',
-        'indonésia': 'id', 'indonesia': 'id',
-        'irã': 'ir', 'iran': 'ir',
-        'iraque': 'iq', 'iraq': 'iq',
-        'irlanda': 'ie', 'ireland': 'ie',
-        'islândia': 'is', 'iceland': 'is',
-        'israel': 'il',
-        'itália': 'it', 'italy': 'it',
-
-        # J
-        'jamaica': 'jm',
-        'japão': 'jp', 'japan': 'jp',
-
-        # K
-        'kenya': 'ke',
-        'kuwait': 'kw',
-
-        # L
-        'letonia': 'lv', 'latvia': 'lv',
-        'líbano': 'lb', 'lebanon': 'lb',
-        'lituânia': 'lt', 'lithuania': 'lt',
-        'luxemburgo': 'lu', 'luxembourg': 'lu',
-
-        # M
-        'malásia': 'my', 'malaysia': 'my',
-        'marrocos': 'ma', 'morocco': 'ma',
-        'méxico': 'mx', 'mexico': 'mx',
-        'moçambique': 'mz', 'mozambique': 'mz',
-
-        # N
-        'namíbia': 'na', 'namibia': 'na',
-        'nepal': 'np',
-        'nigéria': 'ng', 'nigeria': 'ng',
-        'noruega': 'no', 'norway': 'no',
-        'nova zelândia': 'nz', 'new zealand': 'nz',
-
-        # P
-        'paquistão': 'pk', 'pakistan': 'pk',
-        'paraguai': 'py', 'paraguay': 'py',
-        'peru': 'pe',
-        'polônia': 'pl', 'poland': 'pl',
-        'portugal': 'pt',
-
-        # R
-        'reino unido': 'gb', 'uk': 'gb', 'united kingdom': 'gb',
-        'romênia': 'ro', 'romania': 'ro',
-        'rússia': 'ru', 'russia': 'ru',
-
-        # S
-        'senegal': 'sn',
-        'sérvia': 'rs', 'serbia': 'rs',
-        'singapura': 'sg', 'singapore': 'sg',
-        'síria': 'sy', 'syria': 'sy',
-        'suécia': 'se', 'sweden': 'se',
-        'suíça': 'ch', 'switzerland': 'ch',
-
-        # T
-        'tailândia': 'th', 'thailand': 'th',
-        'tunísia': 'tn', 'tunisia': 'tn',
-        'turquia': 'tr', 'turkey': 'tr',
-
-        # U
-        'ucrânia': 'ua', 'ukraine': 'ua',
-        'uruguai': 'uy', 'uruguay': 'uy',
-
-        # V
-        'venezuela': 've',
-        'vietnã': 'vn', 'vietnam': 'vn',
-
-        # Z
-        'zâmbia': 'zm', 'zambia': 'zm',
-        'zimbábue': 'zw', 'zimbabwe': 'zw',
-    }
+    # Viagens onde o usuário é o DONO ou COLABORADOR, já com o papel dele
+    # em cada uma (user_role) calculado na mesma query
+    trips = (
+        Trip.objects.visible_to(request.user)
+        .prefetch_related('collaborators__user') # Lista "Pessoas com acesso" do modal
+        .order_by('-start_date')
+    )
 
+    # As bandeiras de cada viagem vêm de Trip.flags (TripItem.country_code)
     for trip in trips:
-        # trip.flags = set() 
-        
-        # # Pega todos os itens dessa viagem que tenham endereço
-        # items = trip.items.exclude(location_address__isnull=True).exclude(location_address__exact='')
-        
-        # for item in items:
-        #     address_lower = item.location_address.lower()
-            
-        #     for country_name, country_code in country_map.items():
-        #         if country_name in address_lower:
-        #             trip.flags.add(country_code)
-        
-        trip.current_user_role = trip.get_user_role(request.user)
+        trip.current_user_role = trip.user_role
 
     return render(request, 'trips/trip_list.html', {'trips': trips})
 
@@ -354,17 +184,14 @@ def trip_remove_share(request, trip_id, user_id):
 @login_required
 def trip_detail(request, pk):
     # 1. Busca a Viagem e Permissões
-    trip = get_object_or_404(
-        Trip, 
-        Q(pk=pk) & (Q(user=request.user) | Q(collaborators__user=request.user))
-    )
+    trip = get_object_or_404(Trip.objects.visible_to(request.user), pk=pk)
 
     user_role = trip.get_user_role(request.user)
     can_edit = (user_role == 'owner' or user_role == 'editor')
 
-    # 1. Busca TODOS os itens apenas para extrair as datas disponíveis
-    all_items = trip.items.all().order_by('start_datetime')
-    available_dates = trip.items.dates('start_datetime', 'day')
+    # 1. View-model do roteiro: itens, anexos e gastos em número fixo de queries
+    itinerary = build_itinerary_context(trip)
+    available_dates = itinerary.available_dates
 
     # 2. Determina qual data exibir (Filtro)
     selected_date_str = request.GET.get('date')
@@ -380,129 +207,39 @@ def trip_detail(request, pk):
     if not selected_date and available_dates:
         selected_date = available_dates[0]
 
-    # 3. Filtra os itens para a timeline e mapa (AQUI ESTAVA O ERRO, AGORA ESTÁ CERTO)
+    # 3. Filtra os itens para a timeline e mapa (em memória, sem nova query)
     if selected_date:
-        items = all_items.filter(start_datetime__date=selected_date)
+        items = [item for item in itinerary.items if item_local_date(item) == selected_date]
     else:
-        items = all_items
-
-    # --- REMOVIDA A LINHA QUE SOBRESCREVIA 'items' COM TUDO DE NOVO ---
-
-    # 4. Processamento de Itens (Flags e Clima) - Aplica nos itens FILTRADOS
-    # trip.flags = set() 
-    items_changed = False
-
-    # --- LIMPEZA DE DADOS PARA EXIBIÇÃO (Sua lógica original mantida) ---
-    import ast
-    for item in items:
-        # # Lógica de Bandeira
-        item.flag_code = get_country_code_from_address(item.location_address)
-        # if item.flag_code:
-        #     trip.flags.add(item.flag_code)
-
-        # Lógica de Limpeza das Notas 
-        if item.details:
-            raw = item.details
-            if isinstance(raw, str):
-                try:
-                    raw = ast.literal_eval(raw)
-                except:
-                    pass
-            
-            if isinstance(raw, dict):
-                notes = raw.get('notes', '')
-                if isinstance(notes, str) and notes.strip().startswith("{'notes'"):
-                    try:
-                        inner = ast.literal_eval(notes)
-                        if isinstance(inner, dict):
-                            notes = inner.get('notes', notes)
-                    except:
-                        pass
-                item.details = {'notes': notes}
-        
-        # B. Detectar Clima (Se tiver endereço, data e ainda não tiver clima)
-        if item.location_address and item.start_datetime and not item.weather_temp:
-            temp, cond, icon = fetch_weather_data(item.location_address, item.start_datetime)
-            if temp:
-                item.weather_temp = temp
-                item.weather_condition = cond
-                item.weather_icon = icon
-                item.save()
-                items_changed = True
-    
-    # Se atualizamos o clima, recarregamos MANTENDO O FILTRO DA DATA
-    if items_changed:
-        if selected_date:
-            items = trip.items.filter(start_datetime__date=selected_date).order_by('start_datetime')
-        else:
-            items = trip.items.all().order_by('start_datetime')
-
-    # 5. Processamento Financeiro (Mantém global da viagem ou filtra? Geralmente financeiro é global)
-    # Aqui mantemos expenses global (trip.expenses) para o resumo financeiro mostrar o total da viagem
-    # --- LÓGICA FINANCEIRA ATUALIZADA ---
-    expenses = trip.expenses.all()
-    
-    total_planned_brl = Decimal('0.00')
-    total_paid_brl = Decimal('0.00')
-    rates_cache = {}
-
-    for expense in expenses:
-        # Obtém a taxa de câmbio (com cache)
-        if expense.currency not in rates_cache:
-            rates_cache[expense.currency] = get_exchange_rate(expense.currency)
+        items = itinerary.items
 
-        rate = Decimal(str(rates_cache[expense.currency]))  # Converte para Decimal para precisão
+    # 4. Clima só dos itens exibidos (bandeira e notas já vêm tratadas no view-model)
+    apply_item_weather(items)
 
-        # Calcula o valor convertido para BRL
-        converted = Decimal(expense.amount) * rate
-        converted = converted.quantize(Decimal('0.01'))  # Arredonda para 2 casas decimais
+    # 5. Financeiro: global da viagem (o resumo mostra o total da viagem, não só do dia)
+    totals = itinerary.totals
 
-        # Atribui ao atributo temporário (padronizado para 'converted_amount')
-        expense.converted_amount = converted
-
-        # Acumula nos totais convertidos
-        total_planned_brl += converted
-        if expense.is_paid:
-            total_paid_brl += converted
-
-    to_pay_brl = total_planned_brl - total_paid_brl
-
-    # 6. Cotações para Exibição (Baseado nos itens filtrados do dia)
-    detected_currencies = set()
-    for item in items:
-        if item.location_address:
-            currency_code = get_currency_by_country(item.location_address)
-            if currency_code and currency_code != 'BRL':
-                detected_currencies.add(currency_code)
-    
-    trip_rates = []
-    for currency in detected_currencies:
-        rate = rates_cache.get(currency) or get_exchange_rate(currency)
-        trip_rates.append({'code': currency, 'rate': rate})
+    # 6. Cotações para Exibição (Moedas locais distintas dos itens filtrados do dia)
+    trip_rates = currency_rates(items, itinerary.rates)
 
     # 7. Chave do Google Maps
-    google_maps_api_key = ''
-    try:
-        config = APIConfiguration.objects.filter(key='GOOGLE_MAPS_API', is_active=True).first()
-        if config:
-            google_maps_api_key = config.value
-    except Exception as e:
-        print(f"Erro ao buscar API Key: {e}")
+    google_maps_api_key = get_api_key('GOOGLE_MAPS_API') or ''
 
     context = {
         'trip': trip,
-        'total_planned': total_planned_brl,
-        'total_paid': total_paid_brl,
-        'to_pay': to_pay_brl,
+        'total_planned': totals['total'],
+        'total_paid': totals['paid'],
+        'to_pay': totals['to_pay'],
         'items': items,
         'available_dates': available_dates,
         'selected_date': selected_date,
-        'expenses': expenses,
+        'expenses': itinerary.expenses,
         'can_edit': can_edit,
         'user_role': user_role,
-        #'total_spent_brl': round(total_converted_brl, 2),
         'trip_rates': trip_rates,
-        'google_maps_api_key': google_maps_api_key
+        'google_maps_api_key': google_maps_api_key,
+        # Itens aguardando o 'geocode_worker' (a página consulta o status até zerar)
+        'geocode_pending': itinerary.geocode_pending,
     }
 
     return render(request, 'trips/trip_detail.html', context)
@@ -514,64 +251,20 @@ def trip_calendar(request, pk):
         print(f"--- INICIANDO VIEW TRIP_CALENDAR (PK={pk}) ---")
         
         # 1. Busca a Viagem
-        trip = get_object_or_404(
-            Trip, 
-            Q(pk=pk) & (Q(user=request.user) | Q(collaborators__user=request.user))
-        )
+        trip = get_object_or_404(Trip.objects.visible_to(request.user), pk=pk)
         user_role = trip.get_user_role(request.user)
         can_edit = (user_role == 'owner' or user_role == 'editor')
         
         print("--- VIAGEM ENCONTRADA, BUSCANDO ITENS ---")
 
-        # 2. Busca Itens
-        items = trip.items.all().order_by('start_datetime')
-        
-        # --- PRÉ-PROCESSAMENTO (LÓGICA DO TRIP_DETAIL) ---
-        # Isso garante que flag_code, weather e details estejam prontos
-        import ast
-        for item in items:
-            # A. Bandeira (Calculada dinamicamente)
-            item.flag_code = get_country_code_from_address(item.location_address)
-            
-            # B. Limpeza das Notas
-            if item.details:
-                raw = item.details
-                notes = ''
-                # Se for string, tenta converter
-                if isinstance(raw, str):
-                    try:
-                        raw = ast.literal_eval(raw)
-                    except: pass
-                
-                # Se for dict, extrai
-                if isinstance(raw, dict):
-                    notes = raw.get('notes', '')
-                    # Limpeza profunda de dict dentro de string
-                    if isinstance(notes, str) and notes.strip().startswith("{'notes'"):
-                        try:
-                            inner = ast.literal_eval(notes)
-                            if isinstance(inner, dict):
-                                notes = inner.get('notes', notes)
-                        except: pass
-                else:
-                    notes = str(raw) # Fallback
+        # 2. View-model do roteiro (itens com bandeira/notas tratadas, anexos e gastos em BRL)
+        itinerary = build_itinerary_context(trip)
+        items = itinerary.items
 
-                item.details = {'notes': notes}
-            
-            # C. Detectar Clima (Se necessário)
-            # Usa getattr para garantir que não quebre se o campo não existir no model
-            w_temp = getattr(item, 'weather_temp', None)
-            if item.location_address and item.start_datetime and not w_temp:
-                try:
-                    temp, cond, icon = fetch_weather_data(item.location_address, item.start_datetime)
-                    if temp:
-                        item.weather_temp = temp
-                        item.weather_condition = cond
-                        item.weather_icon = icon
-                        item.save() # Salva no banco se mudou
-                except Exception as e:
-                    print(f"Erro ao buscar clima calendar: {e}")
-        # -------------------------------------------------
+        try:
+            apply_item_weather(items)
+        except Exception as e:
+            print(f"Erro ao buscar clima calendar: {e}")
 
         # Prepara eventos JSON (Agora seguro pois os atributos existem)
         calendar_events = []
@@ -615,7 +308,7 @@ def trip_calendar(request, pk):
                 'lat': item.location_lat or '',
                 'lng': item.location_lng or '',
                 
-                # AGORA VAI FUNCIONAR: flag_code foi definido no loop anterior
+                # flag_code já vem preenchido pelo view-model (build_itinerary_context)
                 'flag': getattr(item, 'flag_code', ''), 
                 'reminder': item.reminder_hours > 0,
                 'weather_icon': w_icon,
@@ -636,70 +329,19 @@ def trip_calendar(request, pk):
         
         events_json = json.dumps(calendar_events, cls=DjangoJSONEncoder)
 
-        # --- 3. FINANCEIRO (PADRONIZADO COM O TRIP_DETAIL) ---
-        total_planned = Decimal(0)
-        total_paid = Decimal(0)
-        to_pay = Decimal(0)
-        expenses = []
-
-        try:
-            # 1. Trazemos para a memória com list() para o cálculo persistir no HTML
-            expenses = list(trip.expenses.all().order_by('-date'))
-            rates_cache = {}
-
-            for expense in expenses:
-                # 2. Obtém a taxa (Lógica idêntica ao trip_detail)
-                if expense.currency not in rates_cache:
-                    try:
-                        r = get_exchange_rate(expense.currency)
-                        # Força conversão para Decimal para evitar erros de cálculo
-                        rates_cache[expense.currency] = Decimal(str(r)) if r else Decimal(1)
-                    except:
-                        rates_cache[expense.currency] = Decimal(1)
-
-                rate = rates_cache[expense.currency]
-
-                # 3. Cálculo com precisão (quantize)
-                try:
-                    converted = Decimal(str(expense.amount)) * rate
-                    converted = converted.quantize(Decimal('0.01')) # Arredonda 2 casas
-                except:
-                    converted = Decimal(0)
-
-                # 4. ATRIBUIÇÃO CORRETA (Aqui estava o erro!)
-                # Estamos usando 'converted_amount' para ficar IGUAL ao trip_detail
-                expense.converted_amount = converted
+        # --- 3. FINANCEIRO (MESMO VIEW-MODEL DO TRIP_DETAIL) ---
+        # No calendário a lista de gastos vem do mais recente para o mais antigo
+        expenses = sorted(itinerary.expenses, key=lambda expense: expense.date, reverse=True)
+        totals = itinerary.totals
+        total_planned = totals['total']
+        total_paid = totals['paid']
+        to_pay = totals['to_pay']
 
-                # 5. Totais
-                total_planned += converted
-                if expense.is_paid:
-                    total_paid += converted
-
-            to_pay = total_planned - total_paid
-
-        except Exception as e:
-            print(f"Erro financeiro calendar: {e}")
-
-        # 4. Cotações e API Key
-        trip_rates = []
-        try:
-            cur_set = set()
-            for item in items:
-                if item.location_address:
-                    c = get_currency_by_country(item.location_address)
-                    if c and c != 'BRL': cur_set.add(c)
-            for c in cur_set:
-                r = rates_cache.get(c) or get_exchange_rate(c)
-                if r: trip_rates.append({'code': c, 'rate': r})
-        except: pass
+        # 4. Cotações das moedas locais dos itens
+        trip_rates = currency_rates(items, itinerary.rates)
 
         # API Key
-        google_maps_api_key = ''
-        try:
-            from .models import APIConfiguration
-            c = APIConfiguration.objects.filter(key='GOOGLE_MAPS_API', is_active=True).first()
-            if c: google_maps_api_key = c.value
-        except: pass
+        google_maps_api_key = get_api_key('GOOGLE_MAPS_API') or ''
 
         print("--- RENDERIZANDO TEMPLATE ---")
         context = {
@@ -731,42 +373,25 @@ def trip_calendar(request, pk):
 @login_required
 def trip_detail_pdf(request, pk):
     trip = get_object_or_404(Trip, pk=pk, user=request.user)
-    
-    # Busca itens ordenados
-    items = trip.items.all().order_by('start_datetime')
-    
-    # Busca e calcula gastos (para mostrar o total no PDF)
-    expenses = trip.expenses.all()
-    total_brl = 0
-    for expense in expenses:
-        # Cálculo simplificado para o PDF (idealmente usaria o cache como na view principal)
-        rate = get_exchange_rate(expense.currency)
-        total_brl += float(expense.amount) * rate
-
-    context = {
-        'trip': trip,
-        'items': items,
-        'expenses': expenses,
-        'total_brl': round(total_brl, 2),
-        'user': request.user,
-        'now': datetime.now()
-    }
-
-    # Renderiza o template PDF
-    template_path = 'trips/trip_pdf.html'
-    template = get_template(template_path)
-    html = template.render(context)
 
-    response = HttpResponse(content_type='application/pdf')
-    # 'attachment' baixa o arquivo, 'inline' abre no navegador
-    response['Content-Disposition'] = f'inline; filename="roteiro_{trip.id}.pdf"'
+    # PDF já gerado para este estado da viagem: só lê o arquivo. Senão, gera em segundo plano.
+    return pdf_response(
+        request, 'roteiro', trip.id, trip_pdf_fingerprint(trip, request.user),
+        lambda: build_trip_pdf_html(trip, request.user), filename=f"roteiro_{trip.id}.pdf"
+    )
 
-    pisa_status = pisa.CreatePDF(html, dest=response)
+#--- VIEW PARA EXPORTAR OS PDFs DE TODAS AS VIAGENS (ZIP) ---
+@login_required
+def trip_export_pdfs(request):
+    # Mesma regra do PDF individual: só as viagens das quais o usuário é dono
+    trips = list(Trip.objects.filter(user=request.user).order_by('start_date'))
+    if not trips:
+        messages.info(request, "Você ainda não tem viagens para exportar.")
+        return redirect('trip_list')
 
-    if pisa_status.err:
-        return HttpResponse('Erro ao gerar PDF')
-    
-    return response
+    # Gerado em segundo plano: a página "gerando..." recarrega até o zip ficar pronto
+    filename = f"roteiros_{request.user.username}_{timezone.localdate():%Y%m%d}.zip"
+    return export_zip_response(request, trips, filename)
 
 #--- VIEWS PARA CRIAR ITENS DE VIAGEM (TRIP ITEM) ---
 @login_required
@@ -789,29 +414,8 @@ def trip_item_create(request, trip_id):
                 item.details = {'notes': raw_notes}
             # --------------------------
 
-            # --- INÍCIO DA CORREÇÃO (GEOCODING NA CRIAÇÃO) ---
-            if item.location_address:
-                try:
-                    # 1. Busca a chave no Banco de Dados
-                    config = APIConfiguration.objects.get(key='GOOGLE_MAPS_API')
-                    
-                    # 2. Conecta no Google Maps
-                    gmaps = googlemaps.Client(key=config.value)
-                    
-                    # 3. Converte Endereço -> Lat/Lng
-                    geocode_result = gmaps.geocode(item.location_address)
-                    
-                    if geocode_result:
-                        location = geocode_result[0]['geometry']['location']
-                        item.location_lat = location['lat']
-                        item.location_lng = location['lng']
-                        print(f"Geocoding Create Sucesso: {item.location_lat}, {item.location_lng}")
-                        
-                except APIConfiguration.DoesNotExist:
-                    print("ERRO: Chave GOOGLE_MAPS_API não cadastrada no banco.")
-                except Exception as e:
-                    print(f"Erro no Geocoding (Create): {e}")
-            # --- FIM DA CORREÇÃO ---
+            # Geocoding: o save() usa o cache de endereços ou coloca o item na fila
+            # (comando 'geocode_worker'), sem esperar o Google.
 
             item.save()
             messages.success(request, "Item adicionado com sucesso!")
@@ -879,29 +483,13 @@ def trip_expense_create(request, trip_id):
 def trip_expense_toggle_paid(request, pk):
     expense = get_object_or_404(Expense, pk=pk)
     expense.is_paid = not expense.is_paid # Inverte o status
-    expense.save()
-    
-    # Recalcula os totais da viagem para atualizar a tela dinamicamente
-    trip = expense.trip
-    expenses = trip.expenses.all()
-    
-    total_planned_brl = Decimal('0.00')
-    total_paid_brl = Decimal('0.00')
-    rates_cache = {}
+    expense.save(update_fields=['is_paid']) # Não recalcula a conversão
     
-    for exp in expenses:
-        if exp.currency not in rates_cache:
-            rates_cache[exp.currency] = get_exchange_rate(exp.currency)
-
-        rate = Decimal(str(rates_cache[exp.currency]))
-        converted = Decimal(exp.amount) * rate
-        converted = converted.quantize(Decimal('0.01'))
-
-        total_planned_brl += converted
-        if exp.is_paid:
-            total_paid_brl += converted
-
-    to_pay_brl = total_planned_brl - total_paid_brl
+    # Recalcula os totais da viagem com uma única query (SUM sobre o valor já convertido)
+    totals = Expense.objects.filter(trip_id=expense.trip_id).brl_totals()
+    total_planned_brl = totals['total']
+    total_paid_brl = totals['paid']
+    to_pay_brl = totals['to_pay']
     
     return JsonResponse({
         'is_paid': expense.is_paid,
@@ -950,10 +538,11 @@ def trip_delete(request, pk):
 @login_required
 def trip_item_update(request, pk):
     item = get_object_or_404(TripItem, pk=pk)
-    trip = item.trip
+    # Viagem já com o papel do usuário (uma query só)
+    trip = Trip.objects.with_user_role(request.user).get(pk=item.trip_id)
     
-    # Verifica permissão
-    if trip.user != request.user and trip.get_user_role(request.user) != 'editor':
+    # Verifica permissão (dono ou editor)
+    if not trip.can_edit(request.user):
          messages.error(request, "Sem permissão para editar este item.")
          return redirect('trip_detail', pk=trip.id)
 
@@ -995,36 +584,19 @@ def trip_item_update(request, pk):
             # 3. Salva no formato JSON correto
             updated_item.details = {'notes': clean_text}
             
-            # --- INÍCIO DA CORREÇÃO (GEOCODING NA EDIÇÃO) ---
+            # --- GEOCODING NA EDIÇÃO ---
             # Pegamos o item original do banco para comparar se o endereço mudou
             original_item = TripItem.objects.get(pk=pk)
             
-            address_changed = updated_item.location_address != original_item.location_address
-            missing_coords = not updated_item.location_lat or not updated_item.location_lng
-            
-            # Só consome a API se o endereço mudou ou se não tem coordenadas salvas
-            if updated_item.location_address and (address_changed or missing_coords):
-                try:
-                    # 1. Busca a chave no Banco de Dados
-                    config = APIConfiguration.objects.get(key='GOOGLE_MAPS_API')
-                    
-                    # 2. Conecta no Google Maps
-                    gmaps = googlemaps.Client(key=config.value)
-                    
-                    # 3. Converte Endereço -> Lat/Lng
-                    geocode_result = gmaps.geocode(updated_item.location_address)
-                    
-                    if geocode_result:
-                        location = geocode_result[0]['geometry']['location']
-                        updated_item.location_lat = location['lat']
-                        updated_item.location_lng = location['lng']
-                        print(f"Geocoding Update Sucesso: {updated_item.location_lat}, {updated_item.location_lng}")
-                        
-                except APIConfiguration.DoesNotExist:
-                    print("ERRO: Chave GOOGLE_MAPS_API não cadastrada no banco.")
-                except Exception as e:
-                    print(f"Erro no Geocoding (Update): {e}")
-            # --- FIM DA CORREÇÃO ---
+            # Endereço mudou: descarta as coordenadas antigas para o save() localizar de novo
+            # (pelo cache de endereços ou pela fila do 'geocode_worker')
+            if updated_item.location_address != original_item.location_address:
+                updated_item.location_lat = None
+                updated_item.location_lng = None
+                updated_item.country_code = ''
+                if not updated_item.location_address:
+                    updated_item.geocode_status = ''
+            # ---------------------------
 
             updated_item.save()
             messages.success(request, "Item atualizado com sucesso.")
@@ -1233,10 +805,10 @@ def trip_generate_itinerary(request, trip_id):
 @login_required
 def trip_generate_insights(request, trip_id): # 
     # Busca a viagem usando o trip_id recebido da URL
-    trip = get_object_or_404(Trip, pk=trip_id)
+    trip = get_object_or_404(Trip.objects.with_user_role(request.user), pk=trip_id)
     
-    # Verifica permissão
-    if trip.user != request.user and trip.get_user_role(request.user) != 'editor':
+    # Verifica permissão (dono ou editor)
+    if not trip.can_edit(request.user):
         messages.error(request, "Você não tem permissão para atualizar as dicas.")
         # Redireciona usando pk=trip_id (pois a url de detalhe provavelmente espera pk)
         return redirect('trip_detail', pk=trip_id)
@@ -1252,77 +824,66 @@ def trip_generate_insights(request, trip_id): #
     return redirect('trip_detail', pk=trip_id)
 
 # --- VIEWS PARA FINANCIAL ---
+EXPENSES_PER_PAGE = 50 # Linhas por página na tabela de gastos
+
 @login_required
+@read_replica
 def financial_dashboard(request):
-    # 1. Busca ÚNICA e Otimizada
-    # Trazemos 'trip' e 'item' para não travar o banco na hora de gerar a tabela
-    all_expenses = Expense.objects.filter(
-        trip__user=request.user
-    ).select_related('trip', 'item').order_by('-date')
-    
-    # 2. Inicialização de Variáveis
-    total_global_brl = 0
-    total_year_brl = 0  # Variável para o novo Widget
+    # 1. Base da consulta: todos os gastos do usuário
+    # Conversão, somas e agrupamentos são feitos pelo BANCO (SUM/GROUP BY),
+    # então o tempo de resposta não cresce com o número de gastos.
+    rates = get_exchange_rates()
+    user_expenses = Expense.objects.filter(trip__user=request.user)
 
     # Garante que pegamos o ano certo (inteiro)
     current_year = timezone.now().year # Pega o ano atual (ex: 2025)
-    
-    expenses_by_category = defaultdict(float)
-    expenses_by_trip = defaultdict(float)
-    rates_cache = {}
-
-    # 3. Loop Único (Processa Tabela, Gráficos e Widgets ao mesmo tempo)
-    for expense in all_expenses:
-        # --- Conversão de Moeda ---
-        if expense.currency not in rates_cache:
-            rates_cache[expense.currency] = get_exchange_rate(expense.currency)
-            
-        rate = rates_cache[expense.currency]
-        
-        # CÁLCULO CRÍTICO: Valor * Taxa
-        val_brl = float(expense.amount) * rate
-        val_brl = round(val_brl, 2)
-        
-    #    # Debug no Terminal: Mostra o que está acontecendo com cada gasto
-    #    print(f"Item: {expense.description} | Moeda: {expense.currency} | Valor: {expense.amount} | Taxa: {rate} | Convertido: {val_brl}")
 
-        # Salva no objeto para exibir na Tabela (coluna R$)
-        expense.converted_value = val_brl
-        
-        # --- SOMAS (Acumuladores) ---
-        
-        # 1. Soma Global (Tudo desde sempre)
-        total_global_brl += val_brl
-        
-        # Total do Ano Atual (NOVO)
-        if expense.date.year == current_year:
-            total_year_brl += val_brl
+    # 2. Widgets / KPIs (uma única query)
+    summary = user_expenses.with_brl(rates).aggregate(
+        total=Sum('brl_amount'),
+        total_year=Sum('brl_amount', filter=Q(date__year=current_year)),
+        count=Count('id'),
+    )
+    total_global_brl = summary['total'] or Decimal('0')
+    total_year_brl = summary['total_year'] or Decimal('0')
+
+    # 3. Dados para Gráficos (GROUP BY no banco)
+    by_category = user_expenses.brl_summary('category')
+    by_trip = user_expenses.brl_summary('trip_id', 'trip__title')
+
+    cat_labels = [row['category'] for row in by_category]
+    cat_data = [round(float(row['total']), 2) for row in by_category]
 
-        # Dados para Gráficos
-        expenses_by_category[expense.category] += val_brl
-        expenses_by_trip[expense.trip.title] += val_brl
+    trip_labels = [row['trip__title'] for row in by_trip]
+    trip_data = [round(float(row['total']), 2) for row in by_trip]
 
-    # 4. Preparação dos Gráficos
-    cat_labels = list(expenses_by_category.keys())
-    cat_data = [round(v, 2) for v in expenses_by_category.values()]
+    # 4. Tabela paginada (filtro por viagem feito no servidor)
+    table_expenses = user_expenses.select_related('trip', 'item').with_brl(rates).order_by('-date', '-id')
+
+    selected_trip_id = request.GET.get('trip')
+    if selected_trip_id:
+        try:
+            table_expenses = table_expenses.filter(trip_id=int(selected_trip_id))
+            table_total = user_expenses.filter(trip_id=int(selected_trip_id)).brl_totals()['total']
+        except ValueError:
+            selected_trip_id = None
+    if not selected_trip_id:
+        table_total = total_global_brl
 
-    trip_labels = list(expenses_by_trip.keys())
-    trip_data = [round(v, 2) for v in expenses_by_trip.values()]
+    paginator = Paginator(table_expenses, EXPENSES_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('page'))
 
     # Adicione esta linha para popular o dropdown
     all_trips = Trip.objects.filter(user=request.user).order_by('-start_date')
 
     # --- [NOVO] Adicione esta linha para pegar a cotação ---
-    try:
-        usd_rate = get_exchange_rate('USD')
-    except:
-        usd_rate = 0.0
+    usd_rate = rates['USD']
     # -------------------------------------------------------
 
     context = {
         # Widgets / KPIs
         'total_global': total_global_brl,
-        'expense_count': all_expenses.count(),
+        'expense_count': summary['count'],
         'total_year': total_year_brl,
         'current_year': current_year,
         
@@ -1331,7 +892,10 @@ def financial_dashboard(request):
         # ----------------------------------------------
         
         'all_trips': all_trips,
-        'all_expenses': all_expenses,
+        'all_expenses': page_obj,
+        'page_obj': page_obj,
+        'selected_trip_id': selected_trip_id,
+        'table_total': table_total,
         
         # Gráficos (JSON)
         'cat_labels': json.dumps(cat_labels),
@@ -1355,8 +919,6 @@ def financial_chart_api(request):
             expenses = expenses.filter(trip_id=int(trip_id))
         except ValueError:
             pass 
-            
-    stats = defaultdict(float)
     
     # --- CORREÇÃO BLINDADA AQUI ---
     # Tenta pegar as escolhas do campo. Se não tiver, cria um dicionário vazio.
@@ -1370,29 +932,18 @@ def financial_chart_api(request):
         choices = {}
     # ------------------------------
     
-    for expense in expenses:
-        # Tratamento de erro na conversão de moeda
-        try:
-            rate = get_exchange_rate(expense.currency)
-        except:
-            rate = 1.0
-            
-        val_brl = float(expense.amount) * rate
-        stats[expense.category] += val_brl
-
-    # Ordena
-    sorted_stats = sorted(stats.items(), key=lambda x: x[1], reverse=True)
-    
+    # 2. Soma por categoria feita no banco (já ordenada do maior para o menor)
     labels = []
     data = []
     
-    for cat_code, val in sorted_stats:
+    for row in expenses.brl_summary('category'):
         # Se existir no dicionário de choices, usa o nome bonito.
         # Se não existir (ou choices for vazio), usa o próprio código/texto salvo.
+        cat_code = row['category']
         cat_name = str(choices.get(cat_code, cat_code))
         
         labels.append(cat_name)
-        data.append(round(val, 2))
+        data.append(round(float(row['total']), 2))
         
     return JsonResponse({
         'labels': labels,
@@ -1447,17 +998,49 @@ def expense_delete(request, pk):
 
 # --- VIEWS GOOGLE MAPS ---
 @login_required
-def fix_locations(request):
-    # Pega todos os itens que têm endereço mas não têm latitude
-    items = TripItem.objects.filter(location_address__isnull=False, location_lat__isnull=True)
+def trip_geocode_status(request, trip_id):
+    """
+    Status da fila de Geocoding da viagem (consultado pela página da viagem via AJAX).
+    Retorna quantos itens ainda aguardam o worker e as coordenadas dos já localizados.
+    """
+    trip = get_object_or_404(Trip.objects.visible_to(request.user), pk=trip_id)
+
+    items = trip.items.exclude(geocode_status='').values('id', 'geocode_status', 'location_lat', 'location_lng')
 
-    count = 0
+    pending = 0
+    located = []
     for item in items:
-        # Ao chamar .save(), a lógica nova do models.py será executada automaticamente
-        item.save()
-        count += 1
+        if item['geocode_status'] in TripItem.GEOCODE_QUEUED:
+            pending += 1
+        elif item['geocode_status'] == TripItem.GEOCODE_DONE and item['location_lat'] is not None:
+            located.append({
+                'id': item['id'],
+                'lat': float(item['location_lat']),
+                'lng': float(item['location_lng']),
+            })
+
+    return JsonResponse({'pending': pending, 'located': located})
+
+@login_required
+def fix_locations(request):
+    """
+    Coloca na fila do 'geocode_worker' os itens com endereço e sem coordenadas.
+    Não geocodifica dentro do request (com muitos itens dava timeout);
+    para um reprocessamento grande use o comando 'regeocode_items'.
+    """
+    if not request.user.is_superuser:
+        messages.error(request, "Acesso não autorizado.")
+        return redirect('home')
 
-    print(f"{count} itens atualizados com coordenadas.")
+    count = (
+        TripItem.objects
+        .exclude(location_address__isnull=True).exclude(location_address='')
+        .filter(location_lat__isnull=True)
+        .exclude(geocode_status__in=TripItem.GEOCODE_QUEUED)
+        .update(geocode_status=TripItem.GEOCODE_PENDING, geocode_attempts=0)
+    )
+
+    messages.success(request, f"{count} itens enviados para a fila de localização.")
     return redirect('home')
 
 # --- CHECKLIST ---
@@ -1571,90 +1154,95 @@ def checklist_pdf(request, trip_id):
     """Gera o PDF do Checklist"""
     trip = get_object_or_404(Trip, pk=trip_id, user=request.user)
     checklist, _ = Checklist.objects.get_or_create(trip=trip)
-    
-    # Reutilizamos a lógica de agrupar por categoria
-    items_by_category = {}
-    items = checklist.items.all().order_by('category', 'item')
-    
-    for item in items:
-        if item.category not in items_by_category:
-            items_by_category[item.category] = []
-        items_by_category[item.category].append(item)
-
-    context = {
-        'trip': trip,
-        'items_by_category': items_by_category,
-        'user': request.user,
-    }
 
-    # Renderiza o template HTML específico para PDF
-    template_path = 'trips/checklist_pdf.html'
-    template = get_template(template_path)
-    html = template.render(context)
+    def build_html():
+        # Reutilizamos a lógica de agrupar por categoria
+        items_by_category = {}
+        items = checklist.items.all().order_by('category', 'item')
+        
+        for item in items:
+            if item.category not in items_by_category:
+                items_by_category[item.category] = []
+            items_by_category[item.category].append(item)
 
-    # Cria o PDF
-    response = HttpResponse(content_type='application/pdf')
-    # Se quiser que baixe direto, mude 'inline' para 'attachment'
-    response['Content-Disposition'] = f'inline; filename="checklist_{trip.id}.pdf"'
+        context = {
+            'trip': trip,
+            'items_by_category': items_by_category,
+            'user': request.user,
+        }
 
-    pisa_status = pisa.CreatePDF(html, dest=response)
+        # Renderiza o template HTML específico para PDF
+        return get_template('trips/checklist_pdf.html').render(context)
 
-    if pisa_status.err:
-        return HttpResponse('Erro ao gerar PDF <pre>' + html + '</pre>')
-    
-    return response
+    return pdf_response(
+        request, 'checklist', trip.id, checklist_pdf_fingerprint(trip, checklist, request.user),
+        build_html, filename=f"checklist_{trip.id}.pdf"
+    )
 
 # --- VIEW DE IMPORTAÇÃO/ EXPORTAÇÃO GOOGLE CALENDER ---
 # --- EXPORTAR PARA CALENDAR (.ICS) ---
+def _trip_ics_etag(request, trip_id):
+    """ETag do .ics: muda quando a viagem ou algum item é criado, alterado ou excluído."""
+    trip = Trip.objects.visible_to(request.user).filter(pk=trip_id).values('id', 'updated_at').first()
+    if trip is None:
+        return None  # A view responde 404
+    changed, count = items_state(TripItem.objects.filter(trip_id=trip_id))
+    return ics_etag('trip', trip['id'], trip['updated_at'], changed, count)
+
 @login_required
+@condition(etag_func=_trip_ics_etag)
 def trip_export_ics(request, trip_id):
-    trip = get_object_or_404(Trip, pk=trip_id)
-    
-    # Cria o Calendário
-    cal = Calendar()
-    cal.add('prodid', '-//Travel Manager//carlosviola.com//')
-    cal.add('version', '2.0')
-    
-    items = trip.items.all()
-    
-    for item in items:
-        if item.start_datetime:
-            event = ICalEvent()
-            event.add('summary', f"✈️ {item.name}")
-            
-            # Descrição: Junta notas e link
-            description = ""
-            if item.link:
-                description += f"Link: {item.link}\n"
-            
-            # Tenta extrair texto limpo das notas (usando sua função ou acessando direto)
-            notes = item.details.get('notes', '') if isinstance(item.details, dict) else str(item.details)
-            if notes:
-                description += f"Notas: {notes}"
-                
-            event.add('description', description)
-            
-            # Localização
-            if item.location_address:
-                event.add('location', item.location_address)
-            
-            # Data de Início
-            event.add('dtstart', item.start_datetime)
-            
-            # Data de Fim (Se não tiver, assume 1 hora de duração)
-            if item.end_datetime:
-                event.add('dtend', item.end_datetime)
-            else:
-                event.add('dtend', item.start_datetime + timedelta(hours=1))
-            
-            event.add('dtstamp', datetime.now())
-            cal.add_component(event)
+    # Mesmo acesso da tela da viagem (dono ou colaborador)
+    trip = get_object_or_404(Trip.objects.visible_to(request.user), pk=trip_id)
 
-    # Gera o arquivo para download
-    response = HttpResponse(cal.to_ical(), content_type="text/calendar")
+    # Gerado item a item enquanto é enviado; com o ETag igual, o decorator já respondeu 304
+    response = StreamingHttpResponse(stream_ics(trip.items.all(), trip.title), content_type=ICS_CONTENT_TYPE)
     response['Content-Disposition'] = f'attachment; filename="trip_{trip.id}.ics"'
     return response
 
+# --- ASSINATURA DA AGENDA (LINK .ICS COM TOKEN) ---
+def _feed_links(request, feed):
+    url = request.build_absolute_uri(reverse('calendar_feed', args=[feed.token]))
+    return {'url': url, 'webcal': 'webcal://' + url.split('://', 1)[1]}
+
+@login_required
+def trip_calendar_feed(request, trip_id):
+    """Mostra (e permite trocar) os links de assinatura: desta viagem e de todas as viagens."""
+    trip = get_object_or_404(Trip.objects.visible_to(request.user), pk=trip_id)
+
+    if request.method == 'POST':
+        scope_trip = trip if request.POST.get('scope') == 'trip' else None
+        CalendarFeedToken.for_user(request.user, scope_trip).rotate()
+        messages.success(request, "Novo link gerado. O link antigo parou de funcionar.")
+        return redirect('trip_calendar_feed', trip_id=trip.id)
+
+    context = {
+        'trip': trip,
+        'feeds': [
+            (_feed_links(request, CalendarFeedToken.for_user(request.user, trip)), f"Somente {trip.title}", 'trip'),
+            (_feed_links(request, CalendarFeedToken.for_user(request.user)), "Todas as minhas viagens", 'all'),
+        ],
+    }
+    return render(request, 'trips/calendar_feed.html', context)
+
+@require_safe
+def calendar_feed(request, token):
+    """
+    Feed .ics público (o token é a autenticação) consultado pelo Google/Apple Calendar.
+    Token e conteúdo vêm do cache: polls repetidos não tocam no banco.
+    """
+    feed = get_feed(token)
+    if feed is None:
+        raise Http404("Link de agenda inválido ou revogado.")
+
+    etag, body = feed
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type=ICS_CONTENT_TYPE)
+    response['ETag'] = etag
+    return response
+
 # --- IMPORTAR DO CALENDAR (.ICS) ---
 @login_required
 def trip_import_ics(request, trip_id):
@@ -1773,22 +1361,16 @@ def profile_view(request):
     # Enviamos o form de senha vazio para ser renderizado no modal
     password_form = CustomPasswordChangeForm(user)
 
-    # 2. LÓGICA DAS BANDEIRAS (NOVO)
-    # Buscamos todas as viagens do usuário e já trazemos os itens juntos (prefetch) para ser rápido
-    user_trips = Trip.objects.filter(user=request.user).prefetch_related('items')
-    
-    visited_flags = set() # Usamos um Set para não repetir bandeiras
-    
-    for trip in user_trips:
-        for item in trip.items.all():
-            if item.location_address:
-                # Reutiliza sua função existente que extrai 'br', 'us', 'fr' do endereço
-                code = get_country_code_from_address(item.location_address)
-                if code:
-                    visited_flags.add(code)
-    
-    # Ordena as bandeiras alfabeticamente para ficar bonito na tela
-    visited_flags = sorted(list(visited_flags))
+    # 2. LÓGICA DAS BANDEIRAS
+    # Países distintos de todos os itens das viagens do usuário (TripItem.country_code),
+    # já ordenados alfabeticamente, numa única query
+    visited_flags = list(
+        TripItem.objects.filter(trip__user=request.user)
+        .exclude(country_code='')
+        .order_by('country_code')
+        .values_list('country_code', flat=True)
+        .distinct()
+    )
 
     context = {
         'form': form if 'form' in locals() else None, # Ajuste conforme sua view
@@ -1945,10 +1527,10 @@ def trip_gallery(request, trip_id):
 @login_required
 def trip_photo_delete(request, photo_id):
     photo = get_object_or_404(TripPhoto, pk=photo_id)
-    trip = photo.trip
+    trip = Trip.objects.with_user_role(request.user).get(pk=photo.trip_id)
     
-    # Segurança: Só permite deletar se tiver acesso à trip
-    if trip.user != request.user and trip.get_user_role(request.user) != 'editor':
+    # Segurança: Só permite deletar se for dono ou editor da trip
+    if not trip.can_edit(request.user):
         messages.error(request, "Sem permissão.")
         return redirect('trip_gallery', trip_id=trip.id)
 
@@ -1964,7 +1546,7 @@ def is_admin(user):
 @login_required
 @user_passes_test(is_admin) # Só passa se for admin
 def user_list(request):
-    users = User.objects.all().order_by('username')
+    users = User.objects.prefetch_related('groups').order_by('username')
     return render(request, 'users/user_list.html', {'users': users})
 
 @login_required
@@ -2033,14 +1615,15 @@ def email_settings_view(request):
                     )
                     
                     # Tenta enviar um e-mail simples
-                    send_mail(
-                        subject='Teste de Configuração - TravelManager',
-                        message='Se você recebeu este e-mail, a configuração SMTP está funcionando corretamente!',
-                        from_email=config_instance.default_from_email,
-                        recipient_list=[request.user.email],
-                        connection=connection,
-                        fail_silently=False,
-                    )
+                    with upstream_call('smtp'):
+                        send_mail(
+                            subject='Teste de Configuração - TravelManager',
+                            message='Se você recebeu este e-mail, a configuração SMTP está funcionando corretamente!',
+                            from_email=config_instance.default_from_email,
+                            recipient_list=[request.user.email],
+                            connection=connection,
+                            fail_silently=False,
+                        )
                     messages.success(request, f"Configurações salvas e e-mail de teste enviado para {request.user.email}!")
                 except Exception as e:
                     messages.error(request, f"Configuração salva, mas o teste falhou: {str(e)}")
@@ -2056,8 +1639,9 @@ def email_settings_view(request):
 # --- VIEW DE LOGS DE ACESSO (SOMENTE ADMIN) ---
 @login_required
 @user_passes_test(is_admin)
+@read_replica
 def access_logs_view(request):
-    logs = AccessLog.objects.all()
+    logs = AccessLog.objects.select_related('user')
     
     # --- FILTRO POR USUÁRIO (NOVO) ---
     target_user_id = request.GET.get('user_id')
@@ -2118,10 +1702,10 @@ def about_view(request):
 # ==========================================
 @login_required
 def trip_notes_list(request, trip_id):
-    trip = get_object_or_404(Trip, pk=trip_id)
+    trip = get_object_or_404(Trip.objects.with_user_role(request.user), pk=trip_id)
     
-    # Verifica permissão
-    if trip.user != request.user and trip.get_user_role(request.user) is None:
+    # Verifica permissão (dono ou colaborador)
+    if trip.get_user_role(request.user) is None:
         messages.error(request, "Acesso negado a esta viagem.")
         return redirect('dashboard')
 
@@ -2156,10 +1740,10 @@ def trip_note_create(request, trip_id):
 @login_required
 def trip_note_update(request, note_id):
     note = get_object_or_404(TripNote, pk=note_id)
-    trip = note.trip
+    trip = Trip.objects.with_user_role(request.user).get(pk=note.trip_id)
     
-    # Verificação de segurança simplificada (dono ou colaborador)
-    if trip.user != request.user and trip.get_user_role(request.user) != 'editor':
+    # Verificação de segurança simplificada (dono ou editor)
+    if not trip.can_edit(request.user):
         messages.error(request, "Sem permissão para editar esta nota.")
         return redirect('trip_notes_list', trip_id=trip.id)
 
@@ -2181,9 +1765,10 @@ def trip_note_update(request, note_id):
 @login_required
 def trip_note_delete(request, note_id):
     note = get_object_or_404(TripNote, pk=note_id)
-    trip_id = note.trip.id
+    trip_id = note.trip_id
+    trip = Trip.objects.with_user_role(request.user).get(pk=trip_id)
     
-    if note.trip.user == request.user or note.trip.get_user_role(request.user) == 'editor':
+    if trip.can_edit(request.user):
         note.delete()
         messages.success(request, "Nota excluída.")
     else:
@@ -2196,7 +1781,7 @@ def trip_note_delete(request, note_id):
 def trip_note_ai_generate(request, trip_id):
     import sys
     import requests
-    from .models import Trip, TripNote, APIConfiguration 
+    from .models import Trip, TripNote
     
     sys.stderr.write(f">>> [DEBUG] Iniciando AI para Trip ID: {trip_id}\n")
     
@@ -2211,20 +1796,12 @@ def trip_note_ai_generate(request, trip_id):
             messages.warning(request, "Digite o que deseja pesquisar.")
             return redirect('trip_notes_list', trip_id=trip.id)
 
-        # --- CORREÇÃO AQUI ---
-        # Buscamos a linha específica onde key='OPENAI_API'
-        try:
-            # Tenta pegar a configuração ativa da OpenAI
-            api_config = APIConfiguration.objects.get(key='OPENAI_API', is_active=True)
-            openai_key = api_config.value # O valor da chave está no campo 'value'
-        except APIConfiguration.DoesNotExist:
+        # Chave ativa da OpenAI (cache de configurações)
+        openai_key = get_api_key('OPENAI_API')
+        if not openai_key:
             sys.stderr.write(">>> [ERRO] Chave OPENAI_API não encontrada ou inativa.\n")
             messages.error(request, "Chave OpenAI não cadastrada ou inativa nas Configurações de API.")
             return redirect('trip_notes_list', trip_id=trip.id)
-        except Exception as e:
-            sys.stderr.write(f">>> [ERRO] Falha ao buscar chave: {e}\n")
-            messages.error(request, "Erro ao buscar configuração de API.")
-            return redirect('trip_notes_list', trip_id=trip.id)
 
         # 3. Prepara a chamada (agora usando a variável openai_key correta)
         headers = {
@@ -2248,12 +1825,15 @@ def trip_note_ai_generate(request, trip_id):
         }
 
         # 4. Request
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions", 
-            headers=headers, 
-            json=payload, 
-            timeout=20
-        )
+        with upstream_call('openai') as call:
+            response = requests.post(
+                "https://api.openai.com/v1/chat/completions", 
+                headers=headers, 
+                json=payload, 
+                timeout=20
+            )
+            if response.status_code != 200:
+                call.outcome = 'error'
         
         if response.status_code == 200:
             data = response.json()
@@ -2282,3 +1862,21 @@ def trip_note_ai_generate(request, trip_id):
         messages.error(request, "Erro interno ao processar IA.")
 
     return redirect('trip_notes_list', trip_id=trip_id)
+
+# --- VIEW DE MÉTRICAS (PROMETHEUS) ---
+def metrics_view(request):
+    """
+    Métricas no formato do Prometheus: tempo por view, chamadas externas e acertos de cache.
+    Com METRICS_TOKEN configurado, exige 'Authorization: Bearer <token>'
+    (nunca na URL, que vai parar nos logs); sem token, só superusuários logados podem ver.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, sent = request.headers.get('Authorization', '').partition(' ')
+        allowed = scheme == 'Bearer' and hmac.compare_digest(sent.strip().encode(), token.encode())
+    else:
+        allowed = request.user.is_authenticated and request.user.is_superuser
+
+    if not allowed:
+        return HttpResponse('Acesso negado.', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')